@@ -0,0 +1,197 @@
+"""
+Vectorised activity analytics over stored streams.
+
+All functions work on a whole batch of activities at once: the per-activity
+streams are concatenated into flat arrays, each activity is shifted so that
+no window can span two activities, and per-activity results are pulled back
+out with segment offsets. A season of activities is processed with a handful
+of NumPy calls instead of a Python loop per sample.
+
+The module imports NumPy at import time, so the app only imports it when
+there are streams to analyse.
+"""
+
+import numpy as np
+
+SPLIT_DISTANCE_M = 1000
+BEST_EFFORT_DISTANCES_M = {"best_1k": 1000, "best_5k": 5000, "best_10k": 10000}
+
+# Heart-rate zones as fractions of maximum heart rate (lower bounds of Z2..Z5)
+HR_ZONE_FRACTIONS = (0.6, 0.7, 0.8, 0.9)
+# Gaps between samples longer than this (auto-pause, recording stops) are not
+# counted as time in a heart-rate zone. Missing samples are stored as NaN and
+# never count either.
+MAX_SAMPLE_GAP_S = 30
+
+
+def format_seconds(seconds):
+    """Format a duration as mm:ss, or h:mm:ss from one hour up"""
+    seconds = int(round(seconds))
+    hours, remainder = divmod(seconds, 3600)
+    minutes, secs = divmod(remainder, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+
+def _concatenate(streams_list, key, dtype):
+    """Concatenate one stream across activities; returns (flat array, segment starts, lengths)"""
+    arrays = [np.asarray(s[key], dtype=dtype) for s in streams_list]
+    lengths = np.array([len(a) for a in arrays], dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    flat = np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+    return flat, starts, lengths
+
+
+def _batched_time_distance(streams_list):
+    """Flat time/distance arrays with every activity shifted past the previous one.
+
+    Each activity is offset in distance by the previous totals plus a gap
+    larger than any effort distance, and in time by the previous totals, so
+    interpolation over the flat arrays never mixes two activities.
+    """
+    time, starts, lengths = _concatenate(streams_list, "time", np.float64)
+    distance, _, _ = _concatenate(streams_list, "distance", np.float64)
+    # A missing distance sample becomes 0 and is lifted to the previous
+    # sample's distance by the running maximum below
+    distance = np.nan_to_num(distance, nan=0.0)
+    segment_ids = np.repeat(np.arange(len(lengths)), lengths)
+    totals_d = np.zeros(len(lengths))
+    totals_t = np.zeros(len(lengths))
+    if not len(time):
+        return time, distance, segment_ids, totals_d, totals_d
+
+    # Make every activity start at zero distance and zero elapsed time
+    nonempty = lengths > 0
+    first = np.zeros(len(lengths), dtype=np.int64)
+    first[nonempty] = starts[nonempty]
+    distance = distance - distance[first][segment_ids]
+    time = time - time[first][segment_ids]
+    totals_d[nonempty] = np.maximum.reduceat(distance, starts[nonempty])
+    totals_t[nonempty] = np.maximum.reduceat(time, starts[nonempty])
+
+    gap = max(BEST_EFFORT_DISTANCES_M.values()) + 1
+    offset_d = np.concatenate(([0.0], np.cumsum(totals_d + gap)[:-1]))
+    offset_t = np.concatenate(([0.0], np.cumsum(totals_t + 1)[:-1]))
+    # Streams occasionally step backwards by a few centimetres; interpolation
+    # needs a non-decreasing x axis. The offsets keep each activity above the
+    # previous one, so a single running maximum is enough.
+    distance = np.maximum.accumulate(distance + offset_d[segment_ids])
+    return time + offset_t[segment_ids], distance, segment_ids, offset_d, totals_d
+
+
+def batch_splits(streams_list, split_m=SPLIT_DISTANCE_M):
+    """Seconds taken for every full split (default 1 km) of each activity"""
+    if not streams_list:
+        return []
+    time, distance, _, offset_d, totals_d = _batched_time_distance(streams_list)
+    if not len(time):
+        return [[] for _ in streams_list]
+
+    # Split marks 0, 1000, 2000, ... for every activity, as one flat array
+    counts = (totals_d // split_m).astype(np.int64) + 1
+    mark_segments = np.repeat(np.arange(len(counts)), counts)
+    mark_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    local_index = np.arange(counts.sum()) - np.repeat(mark_starts, counts)
+    marks = offset_d[mark_segments] + local_index * split_m
+
+    times_at_marks = np.interp(marks, distance, time)
+    split_times = np.diff(times_at_marks)
+    # Drop the differences that span from one activity's last mark to the next one's start
+    same_activity = mark_segments[1:] == mark_segments[:-1]
+    split_segments = mark_segments[1:][same_activity]
+    split_times = split_times[same_activity]
+
+    boundaries = np.searchsorted(split_segments, np.arange(1, len(streams_list)))
+    return [[float(s) for s in chunk] for chunk in np.split(split_times, boundaries)]
+
+
+def batch_best_efforts(streams_list, distances=BEST_EFFORT_DISTANCES_M):
+    """Fastest time over each effort distance, per activity ({name: seconds or None})"""
+    results = [dict.fromkeys(distances) for _ in streams_list]
+    if not streams_list:
+        return results
+    time, distance, segment_ids, offset_d, totals_d = _batched_time_distance(streams_list)
+    if not len(time):
+        return results
+
+    activity_end = (offset_d + totals_d)[segment_ids]
+    n_activities = len(streams_list)
+    for name, effort_m in distances.items():
+        # Sliding window over cumulative distance: for every start sample,
+        # the interpolated time at which the window reaches effort_m
+        window_end = distance + effort_m
+        elapsed = np.interp(window_end, distance, time) - time
+        elapsed[window_end > activity_end] = np.inf
+
+        best = np.full(n_activities, np.inf)
+        np.minimum.at(best, segment_ids, elapsed)
+        for i, value in enumerate(best):
+            results[i][name] = float(value) if np.isfinite(value) else None
+    return results
+
+
+def hr_zone_bounds(max_hr, fractions=HR_ZONE_FRACTIONS):
+    """Heart-rate lower bounds of zones 2..5 for a given maximum heart rate"""
+    return [max_hr * f for f in fractions]
+
+
+def batch_hr_zone_time(streams_list, max_hr):
+    """Seconds spent in each heart-rate zone (Z1..Z5), per activity"""
+    n_zones = len(HR_ZONE_FRACTIONS) + 1
+    usable = [i for i, s in enumerate(streams_list) if len(s.get("heartrate", ())) and len(s.get("time", ()))]
+    results = [None] * len(streams_list)
+    if not usable:
+        return results
+
+    subset = [streams_list[i] for i in usable]
+    time, starts, lengths = _concatenate(subset, "time", np.float64)
+    heartrate, _, _ = _concatenate(subset, "heartrate", np.float64)
+    segment_ids = np.repeat(np.arange(len(subset)), lengths)
+
+    # Each sample holds until the next one; the last sample of an activity
+    # (and any long recording gap) contributes nothing
+    dt = np.empty_like(time)
+    dt[:-1] = np.diff(time)
+    dt[-1] = 0
+    dt[starts + lengths - 1] = 0
+    dt[~np.isfinite(dt) | (dt < 0) | (dt > MAX_SAMPLE_GAP_S)] = 0
+    # digitize would put NaN in the top zone
+    missing = np.isnan(heartrate)
+    dt[missing] = 0
+
+    zones = np.digitize(np.where(missing, 0, heartrate), hr_zone_bounds(max_hr))
+    totals = np.bincount(segment_ids * n_zones + zones, weights=dt, minlength=len(subset) * n_zones)
+    for row, i in zip(totals.reshape(len(subset), n_zones), usable):
+        results[i] = [float(v) for v in row]
+    return results
+
+
+def compute_stream_metrics(streams_list, max_hr):
+    """All mappable analytics for a batch of activities, formatted for the sheet.
+
+    Returns one dict per activity with ``splits``, ``best_1k``, ``best_5k``,
+    ``best_10k`` and ``hr_zone_time``; values are empty strings when the
+    activity has no data for them.
+    """
+    with_distance = [i for i, s in enumerate(streams_list) if len(s.get("time", ())) and len(s.get("distance", ()))]
+    distance_streams = [streams_list[i] for i in with_distance]
+    splits = dict(zip(with_distance, batch_splits(distance_streams)))
+    efforts = dict(zip(with_distance, batch_best_efforts(distance_streams)))
+    zone_times = batch_hr_zone_time(streams_list, max_hr)
+
+    metrics = []
+    for i in range(len(streams_list)):
+        activity_metrics = {
+            "splits": " ".join(format_seconds(s) for s in splits.get(i, [])),
+            "hr_zone_time": "",
+        }
+        for name in BEST_EFFORT_DISTANCES_M:
+            value = efforts.get(i, {}).get(name)
+            activity_metrics[name] = format_seconds(value) if value is not None else ""
+        if zone_times[i] is not None:
+            activity_metrics["hr_zone_time"] = " ".join(
+                f"Z{zone}:{format_seconds(seconds)}" for zone, seconds in enumerate(zone_times[i], start=1)
+            )
+        metrics.append(activity_metrics)
+    return metrics
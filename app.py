@@ -1,18 +1,36 @@
 import os
-from flask import Flask, redirect, request, session, url_for, render_template, flash, make_response, jsonify
-from requests_oauthlib import OAuth2Session
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from flask import Flask, redirect, request, session, url_for, render_template, flash, make_response, jsonify, send_from_directory
 from dotenv import load_dotenv
+import click
 import requests
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
+import copy
+import random
 import uuid
 import hashlib
-import sqlite3
 import re
+import math
 import logging
+import threading
+import gzip
+import mimetypes
+import sys
+import zlib
+import time
+import zipfile
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from functools import lru_cache, wraps
+
+from cache import make_cache
+from storage import make_storage
+
+# gspread, oauth2client and requests-oauthlib are imported inside the functions
+# that use them. They are slow to import and most requests never touch them,
+# so keeping them off the module import path shortens worker cold starts.
 
 load_dotenv()
 app = Flask(__name__)
@@ -80,6 +98,84 @@ def values_equal(existing_value: str, new_value: str) -> bool:
     
     return normalized_existing == normalized_new
 
+# Google Sheets serial dates count days from 30 December 1899
+SHEETS_EPOCH = datetime(1899, 12, 30)
+TIME_VALUE_RE = re.compile(r"^\d+:\d{1,2}(:\d{1,2}(\.\d+)?)?$")
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def sheet_cell_text(value) -> str:
+    """
+    Text form of a cell read with UNFORMATTED_VALUE, where numbers come back
+    as int or float (e.g. an ID stored as a number).
+    """
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, str):
+        return normalize_sheet_value(value)
+    return str(value)
+
+def serial_to_date(serial) -> datetime.date:
+    """Convert a Google Sheets serial date number to a date."""
+    return (SHEETS_EPOCH + timedelta(days=int(serial))).date()
+
+# Dates written by format_activity
+ACTIVITY_DATE_FORMAT = "%d/%m/%Y"
+# Text date formats recognised in a sheet's date column, in order of preference
+# when a sample fits more than one (e.g. 01/06/2025)
+DATE_FORMAT_CANDIDATES = ("%d/%m/%Y", "%d.%m.%Y", "%Y-%m-%d", "%d-%m-%Y", "%m/%d/%Y")
+# Stored for date columns that only hold real dates (read as serial numbers)
+SERIAL_DATE_FORMAT = "serial"
+
+@lru_cache(maxsize=None)
+def date_parser(fmt: str):
+    """
+    Build a parser for one fixed date format (%d, %m and %Y only). The parser
+    returns a date, or None when the text does not match; it never raises, so
+    a column of misses costs no exceptions.
+    """
+    pattern = re.escape(fmt).replace("%d", r"(?P<d>\d{1,2})").replace("%m", r"(?P<m>\d{1,2})").replace("%Y", r"(?P<y>\d{4})")
+    regex = re.compile(pattern + "$")
+
+    def parse(text):
+        match = regex.match(normalize_sheet_value(text).strip())
+        if not match:
+            return None
+        try:
+            return datetime(int(match["y"]), int(match["m"]), int(match["d"])).date()
+        except ValueError:
+            return None
+    return parse
+
+def parse_sheet_number(value):
+    """A number from a typed cell or from text with either decimal separator; None if not numeric."""
+    if _is_number(value):
+        return float(value)
+    text = normalize_sheet_value(str(value)).strip().replace(" ", "")
+    text = text.replace(",", "") if "," in text and "." in text else text.replace(",", ".")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def parse_sheet_duration(value):
+    """
+    Seconds in a duration cell: a typed time value is a fraction of a day,
+    and text is read the way Sheets reads USER_ENTERED input (h:mm or h:mm:ss).
+    """
+    if _is_number(value):
+        return value * 86400
+    text = normalize_sheet_value(str(value)).strip()
+    if not TIME_VALUE_RE.match(text):
+        return None
+    parts = [float(part) for part in text.split(":")]
+    return parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) > 2 else 0)
+
+def _decimal_tolerance(decimals) -> float:
+    """Half a unit in the given decimal place."""
+    return 0.5 * 10 ** -decimals + 1e-9
+
 def column_index_to_letter(col_idx):
     """Convert 0-based column index to Excel-style column letter (A, B, ..., Z, AA, AB, etc.)"""
     result = ""
@@ -97,10 +193,17 @@ SCOPES = ["activity:read_all"]
 COOKIE_NAME = "strava_session"
 COOKIE_MAX_AGE = 30 * 24 * 60 * 60  # 30 days in seconds
 
-# Database setup
+# Database setup. DATABASE_URL=postgresql://... selects PostgreSQL with a
+# connection pool of DB_POOL_MIN..DB_POOL_MAX per worker process; otherwise
+# everything lives in the SQLite file at DB_PATH.
 DB_PATH = os.getenv("DB_PATH", "activity_tracker.db")
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
 
-# Get service account email from credentials file
+# Get service account email from credentials file. Cached so the credentials
+# file is read at most once per worker, and only when a page needs the email.
+@lru_cache(maxsize=None)
 def get_service_account_email():
     try:
         creds_file = os.getenv("GOOGLE_CREDS_FILE")
@@ -114,63 +217,759 @@ def get_service_account_email():
         logger.error(f"Error reading service account email: {str(e)}")
         return "Error reading service account email"
 
-# Store service account email globally to avoid repeated file reads
-SERVICE_ACCOUNT_EMAIL = get_service_account_email()
+GOOGLE_SCOPES = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/drive",
+]
+
+def get_gspread_client():
+    """Authorize a gspread client with the service account credentials"""
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    creds = ServiceAccountCredentials.from_json_keyfile_name(
+        os.getenv("GOOGLE_CREDS_FILE"),
+        GOOGLE_SCOPES,
+    )
+    client = gspread.authorize(creds, client_factory=scheduled_client_class())
+    client.set_timeout(UPSTREAM_TIMEOUT)
+    adopt_shared_google_token(client)
+    return client
+
+# Shared cache for Google Sheets metadata and header rows, Strava activity
+# pages and the Google access token. CACHE_BACKEND is "memory" (each worker
+# on its own, the default), "sqlite" (the app database, shared by the workers
+# on this host) or "redis" (CACHE_REDIS_URL, shared across hosts).
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+SHEET_CACHE_TTL = int(os.getenv("SHEET_CACHE_TTL", "120"))
+STRAVA_PAGE_CACHE_TTL = int(os.getenv("STRAVA_PAGE_CACHE_TTL", "60"))
+
+@lru_cache(maxsize=None)
+def get_cache():
+    return make_cache(CACHE_BACKEND, sqlite_path=DB_PATH, redis_url=os.getenv("CACHE_REDIS_URL"))
+
+def cache_get(key):
+    """Read from the shared cache; an unavailable backend counts as a miss"""
+    try:
+        return get_cache().get(key)
+    except Exception as e:
+        logger.warning(f"Cache read failed for {key}: {str(e)}")
+        return None
+
+def cache_set(key, value, ttl):
+    """Write to the shared cache; failures only cost a later miss"""
+    if ttl <= 0:
+        return
+    try:
+        get_cache().set(key, value, ttl)
+    except Exception as e:
+        logger.warning(f"Cache write failed for {key}: {str(e)}")
+
+def _google_token_cache_key():
+    return f"google:access-token:{get_service_account_email()}"
+
+def adopt_shared_google_token(client):
+    """Give a new client the access token another worker already fetched, if still valid"""
+    shared = cache_get(_google_token_cache_key())
+    if shared and shared["expiry"] > time.time() + 60:
+        # google-auth keeps expiry as naive UTC
+        client.auth.token = shared["token"]
+        client.auth.expiry = datetime.fromtimestamp(shared["expiry"], timezone.utc).replace(tzinfo=None)
+        client.shared_token = shared["token"]
+
+def share_google_token(client):
+    """Publish a client's freshly fetched access token for the other workers"""
+    auth = getattr(client, "auth", None)
+    token = getattr(auth, "token", None)
+    if not token or not getattr(auth, "expiry", None) or token == getattr(client, "shared_token", None):
+        return
+    expiry = auth.expiry.replace(tzinfo=timezone.utc).timestamp()
+    cache_set(_google_token_cache_key(), {"token": token, "expiry": expiry}, expiry - time.time() - 60)
+    client.shared_token = token
+
+class SingleFlight:
+    """Share one in-flight call among concurrent callers with the same key.
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for it and get a copy of its result (or its exception) instead
+    of issuing the same request again. Nothing is kept once the call
+    finishes, so this only collapses bursts; it is not a cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {"calls": 0, "shared": 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"event": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+                self.stats["calls"] += 1
+            else:
+                self.stats["shared"] += 1
+
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            logger.debug(f"Shared in-flight result for {key}")
+            # Callers may modify what they get back
+            return copy.deepcopy(call["result"])
+
+        try:
+            call["result"] = fn(*args, **kwargs)
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["event"].set()
+
+
+# Concurrent identical Google Sheets reads in this worker share one request
+sheet_reads = SingleFlight()
+
+
+def _sheet_generation_key(sheet_id):
+    return f"sheets:{sheet_id}:generation"
+
+
+def invalidate_sheet_cache(sheet_id):
+    """Drop every cached read of a spreadsheet (after we change its worksheets or headers)"""
+    # A new generation makes all existing keys unreachable; they expire on their own
+    cache_set(_sheet_generation_key(sheet_id), time.time_ns(), 86400)
+
+
+def coalesce_sheet_read(operation, ttl=None):
+    """Decorator for Sheets read helpers whose first argument is the sheet ID.
+
+    Concurrent calls with the same (sheet_id, operation, arguments) key are
+    coalesced through ``sheet_reads``. With a ``ttl`` the result is also kept
+    in the shared cache, so every worker skips the read until it expires or
+    an import changes the spreadsheet's structure, and while Google is down
+    the last good result is served instead of an error. Only successful
+    results are cached: the decorated function must raise on errors.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(sheet_id, *args, **kwargs):
+            key = (sheet_id, operation, args, tuple(sorted(kwargs.items())))
+            if not ttl:
+                return sheet_reads.do(key, fn, sheet_id, *args, **kwargs)
+
+            generation = cache_get(_sheet_generation_key(sheet_id)) or 0
+            arguments = hashlib.sha256(json.dumps([args, sorted(kwargs.items())], default=str).encode()).hexdigest()[:16]
+            cache_key = f"sheets:{sheet_id}:{generation}:{operation}:{arguments}"
+            cached = cache_get(cache_key)
+            if cached is not None:
+                return cached
+
+            stale_key = f"sheets:{sheet_id}:last-good:{operation}:{arguments}"
+
+            def load():
+                try:
+                    result = fn(sheet_id, *args, **kwargs)
+                except Exception as e:
+                    stale = cache_get(stale_key) if is_upstream_outage(e) else None
+                    if stale is None:
+                        raise
+                    logger.warning(f"Serving the last good {operation} of {sheet_id}: {str(e)}")
+                    return stale
+                cache_set(cache_key, result, ttl)
+                cache_set(stale_key, result, UPSTREAM_STALE_TTL)
+                return result
+            return sheet_reads.do(key, load)
+        return wrapper
+    return decorator
+
+
+# Upstream timeouts and circuit breakers
+#
+# Every request to Google Sheets and Strava has explicit connect and read
+# timeouts, so a degraded upstream cannot hold a worker for minutes. Each
+# upstream also has a circuit breaker: after BREAKER_FAILURE_THRESHOLD
+# consecutive outage failures (timeouts, connection errors, 5xx answers) it
+# opens and calls fail at once for BREAKER_RESET_SECONDS, and reads are served
+# from the last good copy in the shared cache when there is one. Breaker state
+# is per worker process and is reported by /health.
+UPSTREAM_TIMEOUT = (
+    float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "3.05")),
+    float(os.getenv("UPSTREAM_READ_TIMEOUT", "20")),
+)
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+# How long the last good copy of a read is kept for serving during an outage
+UPSTREAM_STALE_TTL = int(os.getenv("UPSTREAM_STALE_TTL", "21600"))
+
+
+class UpstreamUnavailable(Exception):
+    """Raised without calling an upstream whose circuit breaker is open"""
+
+    def __init__(self, upstream, retry_in):
+        super().__init__(f"{upstream} is not responding; not retrying for another {retry_in:.0f}s")
+        self.upstream = upstream
+        self.retry_in = retry_in
+
+
+def is_upstream_outage(error):
+    """Whether an error means the upstream is down or degraded, rather than a bad request"""
+    if isinstance(error, (UpstreamUnavailable, requests.Timeout, requests.ConnectionError)):
+        return True
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status is not None and status >= 500
+
+
+class CircuitBreaker:
+    """Fails calls to an upstream fast while it keeps failing.
+
+    Closed, calls go through and consecutive outage failures are counted.
+    At ``failure_threshold`` the breaker opens and calls raise
+    UpstreamUnavailable without being made. After ``reset_timeout`` seconds
+    one trial call is let through (half-open): success closes the breaker,
+    failure opens it again. Answers that are not outages (e.g. a 404) count
+    as success.
+    """
+
+    def __init__(self, name, label, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.label = label
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self.rejected = 0
+        self.last_error = None
+        self.last_failure_at = None
+
+    def _retry_in(self, now):
+        return max(0.0, self.opened_at + self.reset_timeout - now)
+
+    def _admit(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "open" and self._retry_in(now) <= 0:
+                self.state = "half_open"
+            if self.state == "open" or (self.state == "half_open" and self._trial_running):
+                self.rejected += 1
+                raise UpstreamUnavailable(self.label, self._retry_in(now) if self.state == "open" else 0)
+            if self.state == "half_open":
+                self._trial_running = True
+
+    def _record(self, failed, error=None):
+        with self._lock:
+            self._trial_running = False
+            if not failed:
+                if self.state != "closed":
+                    logger.info(f"{self.label} circuit breaker closed")
+                self.state = "closed"
+                self.failures = 0
+                return
+            self.failures += 1
+            self.last_error = str(error)[:200]
+            self.last_failure_at = time.time()
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                logger.warning(f"{self.label} circuit breaker opened after {self.failures} failures: {self.last_error}")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def call(self, fn):
+        """Run one upstream request; a returned response with a 5xx status counts as a failure"""
+        self._admit()
+        try:
+            result = fn()
+        except Exception as e:
+            self._record(is_upstream_outage(e), e)
+            raise
+        status = getattr(result, "status_code", None)
+        self._record(status is not None and status >= 500, f"HTTP {status}")
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in_seconds": round(self._retry_in(time.monotonic()), 1) if self.state == "open" else 0,
+                "rejected_calls": self.rejected,
+                "last_error": self.last_error,
+                "last_failure_at": datetime.fromtimestamp(self.last_failure_at, timezone.utc).isoformat() if self.last_failure_at else None,
+            }
+
+
+google_breaker = CircuitBreaker("google_sheets", "Google Sheets")
+strava_breaker = CircuitBreaker("strava", "Strava")
+
+
+# Google Sheets quota
+#
+# Sheets allows a fixed number of read and write requests per minute, per
+# user (the service account) and per project. Every request made through
+# get_gspread_client() is paced to stay inside both budgets, and 429 or 5xx
+# answers are retried with jittered exponential backoff. Requests that are
+# not safe to repeat (values.append, structural batchUpdates) are retried on
+# 429 only: after a 5xx Google may still have applied them. The budgets apply
+# per process; with several workers, divide them between the workers.
+SHEETS_QUOTA_WINDOW = 60.0
+SHEETS_BUDGETS = {
+    ("account", "read"): int(os.getenv("SHEETS_READS_PER_MINUTE", "60")),
+    ("account", "write"): int(os.getenv("SHEETS_WRITES_PER_MINUTE", "60")),
+    ("project", "read"): int(os.getenv("SHEETS_PROJECT_READS_PER_MINUTE", "300")),
+    ("project", "write"): int(os.getenv("SHEETS_PROJECT_WRITES_PER_MINUTE", "300")),
+}
+SHEETS_MAX_RETRIES = 5
+SHEETS_RETRY_BASE_DELAY = 1.0
+SHEETS_RETRY_MAX_DELAY = 32.0
+SHEETS_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# A 429 is refused before anything is applied
+SHEETS_UNSAFE_RETRY_STATUSES = {429}
+
+
+def sheets_retry_statuses(method, endpoint):
+    """Statuses a Sheets request can be retried on without risking a second write"""
+    if method.lower() == "post" and (endpoint.endswith(":append") or re.search(r"/spreadsheets/[^/]+:batchUpdate$", endpoint)):
+        return SHEETS_UNSAFE_RETRY_STATUSES
+    return SHEETS_RETRY_STATUSES
+
+
+class SheetsScheduler:
+    """Paces Google Sheets requests to the per-minute budgets and retries throttled ones.
+
+    Time spent waiting (for budget or backoff) and the number of retries are
+    accumulated per thread, so an import can report its own throttling.
+    """
+
+    def __init__(self, budgets, window=SHEETS_QUOTA_WINDOW):
+        self.budgets = budgets
+        self.window = window
+        self._lock = threading.Lock()
+        self._sent = {}  # (scope key, kind) -> deque of send times
+        self._local = threading.local()
+
+    def thread_stats(self):
+        """Cumulative waiting and retries of the calling thread"""
+        return dict(getattr(self._local, "stats", None) or {"throttled_seconds": 0.0, "retries": 0})
+
+    def _record(self, waited, retried=False):
+        stats = getattr(self._local, "stats", None)
+        if stats is None:
+            stats = self._local.stats = {"throttled_seconds": 0.0, "retries": 0}
+        stats["throttled_seconds"] += waited
+        if retried:
+            stats["retries"] += 1
+
+    def _acquire(self, account, kind):
+        """Block until a request of this kind fits every budget, then reserve it"""
+        keys = [((scope, account if scope == "account" else None), kind, self.budgets[(scope, kind)]) for scope in ("account", "project")]
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = 0.0
+                for key, _, budget in keys:
+                    sent = self._sent.setdefault((key, kind), deque())
+                    while sent and sent[0] <= now - self.window:
+                        sent.popleft()
+                    if len(sent) >= budget:
+                        wait = max(wait, sent[0] + self.window - now)
+                if wait <= 0:
+                    for key, _, _ in keys:
+                        self._sent[(key, kind)].append(now)
+                    return
+            logger.info(f"Sheets {kind} budget used up; waiting {wait:.1f}s")
+            self._record(wait)
+            time.sleep(wait)
+
+    def call(self, account, kind, fn, retry_statuses=SHEETS_RETRY_STATUSES):
+        """Run one Sheets request inside the budget, retrying 429 and 5xx answers (or ``retry_statuses``)"""
+        attempt = 0
+        while True:
+            self._acquire(account, kind)
+            try:
+                return fn()
+            except Exception as e:
+                response = getattr(e, "response", None)
+                status = getattr(response, "status_code", None)
+                if status not in retry_statuses or attempt >= SHEETS_MAX_RETRIES:
+                    raise
+                retry_after = response.headers.get("Retry-After") if response is not None else None
+                if retry_after and retry_after.isdigit():
+                    delay = float(retry_after)
+                else:
+                    # Equal jitter: half the exponential delay plus a random share of the other half
+                    cap = min(SHEETS_RETRY_MAX_DELAY, SHEETS_RETRY_BASE_DELAY * 2 ** attempt)
+                    delay = cap / 2 + random.uniform(0, cap / 2)
+                attempt += 1
+                logger.warning(f"Sheets {kind} request returned {status}; retry {attempt}/{SHEETS_MAX_RETRIES} in {delay:.1f}s")
+                self._record(delay, retried=True)
+                time.sleep(delay)
+
+
+sheets_scheduler = SheetsScheduler(SHEETS_BUDGETS)
+
+
+@lru_cache(maxsize=None)
+def scheduled_client_class():
+    """gspread.Client subclass whose API requests all go through sheets_scheduler"""
+    import gspread
+
+    class ScheduledClient(gspread.Client):
+        def request(self, method, endpoint, *args, **kwargs):
+            kind = "read" if method.lower() == "get" else "write"
+            # The breaker sees every attempt, so retries stop as soon as it opens
+            response = sheets_scheduler.call(
+                get_service_account_email(), kind,
+                lambda: google_breaker.call(lambda: super(ScheduledClient, self).request(method, endpoint, *args, **kwargs)),
+                sheets_retry_statuses(method, endpoint)
+            )
+            share_google_token(self)
+            return response
+
+    return ScheduledClient
+
+
+# Storage per worker process: a pool must not be shared across a fork
+_storage_by_pid = {}
+_storage_lock = threading.Lock()
+
+def get_storage():
+    """The configured storage backend for this process"""
+    pid = os.getpid()
+    storage = _storage_by_pid.get(pid)
+    if storage is None:
+        with _storage_lock:
+            storage = _storage_by_pid.get(pid)
+            if storage is None:
+                storage = make_storage(DATABASE_URL, DB_PATH, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX)
+                _storage_by_pid[pid] = storage
+    return storage
+
 
 @contextmanager
 def get_db_connection():
     """Context manager for database connections"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    try:
+    with get_storage().connection() as conn:
         yield conn
-    finally:
-        conn.close()
+
+# Columns returned by the spreadsheet read paths. COALESCE keeps sheet_id and
+# default_worksheet as strings so callers never have to patch up NULLs.
+SPREADSHEET_COLUMNS = """id, name, COALESCE(sheet_id, '') AS sheet_id, is_default,
+    include_date, include_distance, include_time, include_pace, include_hr,
+    COALESCE(default_worksheet, 'Sheet1') AS default_worksheet"""
+
+SELECT_SPREADSHEETS_SQL = f"SELECT {SPREADSHEET_COLUMNS} FROM spreadsheets ORDER BY is_default DESC, name"
+SELECT_DEFAULT_SPREADSHEET_SQL = f"SELECT {SPREADSHEET_COLUMNS} FROM spreadsheets WHERE is_default = 1 LIMIT 1"
+SELECT_SPREADSHEET_SQL = f"SELECT {SPREADSHEET_COLUMNS} FROM spreadsheets WHERE id = ?"
+
+
+def _migration_baseline_schema(cursor):
+    """Create the base tables and backfill columns added before schema versioning"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        token_data TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS spreadsheets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        sheet_id TEXT NOT NULL,
+        is_default INTEGER DEFAULT 0,
+        include_date INTEGER DEFAULT 1,
+        include_distance INTEGER DEFAULT 1,
+        include_time INTEGER DEFAULT 1,
+        include_pace INTEGER DEFAULT 1,
+        include_hr INTEGER DEFAULT 1,
+        default_worksheet TEXT DEFAULT 'Sheet1',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS header_mappings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        spreadsheet_id INTEGER NOT NULL,
+        worksheet_name TEXT NOT NULL,
+        field_name TEXT NOT NULL,
+        header_name TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (spreadsheet_id) REFERENCES spreadsheets(id) ON DELETE CASCADE,
+        UNIQUE(spreadsheet_id, worksheet_name, field_name)
+    )
+    ''')
+
+    # Databases created before versioning may predate the column preferences.
+    # This probe only ever runs once, while the database is still at version 0.
+    cursor.execute("PRAGMA table_info(spreadsheets)")
+    columns = [column[1] for column in cursor.fetchall()]
+    legacy_columns = [
+        ("include_date", "INTEGER DEFAULT 1"),
+        ("include_distance", "INTEGER DEFAULT 1"),
+        ("include_time", "INTEGER DEFAULT 1"),
+        ("include_pace", "INTEGER DEFAULT 1"),
+        ("include_hr", "INTEGER DEFAULT 1"),
+        ("default_worksheet", "TEXT DEFAULT 'Sheet1'"),
+    ]
+    for column_name, column_type in legacy_columns:
+        if column_name not in columns:
+            cursor.execute(f"ALTER TABLE spreadsheets ADD COLUMN {column_name} {column_type}")
+
+
+def _migration_import_plans(cursor):
+    """Store import plans and their batch progress so failed imports can resume"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS import_plans (
+        id TEXT PRIMARY KEY,
+        spreadsheet_id INTEGER NOT NULL,
+        worksheet_name TEXT NOT NULL,
+        plan_json TEXT NOT NULL,
+        total_batches INTEGER NOT NULL,
+        completed_batches INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'planned',
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (spreadsheet_id) REFERENCES spreadsheets(id) ON DELETE CASCADE
+    )
+    ''')
+
+
+def _migration_activity_streams(cursor):
+    """Local archive of activity summaries and their per-second streams"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS activities (
+        id INTEGER PRIMARY KEY,
+        start_date TEXT NOT NULL,
+        start_date_local TEXT,
+        name TEXT,
+        type TEXT,
+        distance REAL,
+        moving_time INTEGER,
+        average_heartrate REAL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activities_start_date ON activities(start_date)")
+
+    # One row per activity and stream type; data is a zlib-compressed,
+    # little-endian typed array (see encode_stream)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS activity_streams (
+        activity_id INTEGER NOT NULL,
+        stream_type TEXT NOT NULL,
+        typecode TEXT NOT NULL,
+        length INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (activity_id, stream_type)
+    )
+    ''')
+
+
+def _migration_activity_rollups(cursor):
+    """Weekly/monthly rollups per spreadsheet and the per-activity inputs behind them"""
+    # What each activity last contributed, so a re-import applies only the difference
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS rollup_contributions (
+        spreadsheet_id INTEGER NOT NULL,
+        activity_id TEXT NOT NULL,
+        activity_date TEXT NOT NULL,
+        distance_m REAL NOT NULL,
+        moving_time_s INTEGER NOT NULL,
+        heart_rate REAL,
+        PRIMARY KEY (spreadsheet_id, activity_id)
+    )
+    ''')
+
+    # period is 'week' (period_start is the Monday) or 'month' (the 1st).
+    # Average HR is kept as a moving-time-weighted sum over the activities
+    # that have a heart rate.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS activity_rollups (
+        spreadsheet_id INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        period_start TEXT NOT NULL,
+        activity_count INTEGER NOT NULL DEFAULT 0,
+        distance_m REAL NOT NULL DEFAULT 0,
+        moving_time_s INTEGER NOT NULL DEFAULT 0,
+        hr_weighted_sum REAL NOT NULL DEFAULT 0,
+        hr_time_s INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (spreadsheet_id, period, period_start)
+    )
+    ''')
+
+
+def _migration_training_load(cursor):
+    """Persisted daily training-load state (CTL/ATL EWMAs) per spreadsheet"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS training_load (
+        spreadsheet_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        load REAL NOT NULL,
+        ctl REAL NOT NULL,
+        atl REAL NOT NULL,
+        PRIMARY KEY (spreadsheet_id, day)
+    )
+    ''')
+
+
+def _migration_sheet_write_queue(cursor):
+    """Cross-process write lock and import queue per (spreadsheet, worksheet)"""
+    # A lease rather than a plain lock, so a crashed worker cannot block a sheet forever
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sheet_write_locks (
+        sheet_key TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    ''')
+
+    # Imports waiting for (or being written by) the lock holder. status is
+    # 'pending', 'running', 'done' or 'failed'; result holds the outcome
+    # until the submitting request has read it.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sheet_write_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sheet_key TEXT NOT NULL,
+        spreadsheet_id INTEGER NOT NULL,
+        worksheet_name TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        owner TEXT,
+        result TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sheet_write_queue_key ON sheet_write_queue(sheet_key, status)")
+
+
+def _migration_import_requests(cursor):
+    """Idempotency keys of confirmed imports and their outcome"""
+    # status is 'running' (leased to owner until expires_at), 'done' or
+    # 'failed'; result holds the summary (or error) replayed to repeats
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS import_requests (
+        idempotency_key TEXT PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'running',
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        result TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+def _migration_import_journal(cursor):
+    """Previous values of the cells written by each import plan, for reverting it"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS import_journal (
+        plan_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        entry_json TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (plan_id, seq),
+        FOREIGN KEY (plan_id) REFERENCES import_plans(id) ON DELETE CASCADE
+    )
+    ''')
+
+
+def _migration_sheet_queue_heartbeat(cursor):
+    """Last heartbeat of the lease holder writing each queued import"""
+    cursor.execute("ALTER TABLE sheet_write_queue ADD COLUMN heartbeat_at REAL")
+
+
+def _migration_import_request_plan(cursor):
+    """Plan an interrupted confirm resumes instead of importing again"""
+    cursor.execute(
+        "ALTER TABLE import_requests ADD COLUMN plan_id TEXT REFERENCES import_plans(id) ON DELETE SET NULL"
+    )
+
+
+def _migration_rollup_worksheet(cursor):
+    """sheetId of the rollup summary worksheet the app created in each spreadsheet"""
+    cursor.execute("ALTER TABLE spreadsheets ADD COLUMN rollup_sheet_id INTEGER")
+
+
+def _migration_header_value_format(cursor):
+    """Per-column value format (e.g. the inferred date format) stored with each mapping"""
+    cursor.execute("ALTER TABLE header_mappings ADD COLUMN value_format TEXT")
+
+
+# Ordered schema migrations. Migration N (1-based) upgrades the database from
+# schema version N-1 to N. Never edit or reorder an existing entry; append a new one.
+MIGRATIONS = [
+    _migration_baseline_schema,
+    _migration_import_plans,
+    _migration_activity_streams,
+    _migration_activity_rollups,
+    _migration_training_load,
+    _migration_sheet_write_queue,
+    _migration_header_value_format,
+    _migration_import_requests,
+    _migration_import_journal,
+    _migration_sheet_queue_heartbeat,
+    _migration_import_request_plan,
+    _migration_rollup_worksheet,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn):
+    """Return the schema version stored in the database"""
+    return get_storage().get_schema_version(conn)
+
+
+def migrate_db():
+    """Apply pending schema migrations, tracked through the stored schema version"""
+    with get_db_connection() as conn:
+        # Fast path: a single header read when the schema is already current
+        version = get_schema_version(conn)
+        if version >= SCHEMA_VERSION:
+            return
+
+        try:
+            for target_version, migration in enumerate(MIGRATIONS, start=1):
+                if target_version <= version:
+                    continue
+
+                # Take the write lock before re-checking the version so that
+                # workers starting at the same time apply each migration once
+                get_storage().begin_migration(conn)
+                try:
+                    if get_schema_version(conn) >= target_version:
+                        conn.rollback()
+                        continue
+                    migration(conn.cursor())
+                    get_storage().set_schema_version(conn, target_version)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+
+                logger.info(f"Applied database migration {target_version}: {migration.__name__}")
+            logger.info(f"Database schema is at version {SCHEMA_VERSION}")
+        except Exception as e:
+            # Surfaces to ensure_db_initialized, which retries on the next request
+            logger.error(f"Error during database migration: {str(e)}")
+            raise
+
 
 def init_db():
     """Initialize the database with required tables"""
+    migrate_db()
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        # Create sessions table to store user tokens
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sessions (
-            session_id TEXT PRIMARY KEY,
-            token_data TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        # Create spreadsheets table to store spreadsheet configurations
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS spreadsheets (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            sheet_id TEXT NOT NULL,
-            is_default INTEGER DEFAULT 0,
-            include_date INTEGER DEFAULT 1,
-            include_distance INTEGER DEFAULT 1,
-            include_time INTEGER DEFAULT 1,
-            include_pace INTEGER DEFAULT 1,
-            include_hr INTEGER DEFAULT 1,
-            default_worksheet TEXT DEFAULT 'Sheet1',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        # Create header_mappings table to store field-to-header mappings
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS header_mappings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            spreadsheet_id INTEGER NOT NULL,
-            worksheet_name TEXT NOT NULL,
-            field_name TEXT NOT NULL,
-            header_name TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (spreadsheet_id) REFERENCES spreadsheets(id) ON DELETE CASCADE,
-            UNIQUE(spreadsheet_id, worksheet_name, field_name)
-        )
-        ''')
-        
         # Check if default spreadsheet exists, if not add it from env
         cursor.execute("SELECT COUNT(*) FROM spreadsheets WHERE is_default = 1")
         if cursor.fetchone()[0] == 0:
@@ -184,176 +983,51 @@ def init_db():
         
         conn.commit()
 
-def migrate_db():
-    """Perform database migrations for schema changes"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Check if columns exist in the spreadsheets table
-        try:
-            cursor.execute("PRAGMA table_info(spreadsheets)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            # Add missing columns if they don't exist
-            if "include_date" not in columns:
-                cursor.execute("ALTER TABLE spreadsheets ADD COLUMN include_date INTEGER DEFAULT 1")
-            if "include_distance" not in columns:
-                cursor.execute("ALTER TABLE spreadsheets ADD COLUMN include_distance INTEGER DEFAULT 1")
-            if "include_time" not in columns:
-                cursor.execute("ALTER TABLE spreadsheets ADD COLUMN include_time INTEGER DEFAULT 1")
-            if "include_pace" not in columns:
-                cursor.execute("ALTER TABLE spreadsheets ADD COLUMN include_pace INTEGER DEFAULT 1")
-            if "include_hr" not in columns:
-                cursor.execute("ALTER TABLE spreadsheets ADD COLUMN include_hr INTEGER DEFAULT 1")
-            if "default_worksheet" not in columns:
-                cursor.execute("ALTER TABLE spreadsheets ADD COLUMN default_worksheet TEXT DEFAULT 'Sheet1'")
-            
-            # Check if header_mappings table exists
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='header_mappings'")
-            if not cursor.fetchone():
-                cursor.execute('''
-                CREATE TABLE header_mappings (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    spreadsheet_id INTEGER NOT NULL,
-                    worksheet_name TEXT NOT NULL,
-                    field_name TEXT NOT NULL,
-                    header_name TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (spreadsheet_id) REFERENCES spreadsheets(id) ON DELETE CASCADE,
-                    UNIQUE(spreadsheet_id, worksheet_name, field_name)
-                )
-                ''')
-            
-            conn.commit()
-            logger.info("Database migration completed successfully")
-        except Exception as e:
-            logger.error(f"Error during database migration: {str(e)}")
+# One-time initialisation marker. The database is initialised on the first
+# request a worker serves rather than at import time.
+_db_initialized = False
+_db_init_lock = threading.Lock()
+
+def ensure_db_initialized():
+    """Run init_db once per process; cheap no-op after the first call.
 
-# Initialize database on startup
-init_db()
-# Run migrations
-migrate_db()
+    If it fails (e.g. a migration error) the error is raised and the next
+    call tries again.
+    """
+    global _db_initialized
+    if _db_initialized:
+        return
+    with _db_init_lock:
+        if not _db_initialized:
+            init_db()
+            _db_initialized = True
+
+@app.before_request
+def _initialize_db_before_request():
+    # /health reports a broken database or migration instead of failing on it
+    if request.endpoint != "health":
+        ensure_db_initialized()
 
 # Function to get all spreadsheets
 def get_spreadsheets():
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        try:
-            cursor.execute("SELECT id, name, sheet_id, is_default, include_date, include_distance, include_time, include_pace, include_hr, default_worksheet FROM spreadsheets ORDER BY is_default DESC, name")
-            sheets = [dict(row) for row in cursor.fetchall()]
-            
-            # Ensure sheet_id is always a string (not None)
-            for sheet in sheets:
-                if sheet["sheet_id"] is None:
-                    sheet["sheet_id"] = ""
-                if sheet["default_worksheet"] is None:
-                    sheet["default_worksheet"] = "Sheet1"
-                    
-            return sheets
-        except sqlite3.OperationalError as e:
-            # If columns don't exist yet, fall back to basic query
-            if "no such column" in str(e):
-                logger.warning("Column missing in spreadsheets table, using fallback query")
-                cursor.execute("SELECT id, name, sheet_id, is_default FROM spreadsheets ORDER BY is_default DESC, name")
-                sheets = []
-                for row in cursor.fetchall():
-                    sheet_dict = dict(row)
-                    # Add default values for missing columns
-                    sheet_dict["include_date"] = 1
-                    sheet_dict["include_distance"] = 1
-                    sheet_dict["include_time"] = 1
-                    sheet_dict["include_pace"] = 1
-                    sheet_dict["include_hr"] = 1
-                    sheet_dict["default_worksheet"] = "Sheet1"
-                    
-                    # Ensure sheet_id is always a string (not None)
-                    if sheet_dict["sheet_id"] is None:
-                        sheet_dict["sheet_id"] = ""
-                        
-                    sheets.append(sheet_dict)
-                return sheets
-            else:
-                raise
+        return [dict(row) for row in conn.execute(SELECT_SPREADSHEETS_SQL)]
 
 # Function to get default spreadsheet
 def get_default_spreadsheet():
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        try:
-            cursor.execute("SELECT id, name, sheet_id, include_date, include_distance, include_time, include_pace, include_hr, default_worksheet FROM spreadsheets WHERE is_default = 1 LIMIT 1")
-            result = cursor.fetchone()
-            if result:
-                sheet_dict = dict(result)
-                # Ensure sheet_id is always a string (not None)
-                if sheet_dict["sheet_id"] is None:
-                    sheet_dict["sheet_id"] = ""
-                if sheet_dict["default_worksheet"] is None:
-                    sheet_dict["default_worksheet"] = "Sheet1"
-                return sheet_dict
-            return None
-        except sqlite3.OperationalError as e:
-            # If columns don't exist yet, fall back to basic query
-            if "no such column" in str(e):
-                logger.warning("Column missing in spreadsheets table, using fallback query")
-                cursor.execute("SELECT id, name, sheet_id FROM spreadsheets WHERE is_default = 1 LIMIT 1")
-                result = cursor.fetchone()
-                if result:
-                    sheet_dict = dict(result)
-                    # Add default values for missing columns
-                    sheet_dict["include_date"] = 1
-                    sheet_dict["include_distance"] = 1
-                    sheet_dict["include_time"] = 1
-                    sheet_dict["include_pace"] = 1
-                    sheet_dict["include_hr"] = 1
-                    sheet_dict["default_worksheet"] = "Sheet1"
-                    # Ensure sheet_id is always a string (not None)
-                    if sheet_dict["sheet_id"] is None:
-                        sheet_dict["sheet_id"] = ""
-                    return sheet_dict
-                return None
-            else:
-                raise
+        result = conn.execute(SELECT_DEFAULT_SPREADSHEET_SQL).fetchone()
+        return dict(result) if result else None
 
 # Function to get a spreadsheet by ID
 def get_spreadsheet(spreadsheet_id):
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        try:
-            cursor.execute("SELECT id, name, sheet_id, is_default, include_date, include_distance, include_time, include_pace, include_hr, default_worksheet FROM spreadsheets WHERE id = ?", (spreadsheet_id,))
-            result = cursor.fetchone()
-            if result:
-                sheet_dict = dict(result)
-                # Ensure sheet_id is always a string (not None)
-                if sheet_dict["sheet_id"] is None:
-                    sheet_dict["sheet_id"] = ""
-                if sheet_dict["default_worksheet"] is None:
-                    sheet_dict["default_worksheet"] = "Sheet1"
-                return sheet_dict
-            return None
-        except sqlite3.OperationalError as e:
-            # If columns don't exist yet, fall back to basic query
-            if "no such column" in str(e):
-                logger.warning("Column missing in spreadsheets table, using fallback query")
-                cursor.execute("SELECT id, name, sheet_id, is_default FROM spreadsheets WHERE id = ?", (spreadsheet_id,))
-                result = cursor.fetchone()
-                if result:
-                    sheet_dict = dict(result)
-                    # Add default values for missing columns
-                    sheet_dict["include_date"] = 1
-                    sheet_dict["include_distance"] = 1
-                    sheet_dict["include_time"] = 1
-                    sheet_dict["include_pace"] = 1
-                    sheet_dict["include_hr"] = 1
-                    sheet_dict["default_worksheet"] = "Sheet1"
-                    # Ensure sheet_id is always a string (not None)
-                    if sheet_dict["sheet_id"] is None:
-                        sheet_dict["sheet_id"] = ""
-                    return sheet_dict
-                return None
-            else:
-                raise
+        result = conn.execute(SELECT_SPREADSHEET_SQL, (spreadsheet_id,)).fetchone()
+        return dict(result) if result else None
 
 def get_strava_session(token=None, state=None):
+    from requests_oauthlib import OAuth2Session
+
     return OAuth2Session(
         CID, redirect_uri=REDIR, scope=SCOPES, state=state, token=token
     )
@@ -377,7 +1051,7 @@ def refresh_token(token):
         "refresh_token": token.get("refresh_token"),
     }
 
-    response = requests.post(refresh_url, data=payload)
+    response = strava_request(requests.post, refresh_url, data=payload)
     if response.status_code != 200:
         return None
 
@@ -414,9 +1088,12 @@ def store_token_with_session_id(session_id, token_data):
     
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        # Use REPLACE to handle both inserts and updates
+        # Upsert to handle both inserts and updates
         cursor.execute(
-            "REPLACE INTO sessions (session_id, token_data) VALUES (?, ?)",
+            """INSERT INTO sessions (session_id, token_data) VALUES (?, ?)
+               ON CONFLICT(session_id) DO UPDATE SET
+                   token_data = excluded.token_data,
+                   created_at = CURRENT_TIMESTAMP""",
             (session_id, token_json)
         )
         conn.commit()
@@ -433,6 +1110,167 @@ def delete_session(session_id):
         conn.commit()
 
 
+# Static asset pipeline
+#
+# Every file under static/ is fingerprinted with a hash of its contents, and
+# url_for('static', ...) transparently emits the fingerprinted name
+# (css/style.css -> css/style.<hash>.css). Fingerprinted URLs never change
+# content, so they are served with a one-year immutable Cache-Control and a
+# repeat page load makes no asset requests at all. Text assets are compressed
+# once per worker (gzip, plus brotli when the optional `brotli` package is
+# installed) and the best variant the client accepts is served. Text assets
+# that point at other static files with /static/... paths (the web app
+# manifest's icons, browserconfig.xml) get the fingerprinted names written
+# into them. In debug mode the manifest is rebuilt when a file changes.
+STATIC_CACHE_MAX_AGE = 365 * 24 * 60 * 60  # one year in seconds
+COMPRESSIBLE_ASSET_EXTENSIONS = {".css", ".js", ".json", ".xml", ".svg", ".txt"}
+
+_asset_manifest = None
+_asset_manifest_signature = None
+_asset_manifest_lock = threading.Lock()
+
+def _static_file_signature(static_folder):
+    """(path, mtime, size) of every static file; changes whenever one is edited, added or removed"""
+    signature = []
+    for root, _, files in os.walk(static_folder):
+        for file_name in files:
+            stat = os.stat(os.path.join(root, file_name))
+            signature.append((os.path.join(root, file_name), stat.st_mtime_ns, stat.st_size))
+    return tuple(sorted(signature))
+
+def _fingerprint_references(data, by_source, static_url_path):
+    """Point /static/<file> references in a text asset (also JSON-escaped \\/) at the fingerprinted files"""
+    prefix = re.escape(static_url_path.strip("/"))
+    pattern = re.compile(rf"(\\?/){prefix}(\\?/)([\w./\\-]+)".encode())
+
+    def replace(match):
+        slash = match.group(1).decode()
+        source = match.group(3).decode().replace("\\/", "/")
+        asset = by_source.get(source)
+        if asset is None:
+            return match.group(0)
+        hashed = asset["hashed"].replace("/", slash)
+        return f"{slash}{static_url_path.strip('/')}{slash}{hashed}".encode()
+
+    return pattern.sub(replace, data)
+
+def build_asset_manifest(static_folder, static_url_path="/static"):
+    """Fingerprint the static files and pre-compress the text assets"""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    manifest = {"by_source": {}, "by_hashed": {}}
+    paths = []
+    for root, _, files in os.walk(static_folder):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            paths.append((os.path.relpath(path, static_folder).replace(os.sep, "/"), path))
+    # Text assets last, so the files they reference are fingerprinted already
+    paths.sort(key=lambda item: os.path.splitext(item[0])[1].lower() in COMPRESSIBLE_ASSET_EXTENSIONS)
+
+    for source, path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        stem, ext = os.path.splitext(source)
+        if ext.lower() in COMPRESSIBLE_ASSET_EXTENSIONS:
+            data = _fingerprint_references(data, manifest["by_source"], static_url_path)
+
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        asset = {
+            "source": source,
+            "hashed": f"{stem}.{digest}{ext}",
+            "digest": digest,
+            "mimetype": mimetypes.guess_type(source)[0] or "application/octet-stream",
+            "encodings": {},
+        }
+
+        # Keep compressed bodies in memory only for text assets; binary
+        # files (icons) are already compressed and are streamed from disk
+        if ext.lower() in COMPRESSIBLE_ASSET_EXTENSIONS:
+            asset["encodings"]["identity"] = data
+            asset["encodings"]["gzip"] = gzip.compress(data, compresslevel=9, mtime=0)
+            if brotli is not None:
+                asset["encodings"]["br"] = brotli.compress(data)
+
+        manifest["by_source"][source] = asset
+        manifest["by_hashed"][asset["hashed"]] = asset
+
+    logger.info(f"Built static asset manifest with {len(manifest['by_source'])} files")
+    return manifest
+
+def get_asset_manifest():
+    """Return the asset manifest, building it on first use (in debug mode, again whenever a static file changes)"""
+    global _asset_manifest, _asset_manifest_signature
+    if _asset_manifest is not None and not app.debug:
+        return _asset_manifest
+    signature = _static_file_signature(app.static_folder) if app.debug else None
+    if _asset_manifest is not None and signature == _asset_manifest_signature:
+        return _asset_manifest
+    with _asset_manifest_lock:
+        if _asset_manifest is None or signature != _asset_manifest_signature:
+            _asset_manifest = build_asset_manifest(app.static_folder, app.static_url_path)
+            _asset_manifest_signature = signature
+    return _asset_manifest
+
+def _choose_asset_encoding(asset):
+    """Pick the smallest pre-compressed variant the client accepts"""
+    for encoding in ("br", "gzip"):
+        if encoding in asset["encodings"] and request.accept_encodings[encoding]:
+            return encoding
+    return "identity"
+
+@app.url_defaults
+def _fingerprint_static_urls(endpoint, values):
+    if endpoint == "static" and "filename" in values:
+        asset = get_asset_manifest()["by_source"].get(values["filename"])
+        if asset:
+            values["filename"] = asset["hashed"]
+
+def serve_static_asset(filename):
+    """Serve fingerprinted static files with long-lived immutable caching"""
+    asset = get_asset_manifest()["by_hashed"].get(filename)
+    if asset is None:
+        # Not a fingerprinted URL (e.g. a hard-coded /static/ path): default caching
+        return app.send_static_file(filename)
+
+    if asset["encodings"]:
+        encoding = _choose_asset_encoding(asset)
+        response = make_response(asset["encodings"][encoding])
+        response.mimetype = asset["mimetype"]
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        response.set_etag(f"{asset['digest']}-{encoding}")
+    else:
+        response = send_from_directory(
+            app.static_folder, asset["source"], max_age=STATIC_CACHE_MAX_AGE, etag=asset["digest"]
+        )
+
+    response.cache_control.public = True
+    response.cache_control.max_age = STATIC_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+app.view_functions["static"] = serve_static_asset
+
+@app.after_request
+def _add_json_etag(response):
+    """Let clients revalidate JSON API responses with If-None-Match"""
+    if (
+        request.method == "GET"
+        and response.status_code == 200
+        and response.mimetype == "application/json"
+        and not response.direct_passthrough
+    ):
+        response.add_etag()
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response = response.make_conditional(request)
+    return response
+
+
 @app.route("/")
 def home():
     # Try to get token from session first
@@ -495,7 +1333,7 @@ def callback():
         "grant_type": "authorization_code",
     }
 
-    response = requests.post(token_url, data=payload)
+    response = strava_request(requests.post, token_url, data=payload)
     if response.status_code != 200:
         flash(f"Error: Failed to get token. Please try again.")
         return redirect(url_for("home"))
@@ -523,27 +1361,83 @@ def callback():
     return resp
 
 
-@app.route("/preview_activities", methods=["POST"])
-def preview_activities():
-    token = session.get("token")
-    
-    # Try to get from cookie session ID if not in session
-    if not token and COOKIE_NAME in request.cookies:
-        session_id = request.cookies.get(COOKIE_NAME)
-        token = get_token_from_session_id(session_id)
-        if token:
-            session["token"] = token
-    
-    if not token:
-        flash("Please connect your Strava account first")
-        return redirect(url_for("home"))
+# Fields computed from stored activity streams (see analytics.py), with the
+# labels shown in the mapping form
+STREAM_METRIC_FIELDS = [
+    ("splits", "Km Splits"),
+    ("best_1k", "Best 1K"),
+    ("best_5k", "Best 5K"),
+    ("best_10k", "Best 10K"),
+    ("hr_zone_time", "HR Zones"),
+]
 
-    # Check if token is expired and refresh if needed
+# Fitness/fatigue/form on the activity's date, computed at import time from
+# all activities imported into the spreadsheet
+TRAINING_LOAD_FIELDS = [
+    ("ctl", "Fitness (CTL)"),
+    ("atl", "Fatigue (ATL)"),
+    ("tsb", "Form (TSB)"),
+]
+
+# Computed fields offered in the mapping form after the Strava values
+DERIVED_FIELDS = STREAM_METRIC_FIELDS + TRAINING_LOAD_FIELDS
+
+# Activity fields that can be mapped to spreadsheet headers, in display order
+IMPORT_FIELDS = ["date", "distance", "duration", "pace", "heart_rate", "strava_id"] + [
+    field for field, _ in DERIVED_FIELDS
+]
+
+# Fields whose value may be unknown for an activity (e.g. no streams
+# downloaded); an empty value never overwrites what the sheet already has
+OPTIONAL_IMPORT_FIELDS = {field for field, _ in DERIVED_FIELDS}
+
+# Used for heart-rate zones (fractions of the maximum) and TRIMP
+MAX_HEART_RATE = int(os.getenv("MAX_HEART_RATE", "190"))
+RESTING_HEART_RATE = int(os.getenv("RESTING_HEART_RATE", "60"))
+
+# When the Strava ID field is mapped to a header the worksheet does not have
+# yet, the column is added after the last header and hidden.
+STRAVA_ID_HEADER = "Strava ID"
+
+STRAVA_ACTIVITIES_URL = "https://www.strava.com/api/v3/athlete/activities"
+
+
+class SheetImportError(Exception):
+    """An import that cannot proceed. The message is safe to show to the user.
+
+    ``field`` names the mapped field that caused the failure (if any), and
+    ``endpoint`` is where the form-based flow should send the user next.
+    """
+
+    def __init__(self, message, field=None, endpoint="preview_activities"):
+        super().__init__(message)
+        self.message = message
+        self.field = field
+        self.endpoint = endpoint
+
+
+def get_authenticated_token():
+    """Return a valid Strava token for the current user, refreshing it if needed.
+
+    Returns None when the user is not connected or the refresh fails.
+    """
+    token = session.get("token")
+    
+    # Try to get from cookie session ID if not in session
+    if not token and COOKIE_NAME in request.cookies:
+        session_id = request.cookies.get(COOKIE_NAME)
+        token = get_token_from_session_id(session_id)
+        if token:
+            session["token"] = token
+    
+    if not token:
+        return None
+
+    # Check if token is expired and refresh if needed
     if is_token_expired(token):
         new_token = refresh_token(token)
         if not new_token:
-            flash("Your authentication has expired. Please login again.")
-            return redirect(url_for("login"))
+            return None
         token = new_token
         session["token"] = token
         session.permanent = True
@@ -553,13 +1447,79 @@ def preview_activities():
             session_id = request.cookies.get(COOKIE_NAME)
             store_token_with_session_id(session_id, token)
 
-    # Process form data
-    before = request.form.get("before")
-    after = request.form.get("after")
-    page = request.form.get("page", "1")
-    per_page = request.form.get("per_page", "30")
+    return token
+
+
+class CachedResponse:
+    """A successful Strava response rebuilt from the shared cache"""
+    status_code = 200
+    headers = {}
+
+    def __init__(self, data, stale=False):
+        self._data = data
+        self.stale = stale
+
+    def json(self):
+        return self._data
+
+
+class UnavailableResponse:
+    """Stands in for a Strava response when Strava could not be reached"""
+    status_code = 503
+    headers = {}
+    unavailable = True
+
+    def __init__(self, message):
+        self.message = message
+
+    def json(self):
+        return {"message": self.message}
+
+
+def strava_request(method, url, **kwargs):
+    """Call Strava with explicit timeouts through its circuit breaker.
+
+    Timeouts, connection errors and an open breaker come back as an
+    UnavailableResponse (status 503) instead of raising, so callers handle
+    them like any other failed answer.
+    """
+    try:
+        return strava_breaker.call(lambda: method(url, timeout=UPSTREAM_TIMEOUT, **kwargs))
+    except (UpstreamUnavailable, requests.RequestException) as e:
+        logger.warning(f"Strava request to {url} failed: {str(e)}")
+        return UnavailableResponse(str(e))
+
+
+def fetch_strava_activities(token, params):
+    """Fetch one page of the athlete's activities from the Strava API.
+
+    Successful pages are kept in the shared cache for STRAVA_PAGE_CACHE_TTL
+    seconds, keyed by access token and query, so showing the same page again
+    (from any worker) does not spend Strava rate limit. While Strava is down
+    the last good copy of the page is served, if there is one.
+    """
+    cache_key = "strava:activities:" + hashlib.sha256(
+        json.dumps([token["access_token"], params], sort_keys=True, default=str).encode()
+    ).hexdigest()
+    cached = cache_get(cache_key) if STRAVA_PAGE_CACHE_TTL > 0 else None
+    if cached is not None:
+        return CachedResponse(cached)
+
+    headers = {"Authorization": f"Bearer {token['access_token']}"}
+    resp = strava_request(requests.get, STRAVA_ACTIVITIES_URL, headers=headers, params=params)
+    if resp.status_code == 200:
+        cache_set(cache_key, resp.json(), STRAVA_PAGE_CACHE_TTL)
+        cache_set(cache_key + ":last-good", resp.json(), UPSTREAM_STALE_TTL)
+    elif resp.status_code >= 500:
+        stale = cache_get(cache_key + ":last-good")
+        if stale is not None:
+            logger.warning(f"Strava answered {resp.status_code}; serving the last good copy of the page")
+            return CachedResponse(stale, stale=True)
+    return resp
 
-    # Build query parameters
+
+def build_strava_params(before, after, page="1", per_page="30"):
+    """Build the query parameters for the Strava activities endpoint"""
     params = {"page": page, "per_page": per_page}
 
     if before:
@@ -568,83 +1528,57 @@ def preview_activities():
     if after:
         params["after"] = after
 
-    # Use the access_token from the token dictionary
-    headers = {"Authorization": f"Bearer {token['access_token']}"}
-    resp = requests.get(
-        "https://www.strava.com/api/v3/athlete/activities",
-        headers=headers,
-        params=params,
-    )
-
-    if resp.status_code != 200:
-        flash(f"Error accessing Strava API: {resp.status_code}")
-        return redirect(url_for("home"))
+    return params
 
-    acts = resp.json()
-    
-    if not acts:
-        flash("No activities found with the specified criteria")
-        return redirect(url_for("import_activities"))
 
-    # Process and format activities for display
-    formatted_activities = []
-    for a in acts:
-        # Format date (dd/mm/yyyy)
-        date_obj = datetime.strptime(a["start_date"], "%Y-%m-%dT%H:%M:%SZ")
-        formatted_date = date_obj.strftime("%d/%m/%Y")
-        
-        # Format distance (xx,yy km)
-        distance_km_numeric = round(a["distance"] / 1000, 2)
-        distance_km = str(distance_km_numeric).replace('.', ',')
-        
-        # Format duration (hh:mm:ss)
-        duration_seconds = a["moving_time"]
-        hours, remainder = divmod(duration_seconds, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        duration = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-        
-        # Calculate pace (min/km)
-        if distance_km_numeric > 0:
-            pace_seconds = duration_seconds / distance_km_numeric
-            pace_minutes, pace_remainder_seconds = divmod(pace_seconds, 60)
-            pace = f"{int(pace_minutes):02d}:{int(pace_remainder_seconds):02d}"
-        else:
-            pace = "00:00"
-            
-        # Get HR (if available)
-        avg_hr_raw = a.get("average_heartrate", "")
-        avg_hr = round(float(avg_hr_raw)) if avg_hr_raw != "" else ""
+def format_activity(a):
+    """Format a Strava activity summary into the values written to the sheet"""
+    # Format date (dd/mm/yyyy)
+    date_obj = datetime.strptime(a["start_date"], "%Y-%m-%dT%H:%M:%SZ")
+    formatted_date = date_obj.strftime("%d/%m/%Y")
+    
+    # Format distance (xx,yy km)
+    distance_km_numeric = round(a["distance"] / 1000, 2)
+    distance_km = str(distance_km_numeric).replace('.', ',')
+    
+    # Format duration (hh:mm:ss)
+    duration_seconds = a["moving_time"]
+    hours, remainder = divmod(duration_seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    duration = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    
+    # Calculate pace (min/km)
+    if distance_km_numeric > 0:
+        pace_seconds = duration_seconds / distance_km_numeric
+        pace_minutes, pace_remainder_seconds = divmod(pace_seconds, 60)
+        pace = f"{int(pace_minutes):02d}:{int(pace_remainder_seconds):02d}"
+    else:
+        pace = "00:00"
         
-        formatted_activities.append({
-            "date": formatted_date,
-            "distance": distance_km,
-            "duration": duration,
-            "pace": pace,
-            "heart_rate": avg_hr,
-            "name": a.get("name", "Activity"),
-            "type": a.get("type", "")
-        })
-
-    # Store the formatted activities in the session for later use
-    session["preview_activities"] = formatted_activities
-    session["import_params"] = {
-        "before": before,
-        "after": after,
-        "page": page,
-        "per_page": per_page
+    # Get HR (if available)
+    avg_hr_raw = a.get("average_heartrate", "")
+    avg_hr = round(float(avg_hr_raw)) if avg_hr_raw != "" else ""
+    
+    return {
+        "date": formatted_date,
+        "distance": distance_km,
+        "duration": duration,
+        "pace": pace,
+        "heart_rate": avg_hr,
+        "name": a.get("name", "Activity"),
+        "type": a.get("type", ""),
+        "strava_id": str(a["id"]) if a.get("id") is not None else ""
     }
-    
-    # Get all spreadsheets for selection
-    all_spreadsheets = get_spreadsheets()
-    
-    # Get selected spreadsheet ID from form if available
-    selected_spreadsheet_id = request.form.get("spreadsheet_id")
+
+
+def select_preview_spreadsheet(all_spreadsheets, selected_spreadsheet_id=None):
+    """Pick the requested spreadsheet, else the default one, else the first one"""
     selected_spreadsheet = None
     
     if selected_spreadsheet_id:
         # Find the selected spreadsheet in the list
         for sheet in all_spreadsheets:
-            if str(sheet["id"]) == selected_spreadsheet_id:
+            if str(sheet["id"]) == str(selected_spreadsheet_id):
                 selected_spreadsheet = sheet
                 break
     
@@ -658,56 +1592,150 @@ def preview_activities():
     # If still no spreadsheet, use the first one
     if not selected_spreadsheet and all_spreadsheets:
         selected_spreadsheet = all_spreadsheets[0]
+
+    return selected_spreadsheet
+
+
+def render_preview_page(formatted_activities, source, selected_spreadsheet_id=None, selected_worksheet=""):
+    """Render the preview page from already formatted activities.
+
+    Worksheet names, headers and saved mappings are loaded by the page itself
+    through the JSON endpoints, so rendering never calls Google or Strava.
+    """
+    all_spreadsheets = get_spreadsheets()
+    selected_spreadsheet = select_preview_spreadsheet(all_spreadsheets, selected_spreadsheet_id)
     
-    # Ensure sheet_id is included in the selected spreadsheet
     if selected_spreadsheet and not selected_spreadsheet.get("sheet_id"):
         logger.warning(f"Selected spreadsheet {selected_spreadsheet.get('name')} has no sheet_id")
-        print(f"DEBUG: Selected spreadsheet {selected_spreadsheet.get('name')} has no sheet_id")
-    else:
+    elif selected_spreadsheet:
         logger.info(f"Selected spreadsheet: {selected_spreadsheet.get('name')}, sheet_id: {selected_spreadsheet.get('sheet_id')}")
-        print(f"DEBUG: Selected spreadsheet: {selected_spreadsheet.get('name')}, sheet_id: {selected_spreadsheet.get('sheet_id')}")
-    
-    # Get worksheet names for the selected spreadsheet
-    worksheet_names = []
-    selected_worksheet = request.form.get("worksheet_name", "")
-    if selected_spreadsheet and selected_spreadsheet.get("sheet_id"):
-        try:
-            logger.info(f"Getting worksheets for selected spreadsheet: {selected_spreadsheet.get('name')} (ID: {selected_spreadsheet.get('sheet_id')})")
-            worksheet_names = get_worksheet_names(selected_spreadsheet.get("sheet_id"))
-            
-            # If no worksheet specified in form, use the default worksheet from spreadsheet settings
-            if not selected_worksheet:
-                if selected_spreadsheet.get("default_worksheet"):
-                    selected_worksheet = selected_spreadsheet.get("default_worksheet")
-                    logger.info(f"Using saved default worksheet: {selected_worksheet}")
-                elif worksheet_names:
-                    selected_worksheet = worksheet_names[0]  # Use first worksheet as fallback
-                    logger.info(f"No saved default worksheet, using first available: {selected_worksheet}")
-                else:
-                    selected_worksheet = "Sheet1"  # Final fallback
-                    
-        except Exception as e:
-            logger.error(f"Error getting worksheet names: {str(e)}")
-            worksheet_names = ["Sheet1"]
-            if not selected_worksheet:
-                selected_worksheet = "Sheet1"
     
-    # Get saved field mappings from session (if coming back from a failed import)
-    saved_field_mappings = session.get("saved_field_mappings")
-    saved_field_mappings_json = json.dumps(saved_field_mappings) if saved_field_mappings else "null"
+    # If no worksheet specified, use the default worksheet from spreadsheet settings
+    if not selected_worksheet:
+        if selected_spreadsheet and selected_spreadsheet.get("default_worksheet"):
+            selected_worksheet = selected_spreadsheet.get("default_worksheet")
+        else:
+            selected_worksheet = "Sheet1"
     
     return render_template(
         "preview_activities.html", 
         activities=formatted_activities, 
         spreadsheets=all_spreadsheets,
         selected_spreadsheet=selected_spreadsheet,
-        worksheet_names=worksheet_names,
+        worksheet_names=[selected_worksheet],
         selected_worksheet=selected_worksheet,
-        saved_field_mappings_json=saved_field_mappings_json,
-        source='import'
+        # Saved field mappings are present when coming back from a failed import
+        saved_field_mappings=session.get("saved_field_mappings"),
+        strava_id_header=STRAVA_ID_HEADER,
+        derived_fields=DERIVED_FIELDS,
+        import_key=session.get("import_key", ""),
+        source=source
+    )
+
+
+@app.route("/preview_activities", methods=["GET", "POST"])
+def preview_activities():
+    token = get_authenticated_token()
+    if not token:
+        flash("Please connect your Strava account first")
+        return redirect(url_for("home"))
+
+    # A GET re-renders the activities already previewed (e.g. after a failed
+    # import) without fetching them from Strava again
+    if request.method == "GET":
+        formatted_activities = session.get("preview_activities")
+        if not formatted_activities:
+            flash("No activities to import. Please preview activities first.")
+            return redirect(url_for("import_activities"))
+        return render_preview_page(
+            formatted_activities,
+            session.get("preview_source", "import"),
+            request.args.get("spreadsheet_id"),
+            request.args.get("worksheet_name", "")
+        )
+
+    # Process form data
+    before = request.form.get("before")
+    after = request.form.get("after")
+    page = request.form.get("page", "1")
+    per_page = request.form.get("per_page", "30")
+
+    resp = fetch_strava_activities(token, build_strava_params(before, after, page, per_page))
+
+    if resp.status_code != 200:
+        flash(f"Error accessing Strava API: {resp.status_code}")
+        return redirect(url_for("home"))
+
+    acts = resp.json()
+    
+    if not acts:
+        flash("No activities found with the specified criteria")
+        return redirect(url_for("import_activities"))
+
+    # Process and format activities for display
+    formatted_activities = [format_activity(a) for a in acts]
+    store_activity_summaries(acts)
+
+    # Opt-in: download the per-second streams for the previewed activities
+    if request.form.get("fetch_streams"):
+        stream_stats = ingest_activity_streams(token, [a["id"] for a in acts])
+        if stream_stats["deferred"]:
+            flash(f"Downloaded streams for {stream_stats['fetched']} activities; {stream_stats['deferred']} deferred because of the Strava rate limit")
+    add_stream_metrics(formatted_activities)
+
+    # Store the formatted activities in the session for later use
+    store_preview_session(formatted_activities, "import")
+    session["import_params"] = {
+        "before": before,
+        "after": after,
+        "page": page,
+        "per_page": per_page
+    }
+    
+    return render_preview_page(
+        formatted_activities,
+        "import",
+        request.form.get("spreadsheet_id"),
+        request.form.get("worksheet_name", "")
     )
 
 
+@app.route("/api/preview", methods=["GET", "POST"])
+def api_preview():
+    """JSON preview endpoint.
+
+    POST fetches and formats one page of Strava activities and stores it as the
+    current preview. GET returns the current preview without calling Strava.
+    """
+    token = get_authenticated_token()
+    if not token:
+        return jsonify({"error": "Not authenticated", "activities": []}), 401
+
+    if request.method == "GET":
+        return jsonify({
+            "activities": session.get("preview_activities") or [],
+            "import_params": session.get("import_params") or {}
+        })
+
+    data = request.get_json(silent=True) or {}
+    import_params = {
+        "before": data.get("before"),
+        "after": data.get("after"),
+        "page": str(data.get("page") or "1"),
+        "per_page": str(data.get("per_page") or "30")
+    }
+
+    resp = fetch_strava_activities(token, build_strava_params(**import_params))
+    if resp.status_code != 200:
+        return jsonify({"error": f"Error accessing Strava API: {resp.status_code}", "activities": []}), 502
+
+    formatted_activities = add_stream_metrics([format_activity(a) for a in resp.json()])
+    store_preview_session(formatted_activities, "import")
+    session["import_params"] = import_params
+
+    return jsonify({"activities": formatted_activities, "import_params": import_params, "import_key": session["import_key"]})
+
+
 @app.route("/import", methods=["GET", "POST"])
 def import_activities():
     token = session.get("token")
@@ -738,379 +1766,2235 @@ def import_activities():
             session_id = request.cookies.get(COOKIE_NAME)
             store_token_with_session_id(session_id, token)
 
-    # If it's a GET request, render the form
-    if request.method == "GET":
-        return render_template("import_form.html")
+    # If it's a GET request, render the form
+    if request.method == "GET":
+        return render_template("import_form.html")
+
+    # For POST requests, redirect to preview
+    return redirect(url_for("preview_activities"))
+
+
+def resolve_import_spreadsheet(spreadsheet_id):
+    """Return the spreadsheet to import into, falling back to the default"""
+    spreadsheet = None
+    if spreadsheet_id:
+        spreadsheet = get_spreadsheet(int(spreadsheet_id))
+    
+    if not spreadsheet:
+        spreadsheet = get_default_spreadsheet()
+
+    return spreadsheet
+
+
+def save_import_preferences(spreadsheet, worksheet_name, field_mappings):
+    """Remember the header mappings, column preferences and worksheet used for an import"""
+    # Save header mappings to database for future use
+    try:
+        save_header_mappings(spreadsheet["id"], worksheet_name, field_mappings)
+        logger.info(f"Saved header mappings for spreadsheet {spreadsheet['id']}, worksheet {worksheet_name}")
+    except Exception as e:
+        logger.error(f"Error saving header mappings: {str(e)}")
+
+    # Update column preferences based on the field mappings
+    include_date = 1 if "date" in field_mappings else 0
+    include_distance = 1 if "distance" in field_mappings else 0
+    include_time = 1 if "duration" in field_mappings else 0
+    include_pace = 1 if "pace" in field_mappings else 0
+    include_hr = 1 if "heart_rate" in field_mappings else 0
+    
+    # Save column preferences for this spreadsheet
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """UPDATE spreadsheets SET 
+                include_date = ?, 
+                include_distance = ?, 
+                include_time = ?, 
+                include_pace = ?, 
+                include_hr = ?,
+                default_worksheet = ?
+                WHERE id = ?""",
+            (
+                include_date,
+                include_distance,
+                include_time,
+                include_pace,
+                include_hr,
+                worksheet_name,
+                spreadsheet["id"]
+            )
+        )
+        conn.commit()
+        
+    logger.info(f"Updated column preferences and default worksheet for spreadsheet {spreadsheet['id']}: date={include_date}, distance={include_distance}, time={include_time}, pace={include_pace}, hr={include_hr}, default_worksheet={worksheet_name}")
+
+
+def open_spreadsheet(client, spreadsheet):
+    """Open a configured spreadsheet by ID, falling back to its name"""
+    import gspread
+
+    if spreadsheet.get("sheet_id"):
+        try:
+            logger.debug(f"Attempting to open spreadsheet by ID: {spreadsheet['sheet_id']}")
+            sheet_obj = client.open_by_key(spreadsheet["sheet_id"])
+            logger.info(f"Successfully opened spreadsheet by ID: {spreadsheet['sheet_id']}")
+            return sheet_obj
+        except gspread.exceptions.APIError as e:
+            logger.error(f"API Error when opening spreadsheet by ID: {str(e)}")
+            if "not found" in str(e).lower():
+                raise SheetImportError(
+                    f"Spreadsheet with ID '{spreadsheet['sheet_id']}' was not found. Make sure the ID is correct and the spreadsheet is shared with {get_service_account_email()}",
+                    endpoint="spreadsheets"
+                )
+            fallback_message = f"Could not open spreadsheet by ID or name. Please make sure the spreadsheet is shared with {get_service_account_email()}"
+        except Exception as e:
+            logger.error(f"Error opening by ID: {str(e)}")
+            fallback_message = f"Could not open spreadsheet. Please make sure the spreadsheet is shared with {get_service_account_email()}"
+    else:
+        fallback_message = f"Could not open spreadsheet '{spreadsheet['name']}'. Please make sure the spreadsheet is shared with {get_service_account_email()}"
+
+    try:
+        logger.debug(f"Opening spreadsheet by name: {spreadsheet['name']}")
+        sheet_obj = client.open(spreadsheet["name"])
+        logger.info(f"Successfully opened spreadsheet by name: {spreadsheet['name']}")
+        return sheet_obj
+    except Exception as e:
+        logger.error(f"Error opening by name: {str(e)}")
+        raise SheetImportError(fallback_message, endpoint="spreadsheets")
+
+
+def import_summary_message(spreadsheet, worksheet_name, total, added_count, updated_count):
+    """Build the user-facing summary of a finished import"""
+    if updated_count > 0 and added_count > 0:
+        return f"Successfully imported {total} activities to '{spreadsheet['name']}' (worksheet: {worksheet_name}): {added_count} new, {updated_count} updated!"
+    elif updated_count > 0:
+        return f"Successfully updated {updated_count} existing activities in '{spreadsheet['name']}' (worksheet: {worksheet_name})!"
+    else:
+        return f"Successfully added {added_count} new activities to '{spreadsheet['name']}' (worksheet: {worksheet_name})!"
+
+
+# Maximum number of ranges sent in one values.batchUpdate call. Larger plans
+# are split into several batches whose progress is recorded, so a failed
+# import can be resumed from the first batch that did not complete.
+IMPORT_BATCH_SIZE = 500
+
+
+def sheet_fingerprint(all_values):
+    """Hash the worksheet contents a plan was computed against"""
+    return hashlib.sha256(json.dumps(all_values, ensure_ascii=False).encode()).hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def _guess_date_key(text):
+    """The date for text in the first candidate format that fits it, else the text itself.
+
+    Memoised: a column whose format could not be inferred repeats the same
+    values, and each distinct one is only tried against the candidates once.
+    """
+    for fmt in DATE_FORMAT_CANDIDATES:
+        parsed = date_parser(fmt)(text)
+        if parsed is not None:
+            return parsed
+    return text
+
+
+def _date_key(value):
+    """Hashable key for a sheet date without a known column format"""
+    if _is_number(value):
+        return serial_to_date(value)
+    return _guess_date_key(normalize_sheet_value(str(value)).strip())
+
+
+def sheet_date_key(value, date_format=None):
+    """Hashable key for a date cell: the date when it parses with the column's format, else the text"""
+    if date_format is None:
+        return _date_key(value)
+    if _is_number(value):
+        return serial_to_date(value)
+    if date_format != SERIAL_DATE_FORMAT:
+        parsed = date_parser(date_format)(str(value))
+        if parsed is not None:
+            return parsed
+    return normalize_sheet_value(str(value)).strip()
+
+
+def activity_date_key(value):
+    """Hashable key for a formatted activity date"""
+    return date_parser(ACTIVITY_DATE_FORMAT)(value) or value
+
+
+# Cells sampled to infer a date column's format, and to check a cached format
+DATE_FORMAT_SAMPLE_SIZE = 200
+DATE_FORMAT_CHECK_SIZE = 20
+
+
+def _sample(values, size):
+    """Up to ``size`` values spread evenly over the list"""
+    return values[::max(1, len(values) // size)][:size]
+
+
+def infer_date_format(values):
+    """Infer a date column's format from its non-empty cells.
+
+    Returns (format, problem). ``format`` is the candidate that fits the
+    sampled text cells (or the one fitting most of them), SERIAL_DATE_FORMAT
+    when the column only holds real dates, or None when nothing fits.
+    ``problem`` describes mixed or unrecognised formats, else it is None.
+    """
+    texts = [normalize_sheet_value(str(v)).strip() for v in values if v not in ("", None) and not _is_number(v)]
+    if not texts:
+        return (SERIAL_DATE_FORMAT if any(v not in ("", None) for v in values) else None), None
+    texts = _sample(texts, DATE_FORMAT_SAMPLE_SIZE)
+
+    fits = {fmt: sum(1 for t in texts if date_parser(fmt)(t)) for fmt in DATE_FORMAT_CANDIDATES}
+    best = max(DATE_FORMAT_CANDIDATES, key=lambda fmt: fits[fmt])
+    if fits[best] == len(texts):
+        return best, None
+    misfits = [t for t in texts if not date_parser(best)(t)][:3]
+    if not fits[best]:
+        return None, f"unrecognised date format (e.g. {', '.join(repr(t) for t in misfits)})"
+    return best, f"mixed date formats: {fits[best]} of {len(texts)} sampled dates are {best}, others look like {', '.join(repr(t) for t in misfits)}"
+
+
+# How values of each field are compared with what the sheet already holds
+FIELD_VALUE_TYPES = {
+    "date": "date",
+    "distance": "number",
+    "duration": "duration",
+    "pace": "duration",
+    "heart_rate": "number",
+    "best_1k": "duration",
+    "best_5k": "duration",
+    "best_10k": "duration",
+    "ctl": "number",
+    "atl": "number",
+    "tsb": "number",
+}
+
+# Decimal places each numeric field is rounded to when formatted. The text
+# written can be shorter ("12,3" for 12.30 km), so the precision comes from
+# here rather than from the value.
+FIELD_DECIMALS = {
+    "distance": 2,
+    "heart_rate": 0,
+    "ctl": 1,
+    "atl": 1,
+    "tsb": 1,
+}
+
+# Durations are written to the second
+DURATION_TOLERANCE_S = 1
+
+
+def cells_equal(field, existing_value, new_value, date_format=None):
+    """Whether a cell read with UNFORMATTED_VALUE/SERIAL_NUMBER already holds the new value.
+
+    Dates are compared as dates, durations in seconds and numbers within half
+    a unit of the field's rounding (FIELD_DECIMALS), so "12,3" against 12.30,
+    or 00:25:00 against its day fraction, is not a change, but 12.34 is. Other fields (and
+    values that do not parse) are compared as text. ``date_format`` is the
+    sheet's date column format (see infer_date_format).
+    """
+    if existing_value is None or existing_value == "":
+        return new_value is None or new_value == ""
+    kind = FIELD_VALUE_TYPES.get(field)
+    if kind == "date":
+        old, new = sheet_date_key(existing_value, date_format), activity_date_key(new_value)
+        if not isinstance(old, str) and not isinstance(new, str):
+            return old == new
+    elif kind == "duration":
+        old, new = parse_sheet_duration(existing_value), parse_sheet_duration(new_value)
+        if old is not None and new is not None:
+            return abs(old - new) <= DURATION_TOLERANCE_S
+    elif kind == "number":
+        old, new = parse_sheet_number(existing_value), parse_sheet_number(new_value)
+        if old is not None and new is not None:
+            return abs(old - new) <= _decimal_tolerance(FIELD_DECIMALS.get(field, 0))
+    return values_equal(sheet_cell_text(existing_value), "" if new_value is None else str(new_value))
+
+
+def build_import_plan(all_values, field_mappings, formatted_activities, sheet=None, worksheet_name=None, append_only=False, date_format=None):
+    """Compute the full diff between previewed activities and a worksheet.
+
+    ``all_values`` is the current worksheet content (header row first), read
+    with UNFORMATTED_VALUE so numbers, durations and dates are typed. No
+    Google calls are made; the returned plan lists the header cells to write,
+    the cells to change in existing rows, the rows to append and the rows
+    that are already up to date. Raises SheetImportError for problems the
+    user can fix.
+
+    ``sheet`` is the target worksheet, or None when ``worksheet_name`` does
+    not exist yet; the plan's ``structure`` holds the batchUpdate requests
+    that create or prepare it (see plan_structure_requests).
+
+    Rows are matched by Strava activity ID when the ``strava_id`` field is
+    mapped, so several activities on one day each get their own row. Rows
+    without an ID (imported before the column existed) are matched by date
+    once, and the ID is written into them.
+
+    ``date_format`` is the date column's format from infer_date_format;
+    without it every date is parsed by guessing its format.
+
+    With ``append_only`` no rows are matched: ``all_values`` only needs the
+    header row and every activity becomes an appended row without a row
+    number, to be placed by the Sheets append API.
+    """
+    header_row = None
+    if not all_values:
+        # Add headers if sheet is empty and we have field mappings
+        if not field_mappings:
+            raise SheetImportError("No field mappings provided and sheet is empty. Please select at least one field to import.")
+        header_row = list(field_mappings.values())
+        all_values = [header_row]
+    
+    headers = [sheet_cell_text(header) for header in all_values[0]]
+    header_updates = []
+    hide_columns = []
+    
+    # Find column indices for each mapped field
+    column_indices = {}
+    for field, header in field_mappings.items():
+        if header in headers:
+            column_indices[field] = headers.index(header)
+        elif field == "strava_id":
+            # Add the ID column after the last header
+            column_indices[field] = len(headers)
+            header_updates.append({"range": f"{column_index_to_letter(len(headers))}1", "column": len(headers), "value": header})
+            headers.append(header)
+        else:
+            raise SheetImportError(f"Could not find '{header}' header in the spreadsheet", field=field)
+    
+    date_column_idx = column_indices.get("date")
+    id_column_idx = column_indices.get("strava_id")
+    if id_column_idx is not None and (header_row or header_updates):
+        hide_columns.append(id_column_idx)
+    
+    # Hash indexes built in one pass over the rows (row 1 is the header):
+    # activity ID -> row, and date -> row for rows that carry no ID
+    id_rows = {}
+    date_rows = {}
+    for i, row in enumerate(all_values[1:] if not append_only else [], start=2):
+        if id_column_idx is not None and len(row) > id_column_idx and row[id_column_idx]:
+            id_rows[sheet_cell_text(row[id_column_idx])] = i
+        elif date_column_idx is not None and len(row) > date_column_idx and row[date_column_idx]:
+            date_rows[sheet_date_key(row[date_column_idx], date_format)] = i
+    logger.info(f"Indexed {len(id_rows)} rows by Strava ID and {len(date_rows)} rows by date")
+    
+    # Find the first empty row for new entries
+    first_empty_row = len(all_values) + 1
+    
+    cell_updates = []
+    appends = {}  # row index -> planned row values
+    updated_rows = []
+    unchanged_rows = []
+    
+    if append_only:
+        for activity in formatted_activities:
+            values = dict(activity)
+            if values.get("strava_id"):
+                values["strava_id"] = f"'{values['strava_id']}"
+            row_values = [""] * len(headers)
+            for field, col_idx in column_indices.items():
+                row_values[col_idx] = values.get(field, "")
+            appends[first_empty_row] = row_values
+            first_empty_row += 1
+        formatted_activities_to_match = []
+    else:
+        formatted_activities_to_match = formatted_activities
+    
+    for activity in formatted_activities_to_match:
+        values = dict(activity)
+        # Stored as text so that Sheets never reformats long IDs as numbers
+        if values.get("strava_id"):
+            values["strava_id"] = f"'{values['strava_id']}"
+        
+        row_idx = None
+        if id_column_idx is not None and activity.get("strava_id"):
+            row_idx = id_rows.get(activity["strava_id"])
+        
+        date_key = activity_date_key(activity["date"]) if date_column_idx is not None and activity["date"] else None
+        if row_idx is None and date_key is not None:
+            if id_column_idx is not None:
+                # A row without an ID is claimed by one activity only
+                row_idx = date_rows.pop(date_key, None)
+            else:
+                row_idx = date_rows.get(date_key)
+        
+        if row_idx in appends:
+            # Same date as a row appended earlier in this import (date-only
+            # matching): the later activity's values replace the planned ones
+            for field, col_idx in column_indices.items():
+                if values.get(field, "") != "" or field not in OPTIONAL_IMPORT_FIELDS:
+                    appends[row_idx][col_idx] = values.get(field, "")
+        elif row_idx:
+            # Existing row - only change mapped cells whose value differs, to
+            # preserve formulas and unmapped columns
+            existing_row = all_values[row_idx - 1]
+            row_changes = []
+            for field, col_idx in column_indices.items():
+                old_value = existing_row[col_idx] if col_idx < len(existing_row) else ""
+                new_value = values.get(field, "")
+                
+                if new_value == "" and field in OPTIONAL_IMPORT_FIELDS:
+                    changed = False
+                else:
+                    # Typed comparison; e.g. a date keeps its original format
+                    # unless it is a different day
+                    changed = not cells_equal(field, old_value, new_value, date_format)
+                
+                if changed:
+                    row_changes.append({
+                        "range": f"{column_index_to_letter(col_idx)}{row_idx}",
+                        "row": row_idx,
+                        "field": field,
+                        "old": old_value,
+                        "new": new_value
+                    })
+            
+            if row_changes:
+                cell_updates.extend(row_changes)
+                updated_rows.append(row_idx)
+            else:
+                unchanged_rows.append(row_idx)
+        else:
+            # New row with values in the mapped positions
+            row_idx = first_empty_row
+            first_empty_row += 1
+            row_values = [""] * len(headers)
+            for field, col_idx in column_indices.items():
+                row_values[col_idx] = values.get(field, "")
+            appends[row_idx] = row_values
+            
+            if id_column_idx is not None and activity.get("strava_id"):
+                id_rows[activity["strava_id"]] = row_idx
+            elif date_key is not None:
+                date_rows[date_key] = row_idx
+    
+    plan = {
+        "create_worksheet": sheet is None,
+        "header_row": header_row,
+        "header_updates": header_updates,
+        "hide_columns": hide_columns,
+        "column_indices": column_indices,
+        "cell_updates": cell_updates,
+        "appends": [{"row": None if append_only else row, "values": values} for row, values in sorted(appends.items())],
+        "append_only": append_only,
+        "column_count": len(headers),
+        "updated_rows": updated_rows,
+        "unchanged_rows": unchanged_rows,
+        "total": len(formatted_activities)
+    }
+    plan["structure"] = plan_structure_requests(plan, sheet, worksheet_name)
+    return plan
+
+
+def plan_write_batches(plan):
+    """Turn a plan into ordered lists of {range, values} for values.batchUpdate.
+
+    Headers are written by the structural step (see plan_structure_requests)
+    and an append-only plan's rows by one values.append call, so neither is
+    included here.
+    """
+    data = []
+    # Contiguous appended rows are written as a single range
+    block = []
+    for append in plan["appends"] if not plan.get("append_only") else []:
+        if block and append["row"] != block[-1]["row"] + 1:
+            data.append({"range": f"A{block[0]['row']}", "values": [a["values"] for a in block]})
+            block = []
+        block.append(append)
+    if block:
+        data.append({"range": f"A{block[0]['row']}", "values": [a["values"] for a in block]})
+    
+    for update in plan["cell_updates"]:
+        data.append({"range": update["range"], "values": [[update["new"]]]})
+    
+    return [data[i:i + IMPORT_BATCH_SIZE] for i in range(0, len(data), IMPORT_BATCH_SIZE)]
+
+
+# Spare rows added whenever a worksheet is created or grown, so that the next
+# few imports fit without another resize
+WORKSHEET_ROW_HEADROOM = 100
+
+
+def plan_structure_requests(plan, sheet, worksheet_name):
+    """Spreadsheet batchUpdate requests that prepare the worksheet for a plan.
+
+    Creating the worksheet with a grid that fits the import, growing an
+    existing grid before rows are written past its end, writing new headers
+    and hiding bookkeeping columns are all sent as one request. Returns an
+    empty list when the worksheet needs no changes.
+    """
+    cols_needed = max(plan["column_count"], 1)
+    if plan.get("append_only"):
+        # INSERT_ROWS grows an existing grid by itself
+        rows_needed = 1 + len(plan["appends"]) if sheet is None else 0
+    else:
+        rows_needed = max([append["row"] for append in plan["appends"]] + [1])
+
+    requests_body = []
+    if sheet is None:
+        # Choosing the ID here lets the header and hide requests below refer
+        # to the new worksheet within the same call
+        sheet_id = random.randint(1, 2**31 - 1)
+        requests_body.append({"addSheet": {"properties": {
+            "sheetId": sheet_id,
+            "title": worksheet_name,
+            "gridProperties": {"rowCount": rows_needed + WORKSHEET_ROW_HEADROOM, "columnCount": cols_needed}
+        }}})
+    else:
+        sheet_id = sheet.id
+        grid = {}
+        if rows_needed > sheet.row_count:
+            grid["rowCount"] = rows_needed + WORKSHEET_ROW_HEADROOM
+        if cols_needed > sheet.col_count:
+            grid["columnCount"] = cols_needed
+        if grid:
+            requests_body.append({"updateSheetProperties": {
+                "properties": {"sheetId": sheet_id, "gridProperties": grid},
+                "fields": ",".join(f"gridProperties.{key}" for key in grid)
+            }})
+
+    header_cells = [(0, plan["header_row"])] if plan["header_row"] else []
+    header_cells += [(header["column"], [header["value"]]) for header in plan.get("header_updates", [])]
+    for col_idx, values in header_cells:
+        requests_body.append({"updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": 0, "columnIndex": col_idx},
+            "rows": [{"values": [{"userEnteredValue": {"stringValue": value}} for value in values]}],
+            "fields": "userEnteredValue"
+        }})
+
+    for col_idx in plan.get("hide_columns", []):
+        requests_body.append({"updateDimensionProperties": {
+            "range": {"sheetId": sheet_id, "dimension": "COLUMNS", "startIndex": col_idx, "endIndex": col_idx + 1},
+            "properties": {"hiddenByUser": True},
+            "fields": "hiddenByUser"
+        }})
+    return requests_body
+
+
+def plan_write_steps(plan):
+    """The ordered write requests a plan is executed (and resumed) in.
+
+    Each step is ("structure", batchUpdate requests), ("values", ranges for
+    values.batchUpdate) or ("append", rows for values.append).
+    """
+    steps = [("structure", plan["structure"])] if plan.get("structure") else []
+    steps += [("values", batch) for batch in plan_write_batches(plan)]
+    if plan.get("append_only") and plan["appends"]:
+        steps.append(("append", [append["values"] for append in plan["appends"]]))
+    return steps
+
+
+def plan_request_count(plan):
+    """Number of write steps a plan is executed (and resumed) in"""
+    return len(plan_write_steps(plan))
+
+
+def summarize_import_plan(plan):
+    """The dry-run view of a plan: counts plus the individual changes"""
+    return {
+        "plan_id": plan.get("id"),
+        "status": plan.get("status", "planned"),
+        "create_worksheet": plan["create_worksheet"],
+        "write_headers": bool(plan["header_row"] or plan.get("header_updates")),
+        "cells_to_change": len(plan["cell_updates"]),
+        "rows_to_update": len(plan["updated_rows"]),
+        "rows_to_append": len(plan["appends"]),
+        "unchanged_rows": len(plan["unchanged_rows"]),
+        "append_only": bool(plan.get("append_only")),
+        "write_requests": plan_request_count(plan),
+        "warnings": plan.get("warnings", []),
+        "changes": plan["cell_updates"],
+        "appends": plan["appends"]
+    }
+
+
+def save_import_plan(spreadsheet, worksheet_name, plan):
+    """Persist a plan so that it can be executed (or resumed) later"""
+    plan_id = str(uuid.uuid4())
+    plan["id"] = plan_id
+    plan["status"] = "planned"
+    with get_db_connection() as conn:
+        conn.execute(
+            """INSERT INTO import_plans
+               (id, spreadsheet_id, worksheet_name, plan_json, total_batches, completed_batches, status)
+               VALUES (?, ?, ?, ?, ?, 0, 'planned')""",
+            (plan_id, spreadsheet["id"], worksheet_name, json.dumps(plan), plan_request_count(plan))
+        )
+        conn.commit()
+    return plan_id
+
+
+def get_import_plan(plan_id):
+    """Load a stored plan with its execution progress"""
+    with get_db_connection() as conn:
+        row = conn.execute(
+            "SELECT id, spreadsheet_id, worksheet_name, plan_json, total_batches, completed_batches, status, error FROM import_plans WHERE id = ?",
+            (plan_id,)
+        ).fetchone()
+    if not row:
+        return None
+    record = dict(row)
+    record["plan"] = json.loads(record.pop("plan_json"))
+    record["plan"]["status"] = record["status"]
+    return record
+
+
+def update_import_plan_progress(plan_id, status, completed_batches=None, error=None):
+    """Record execution progress for a stored plan"""
+    with get_db_connection() as conn:
+        if completed_batches is None:
+            conn.execute(
+                "UPDATE import_plans SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (status, error, plan_id)
+            )
+        else:
+            conn.execute(
+                "UPDATE import_plans SET status = ?, completed_batches = ?, error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (status, completed_batches, error, plan_id)
+            )
+        conn.commit()
+
+
+def open_import_worksheet(spreadsheet, worksheet_name):
+    """Open the target worksheet; returns (spreadsheet object, worksheet or None)"""
+    import gspread
+
+    client = get_gspread_client()
+    
+    # Log the service account email for debugging
+    logger.info(f"Using service account: {get_service_account_email()}")
+    
+    sheet_obj = open_spreadsheet(client, spreadsheet)
+    try:
+        sheet = sheet_obj.worksheet(worksheet_name)
+        logger.info(f"Using worksheet: {worksheet_name}")
+    except gspread.exceptions.WorksheetNotFound:
+        sheet = None
+    return sheet_obj, sheet
+
+
+def read_plan_values(sheet, append_only=False):
+    """The worksheet content a plan is computed against: everything, or just the header row when appending"""
+    if sheet is None:
+        return []
+    if append_only:
+        header = sheet.row_values(1)
+        return [header] if header else []
+    # Typed values (numbers, day fractions, serial dates) so that unchanged
+    # cells compare equal however the sheet formats them
+    return sheet.get_all_values(value_render_option="UNFORMATTED_VALUE", date_time_render_option="SERIAL_NUMBER")
+
+
+def resolve_date_format(spreadsheet, worksheet_name, field_mappings, all_values):
+    """The date column's format: the cached one while it still fits, else inferred and cached.
+
+    Returns (format, warning); warning is a message about mixed or
+    unrecognised dates in the column, or None.
+    """
+    header = field_mappings.get("date")
+    headers = [sheet_cell_text(h) for h in all_values[0]] if all_values else []
+    if header not in headers:
+        return None, None
+    col_idx = headers.index(header)
+    column = [row[col_idx] for row in all_values[1:] if len(row) > col_idx and row[col_idx] not in ("", None)]
+    if not column:
+        return None, None
+
+    cached = get_date_format(spreadsheet["id"], worksheet_name)
+    if cached:
+        # Check the newest rows and a spread of older ones
+        check = column[-DATE_FORMAT_CHECK_SIZE:] + _sample(column, DATE_FORMAT_CHECK_SIZE)
+        if all(not isinstance(sheet_date_key(v, cached), str) for v in check):
+            return cached, None
+
+    date_format, problem = infer_date_format(column)
+    if problem:
+        logger.warning(f"Date column '{header}' in '{worksheet_name}': {problem}")
+        # Not cached, so the column is checked again on the next import
+        return date_format, f"The '{header}' column has {problem}. Rows whose date is in another format are only matched by Strava ID or identical text."
+    if date_format != cached:
+        save_date_format(spreadsheet["id"], worksheet_name, date_format)
+        logger.info(f"Inferred date format {date_format} for '{header}' in '{worksheet_name}'")
+    return date_format, None
+
+
+def plan_sheet_import(spreadsheet, worksheet_name, field_mappings, formatted_activities, append_only=False):
+    """Read the target worksheet once and compute an import plan (no writes)"""
+    quota_before = sheets_scheduler.thread_stats()
+    sheet_obj, sheet = open_import_worksheet(spreadsheet, worksheet_name)
+    all_values = read_plan_values(sheet, append_only)
+    if any(field in field_mappings for field, _ in TRAINING_LOAD_FIELDS):
+        add_training_load_fields(spreadsheet["id"], formatted_activities)
+    date_format, date_warning = (None, None) if append_only else resolve_date_format(spreadsheet, worksheet_name, field_mappings, all_values)
+    plan = build_import_plan(
+        all_values, field_mappings, formatted_activities,
+        sheet=sheet, worksheet_name=worksheet_name, append_only=append_only, date_format=date_format
+    )
+    plan["warnings"] = [date_warning] if date_warning else []
+    plan["sheet_fingerprint"] = sheet_fingerprint(all_values)
+    plan["field_mappings"] = field_mappings
+    plan["rollup_inputs"] = [c for c in (rollup_contribution(a) for a in formatted_activities) if c]
+    quota_after = sheets_scheduler.thread_stats()
+    plan["quota"] = {key: quota_after[key] - quota_before[key] for key in quota_after}
+    return plan, sheet_obj, sheet
+
+
+def execute_import_plan(spreadsheet, worksheet_name, record, sheet_obj=None, sheet=None, lease=None):
+    """Apply a stored plan with batched writes, resuming after the last completed batch.
+
+    A plan that has not started yet is only applied if the worksheet still
+    has the content it was computed against. With a ``lease`` (SheetLease),
+    writing stops before the next batch once the lease has been lost.
+    """
+    plan = record["plan"]
+    plan_id = record["id"]
+    completed = record["completed_batches"]
+    quota_before = sheets_scheduler.thread_stats()
+    
+    if record["status"] == "completed":
+        return import_plan_result(spreadsheet, worksheet_name, plan)
+    if record["status"] == "reverted":
+        raise SheetImportError("This import has been reverted. Please preview the activities again.")
+    if "structure" not in plan:
+        # Planned before worksheet changes were part of the plan
+        raise SheetImportError("This import was planned by an older version of the app. Please preview the activities again.")
+    
+    if sheet_obj is None:
+        sheet_obj, sheet = open_import_worksheet(spreadsheet, worksheet_name)
+        if completed == 0:
+            current_values = read_plan_values(sheet, plan.get("append_only"))
+            if sheet_fingerprint(current_values) != plan["sheet_fingerprint"]:
+                raise SheetImportError("The worksheet has changed since this import was planned. Please review the changes again.")
+    
+    steps = plan_write_steps(plan)
+    if completed == 0:
+        # Before the first write, so that a partial import can be reverted too
+        journal_import_plan(plan_id, plan)
+    update_import_plan_progress(plan_id, "running")
+    for step_number in range(completed, len(steps)):
+        kind, body = steps[step_number]
+        if lease is not None and lease.lost:
+            update_import_plan_progress(plan_id, "failed", step_number, "Lost the worksheet write lease")
+            raise SheetWriteError("Another worker took over writing to this worksheet; the import can be resumed.", plan_id)
+        try:
+            if kind == "structure":
+                response = sheet_obj.batch_update({"requests": body})
+                if sheet is None:
+                    # The new worksheet's properties come back in the reply; no extra read
+                    import gspread
+                    sheet = gspread.Worksheet(sheet_obj, response["replies"][0]["addSheet"]["properties"])
+                    logger.info(f"Created new worksheet: {worksheet_name}")
+                logger.info(f"Import plan {plan_id}: applied {len(body)} structural changes")
+            elif kind == "values":
+                # USER_ENTERED prevents Google Sheets from adding single quotes to time values
+                sheet.batch_update(body, value_input_option='USER_ENTERED')
+                logger.info(f"Import plan {plan_id}: wrote batch {step_number + 1}/{len(steps)} ({len(body)} ranges)")
+            else:
+                positions = list(range(len(body)))
+                if plan.get("append_after_row") is None:
+                    # Rows up to here were in the sheet before this plan
+                    # appended anything; a resume only looks past them
+                    record_append_start(plan_id, plan, len(sheet.col_values(append_key_column(plan) + 1)))
+                elif step_number == completed and record["status"] in ("running", "failed"):
+                    # An earlier attempt may have been applied without us
+                    # seeing the reply: do not append those rows twice
+                    placed = find_appended_rows(sheet, plan, body, get_date_format(spreadsheet["id"], worksheet_name))
+                    if placed:
+                        journal_placed_rows(plan_id, plan, placed)
+                        logger.info(f"Import plan {plan_id}: {len(placed)} rows were already appended")
+                    placed_positions = {position for position, _, _ in placed}
+                    positions = [position for position in positions if position not in placed_positions]
+                if positions:
+                    # Append-only plans: Google finds the end of the table and
+                    # inserts the rows there, so no row numbers are needed
+                    rows = [body[position] for position in positions]
+                    response = sheet.append_rows(rows, value_input_option='USER_ENTERED', insert_data_option='INSERT_ROWS', table_range='A1')
+                    journal_appended_rows(plan_id, plan, rows, response, positions)
+                    logger.info(f"Import plan {plan_id}: appended {len(rows)} rows")
+        except Exception as e:
+            logger.error(f"Import plan {plan_id} failed at batch {step_number + 1}/{len(steps)}: {str(e)}")
+            update_import_plan_progress(plan_id, "failed", step_number, str(e))
+            if kind == "structure" and sheet is None:
+                raise SheetImportError(f"Could not create worksheet '{worksheet_name}': {str(e)}")
+            raise
+        update_import_plan_progress(plan_id, "running", step_number + 1)
+    
+    if plan["structure"]:
+        # New worksheet or headers: cached worksheet lists and header rows are stale
+        invalidate_sheet_cache(spreadsheet["sheet_id"])
+    
+    update_import_plan_progress(plan_id, "completed", len(steps))
+    
+    if plan.get("rollup_inputs"):
+        # Training load first: it needs the previous contributions to find
+        # the earliest day that changed
+        advance_training_load(spreadsheet["id"], plan["rollup_inputs"])
+        update_activity_rollups(spreadsheet["id"], plan["rollup_inputs"])
+        write_rollup_summary(sheet_obj, spreadsheet["id"])
+    
+    quota_after = sheets_scheduler.thread_stats()
+    # A resumed plan already reported the waiting it did while planning
+    planning = (plan.get("quota") or {}) if completed == 0 else {}
+    quota = {key: quota_after[key] - quota_before[key] + planning.get(key, 0) for key in quota_after}
+    return import_plan_result(spreadsheet, worksheet_name, plan, quota)
+
+
+# Import journal
+#
+# Before a plan writes anything, the previous value of every cell it will
+# overwrite and the position of every row it will add are journalled under
+# the plan ID (the import ID returned by confirm_import; imports merged by
+# the write queue share one). Rows added through values.append are
+# journalled once Google reports where it put them. Reverting restores the
+# journalled values in one values.batchUpdate, skipping cells edited since.
+
+def _journal_entry(cell_range, fields, old, new):
+    return {"range": cell_range, "fields": fields, "old": old, "new": new}
+
+
+def _appended_rows_entry(first_row, rows, fields_by_column):
+    """One entry for a block of consecutive appended rows"""
+    width = max(max(len(values) for values in rows), 1)
+    last_column = column_index_to_letter(width - 1)
+    return _journal_entry(
+        f"A{first_row}:{last_column}{first_row + len(rows) - 1}",
+        [fields_by_column.get(i) for i in range(width)],
+        [[""] * width for _ in rows],
+        [list(values) + [""] * (width - len(values)) for values in rows]
+    )
+
+
+def _row_blocks(placed):
+    """Split (position, row number, values) items into runs of consecutive rows"""
+    blocks = []
+    for item in sorted(placed, key=lambda item: item[1]):
+        if blocks and item[1] == blocks[-1][-1][1] + 1 and item[0] == blocks[-1][-1][0] + 1:
+            blocks[-1].append(item)
+        else:
+            blocks.append([item])
+    return blocks
+
+
+def plan_journal_entries(plan):
+    """Journal entries for everything a plan writes at known positions"""
+    fields_by_column = {col_idx: field for field, col_idx in plan["column_indices"].items()}
+    entries = []
+    # New header cells: the header row of an empty sheet, or an added ID column
+    header_cells = [(0, plan["header_row"])] if plan["header_row"] else []
+    header_cells += [(header["column"], [header["value"]]) for header in plan.get("header_updates", [])]
+    for col_idx, values in header_cells:
+        cell_range = f"{column_index_to_letter(col_idx)}1:{column_index_to_letter(col_idx + len(values) - 1)}1"
+        entry = _journal_entry(cell_range, [None] * len(values), [[""] * len(values)], [values])
+        entry["header"] = True
+        entries.append(entry)
+    for update in plan["cell_updates"]:
+        entries.append(_journal_entry(update["range"], [update["field"]], [[update["old"]]], [[update["new"]]]))
+    # Contiguous appended rows are journalled as a single range, as they are written
+    placed = [(i, append["row"], append["values"]) for i, append in enumerate(plan["appends"]) if append["row"] is not None]
+    for block in _row_blocks(placed):
+        entries.append(_appended_rows_entry(block[0][1], [values for _, _, values in block], fields_by_column))
+    return entries
+
+
+def _save_journal_entries(plan_id, first_seq, entries):
+    # Resuming a plan journals the same entries again; the first copy stays
+    with get_db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO import_journal (plan_id, seq, entry_json) VALUES (?, ?, ?) ON CONFLICT(plan_id, seq) DO NOTHING",
+            [(plan_id, first_seq + i, json.dumps(entry)) for i, entry in enumerate(entries)]
+        )
+        conn.commit()
+
+
+def journal_import_plan(plan_id, plan):
+    _save_journal_entries(plan_id, 0, plan_journal_entries(plan))
+
+
+def journal_placed_rows(plan_id, plan, placed):
+    """Journal appended rows given as (position in the append step, row number, values).
+
+    Each run of consecutive rows is one entry, keyed by the position of its
+    first row so that journalling the same rows again on resume is a no-op.
+    """
+    fields_by_column = {col_idx: field for field, col_idx in plan["column_indices"].items()}
+    first_seq = len(plan_journal_entries(plan))
+    for block in _row_blocks(placed):
+        entry = _appended_rows_entry(block[0][1], [values for _, _, values in block], fields_by_column)
+        _save_journal_entries(plan_id, first_seq + block[0][0], [entry])
+
+
+def journal_appended_rows(plan_id, plan, rows, response, positions=None):
+    """Journal rows placed by values.append, from the range in its response"""
+    updated_range = ((response or {}).get("updates") or {}).get("updatedRange", "")
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    if not match:
+        logger.warning(f"Import plan {plan_id}: append response has no range; the appended rows cannot be reverted")
+        return
+    first_row = int(match.group(1))
+    positions = positions if positions is not None else range(len(rows))
+    journal_placed_rows(plan_id, plan, [(position, first_row + i, values) for i, (position, values) in enumerate(zip(positions, rows))])
+
+
+def append_key_column(plan):
+    """Column whose last value marks the end of the table: Strava ID, else date, else the first mapped one"""
+    column_indices = plan["column_indices"]
+    return column_indices.get("strava_id", column_indices.get("date", min(column_indices.values())))
+
+
+def record_append_start(plan_id, plan, last_row):
+    """Store the last row of the table before the plan's first append attempt"""
+    plan["append_after_row"] = last_row
+    with get_db_connection() as conn:
+        conn.execute("UPDATE import_plans SET plan_json = ? WHERE id = ?", (json.dumps(plan), plan_id))
+        conn.commit()
+
+
+def find_appended_rows(sheet, plan, rows, date_format=None):
+    """Rows of an append step that are in the worksheet already, as (position, row number, values).
+
+    values.append is not idempotent, and an attempt that timed out or got a
+    5xx may still have been applied. Only rows below the table end recorded
+    before the first attempt are considered: an append-only import may
+    repeat activities that were in the sheet already, and those rows are
+    not the plan's. Rows are found by Strava ID when that column is mapped;
+    otherwise the step counts as applied when the end of the worksheet
+    holds exactly its rows.
+    """
+    after_row = plan.get("append_after_row")
+    if after_row is None:
+        # Never attempted
+        return []
+    id_column_idx = plan["column_indices"].get("strava_id")
+    if id_column_idx is not None:
+        id_rows = {
+            sheet_cell_text(value): row_idx
+            for row_idx, value in enumerate(sheet.col_values(id_column_idx + 1), start=1)
+            if value and row_idx > after_row
+        }
+        return [
+            (position, id_rows[str(values[id_column_idx]).lstrip("'")], values)
+            for position, values in enumerate(rows)
+            if str(values[id_column_idx]).lstrip("'") in id_rows
+        ]
+
+    all_values = read_plan_values(sheet)
+    first_row = len(all_values) - len(rows) + 1
+    if first_row <= max(after_row, 1):
+        return []
+    fields_by_column = {col_idx: field for field, col_idx in plan["column_indices"].items()}
+    for existing, values in zip(all_values[first_row - 1:], rows):
+        for col_idx, field in fields_by_column.items():
+            old_value = existing[col_idx] if col_idx < len(existing) else ""
+            new_value = values[col_idx] if col_idx < len(values) else ""
+            if not cells_equal(field, old_value, new_value, date_format):
+                return []
+    return [(position, first_row + position, values) for position, values in enumerate(rows)]
+
+
+def get_import_journal(plan_id):
+    with get_db_connection() as conn:
+        rows = conn.execute("SELECT entry_json FROM import_journal WHERE plan_id = ? ORDER BY seq", (plan_id,)).fetchall()
+    return [json.loads(row["entry_json"]) for row in rows]
+
+
+def _journal_entry_state(entry, current, date_format):
+    """'old' if the range still holds its previous values, 'new' if it holds what the import wrote, else 'edited'"""
+    states = set()
+    for r, (old_row, new_row) in enumerate(zip(entry["old"], entry["new"])):
+        current_row = current[r] if r < len(current) else []
+        for c, (old, new) in enumerate(zip(old_row, new_row)):
+            value = current_row[c] if c < len(current_row) else ""
+            if value == old or (value in ("", None) and old in ("", None)):
+                states.add("old")
+            elif cells_equal(entry["fields"][c], value, new, date_format):
+                states.add("new")
+            else:
+                return "edited"
+    return "new" if "new" in states else "old"
+
+
+# Ranges per values.batchGet when reverting; the ranges go in the URL
+REVERT_READ_BATCH_SIZE = 100
+
+
+def _entry_rows(entry):
+    """Split a journal entry for a block of rows into one entry per row"""
+    if len(entry["new"]) == 1:
+        return [entry]
+    match = re.match(r"([A-Z]+)(\d+):([A-Z]+)\d+$", entry["range"])
+    first_column, first_row, last_column = match.group(1), int(match.group(2)), match.group(3)
+    return [
+        dict(entry, range=f"{first_column}{first_row + i}:{last_column}{first_row + i}", old=[old], new=[new])
+        for i, (old, new) in enumerate(zip(entry["old"], entry["new"]))
+    ]
+
+
+def revert_import(spreadsheet, worksheet_name, plan_id):
+    """Restore the cells an import wrote to their journalled values.
+
+    Batched reads (REVERT_READ_BATCH_SIZE ranges each) find cells edited
+    since the import; those ranges are left alone and reported, row by row
+    for blocks of appended rows. Everything else is restored with a single
+    values.batchUpdate, and the plan is marked reverted. Appended rows are
+    cleared rather than deleted, so the next import fills them again.
+    """
+    from gspread.utils import absolute_range_name
+
+    entries = get_import_journal(plan_id)
+    if not entries:
+        raise SheetImportError("Nothing was written by this import, so there is nothing to revert.")
+
+    sheet_obj = open_spreadsheet(get_gspread_client(), spreadsheet)
+    ranges = [absolute_range_name(worksheet_name, entry["range"]) for entry in entries]
+    current = []
+    for i in range(0, len(ranges), REVERT_READ_BATCH_SIZE):
+        current += sheet_obj.values_batch_get(
+            ranges[i:i + REVERT_READ_BATCH_SIZE],
+            params={"valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "SERIAL_NUMBER"}
+        ).get("valueRanges", [])
+    date_format = get_date_format(spreadsheet["id"], worksheet_name)
+
+    data = []
+    edited = []
+    headers_restored = False
+    for i, entry in enumerate(entries):
+        values = current[i].get("values", []) if i < len(current) else []
+        row_entries = _entry_rows(entry)
+        states = [_journal_entry_state(row_entry, values[r:r + 1], date_format) for r, row_entry in enumerate(row_entries)]
+        if "edited" not in states:
+            # The whole range is restored at once
+            row_entries, states = [entry], ["new" if "new" in states else "old"]
+        for row_entry, state in zip(row_entries, states):
+            if state == "edited":
+                edited.append(row_entry["range"])
+            elif state == "new":
+                data.append({"range": absolute_range_name(worksheet_name, row_entry["range"]), "values": row_entry["old"]})
+                headers_restored = headers_restored or entry.get("header", False)
+
+    if data:
+        # RAW: the journalled values are the typed values that were read
+        sheet_obj.values_batch_update({"valueInputOption": "RAW", "data": data})
+        if headers_restored:
+            invalidate_sheet_cache(spreadsheet["sheet_id"])
+    update_import_plan_progress(plan_id, "reverted")
+    logger.info(f"Reverted import plan {plan_id}: restored {len(data)} ranges, skipped {len(edited)} edited since")
+
+    message = f"Reverted {len(data)} changes in '{spreadsheet['name']}' (worksheet: {worksheet_name})."
+    if edited:
+        message += f" Cells edited since the import were left as they are: {', '.join(edited[:10])}"
+        if len(edited) > 10:
+            message += ", ..."
+    return {"plan_id": plan_id, "reverted": len(data), "edited": edited, "message": message}
+
+
+def import_plan_result(spreadsheet, worksheet_name, plan, quota=None):
+    """Summary of an executed plan, with the time spent waiting on the Sheets quota"""
+    added_count = len(plan["appends"])
+    updated_count = len(plan["updated_rows"])
+    quota = quota or {"throttled_seconds": 0.0, "retries": 0}
+    message = import_summary_message(spreadsheet, worksheet_name, plan["total"], added_count, updated_count)
+    if quota["throttled_seconds"] >= 1:
+        message += f" (waited {quota['throttled_seconds']:.0f}s for the Google Sheets quota)"
+    for warning in plan.get("warnings", []):
+        message += f" Note: {warning}"
+    return {
+        "plan_id": plan.get("id"),
+        "total": plan["total"],
+        "added": added_count,
+        "updated": updated_count,
+        "unchanged": len(plan["unchanged_rows"]),
+        "throttled_seconds": round(quota["throttled_seconds"], 1),
+        "retries": quota["retries"],
+        "warnings": plan.get("warnings", []),
+        "message": message
+    }
+
+
+class SheetWriteError(Exception):
+    """A queued import failed while writing; ``plan_id`` can be resumed"""
+
+    def __init__(self, message, plan_id=None):
+        super().__init__(message)
+        self.plan_id = plan_id
+
+
+class SheetImportQueued(Exception):
+    """An import is waiting behind another write to its worksheet; the lease holder will write it"""
+
+    def __init__(self, entry_id=None):
+        super().__init__("The import is queued behind another import into this worksheet and will be written shortly.")
+        self.entry_id = entry_id
+
+
+# Writes to one worksheet are serialised: a plan is computed from a read of
+# the sheet and then written at fixed row numbers, so two imports must never
+# interleave. Imports enqueue themselves in SQLite; whoever holds the
+# worksheet's lease writes everything queued for it, merging imports with the
+# same mapping into one plan, while imports into other worksheets proceed in
+# parallel. Works across threads and worker processes.
+SHEET_LOCK_LEASE_SECONDS = 600
+# The holder renews its lease (and marks its entries alive) this often, so a
+# long write under quota waits or backoff never outlives the lease
+SHEET_LOCK_HEARTBEAT_SECONDS = SHEET_LOCK_LEASE_SECONDS / 4
+SHEET_QUEUE_POLL_SECONDS = 0.2
+SHEET_QUEUE_TIMEOUT_SECONDS = 900
+
+
+def _sheet_key(spreadsheet, worksheet_name):
+    return f"{spreadsheet.get('sheet_id') or spreadsheet['name']}|{worksheet_name}"
+
+
+def acquire_sheet_lock(sheet_key, owner):
+    """Take (or take over an expired) write lease; returns True on success"""
+    now = time.time()
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            """INSERT INTO sheet_write_locks (sheet_key, owner, expires_at) VALUES (?, ?, ?)
+               ON CONFLICT(sheet_key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+               WHERE sheet_write_locks.expires_at < ? OR sheet_write_locks.owner = excluded.owner""",
+            (sheet_key, owner, now + SHEET_LOCK_LEASE_SECONDS, now)
+        )
+        conn.commit()
+        return cursor.rowcount == 1
+
+
+def release_sheet_lock(sheet_key, owner):
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM sheet_write_locks WHERE sheet_key = ? AND owner = ?", (sheet_key, owner))
+        conn.commit()
+
+
+class SheetLease:
+    """Renews a held worksheet lease from a side thread while its holder writes.
+
+    Each heartbeat extends the lease and stamps the holder's running queue
+    entries. If the lease cannot be renewed because another worker took it
+    over, ``lost`` is set and the holder must stop writing.
+    """
+
+    def __init__(self, sheet_key, owner):
+        self.sheet_key = sheet_key
+        self.owner = owner
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"sheet-lease-{owner}", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(SHEET_LOCK_HEARTBEAT_SECONDS):
+            self.beat()
+
+    def beat(self):
+        try:
+            if not acquire_sheet_lock(self.sheet_key, self.owner):
+                logger.error(f"Lost the write lease on {self.sheet_key}")
+                self.lost = True
+                self._stop.set()
+                return
+            with get_db_connection() as conn:
+                conn.execute(
+                    "UPDATE sheet_write_queue SET heartbeat_at = ? WHERE owner = ? AND status = 'running'",
+                    (time.time(), self.owner)
+                )
+                conn.commit()
+        except Exception as e:
+            # The lease is still valid until it expires; try again on the next beat
+            logger.warning(f"Could not renew the write lease on {self.sheet_key}: {str(e)}")
+
+
+@contextmanager
+def sheet_write_lock(spreadsheet, worksheet_name):
+    """Hold a worksheet's write lease for the duration of the block, waiting for it if needed.
+
+    Yields the SheetLease that keeps it renewed.
+    """
+    sheet_key = _sheet_key(spreadsheet, worksheet_name)
+    owner = f"{os.getpid()}-{threading.get_ident()}-{uuid.uuid4().hex[:8]}"
+    deadline = time.monotonic() + SHEET_QUEUE_TIMEOUT_SECONDS
+    while not acquire_sheet_lock(sheet_key, owner):
+        if time.monotonic() > deadline:
+            raise SheetImportError("Another import into this worksheet is still running. Please try again in a few minutes.")
+        time.sleep(SHEET_QUEUE_POLL_SECONDS)
+    try:
+        with SheetLease(sheet_key, owner) as lease:
+            yield lease
+    finally:
+        release_sheet_lock(sheet_key, owner)
+
+
+def import_failure_outcome(error):
+    """JSON-safe record of a failed import, turned back into the error by raise_import_failure"""
+    if isinstance(error, SheetImportError):
+        return {"error": error.message, "field": error.field, "endpoint": error.endpoint, "user_error": True}
+    return {"error": str(error), "plan_id": getattr(error, "plan_id", None)}
+
+
+def raise_import_failure(outcome):
+    if outcome.get("user_error"):
+        raise SheetImportError(outcome["error"], field=outcome.get("field"), endpoint=outcome.get("endpoint", "preview_activities"))
+    raise SheetWriteError(outcome["error"], outcome.get("plan_id"))
+
+
+def _finish_queue_entries(entry_ids, status, outcome):
+    with get_db_connection() as conn:
+        conn.executemany(
+            "UPDATE sheet_write_queue SET status = ?, result = ? WHERE id = ?",
+            [(status, json.dumps(outcome), entry_id) for entry_id in entry_ids]
+        )
+        conn.commit()
+
+
+def process_sheet_write_queue(sheet_key, owner, worksheet_name, lease=None):
+    """Write everything queued for a worksheet; the caller holds its lease.
+
+    Entries still marked 'running' are only picked up again once their
+    holder has stopped heartbeating for a whole lease period. Entries with
+    the same spreadsheet and mapping are merged into a single plan: one
+    sheet read, one batched write. Returns the number of entries taken.
+    """
+    now = time.time()
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            """SELECT id, spreadsheet_id, payload FROM sheet_write_queue
+               WHERE sheet_key = ? AND (status = 'pending'
+                   OR (status = 'running' AND (owner = ? OR COALESCE(heartbeat_at, 0) < ?)))
+               ORDER BY id""",
+            (sheet_key, owner, now - SHEET_LOCK_LEASE_SECONDS)
+        ).fetchall()
+        if not rows:
+            return 0
+        conn.executemany(
+            "UPDATE sheet_write_queue SET status = 'running', owner = ?, heartbeat_at = ? WHERE id = ?",
+            [(owner, now, row["id"]) for row in rows]
+        )
+        conn.commit()
+
+    groups = {}
+    for row in rows:
+        payload = json.loads(row["payload"])
+        append_only = payload.get("append_only", False)
+        key = (row["spreadsheet_id"], json.dumps(payload["field_mappings"], sort_keys=True), append_only)
+        group = groups.setdefault(key, {"ids": [], "field_mappings": payload["field_mappings"], "append_only": append_only, "activities": []})
+        group["ids"].append(row["id"])
+        group["activities"].extend(payload["activities"])
+
+    for (spreadsheet_id, _, _), group in groups.items():
+        spreadsheet = get_spreadsheet(spreadsheet_id)
+        if len(group["ids"]) > 1:
+            logger.info(f"Merging {len(group['ids'])} queued imports into one write for {sheet_key}")
+        plan_id = None
+        try:
+            if not spreadsheet:
+                raise SheetImportError("The spreadsheet was removed before the import ran.", endpoint="spreadsheets")
+            plan, sheet_obj, sheet = plan_sheet_import(
+                spreadsheet, worksheet_name, group["field_mappings"], group["activities"], append_only=group["append_only"]
+            )
+            plan_id = save_import_plan(spreadsheet, worksheet_name, plan)
+            result = execute_import_plan(spreadsheet, worksheet_name, get_import_plan(plan_id), sheet_obj, sheet, lease)
+            result["merged_imports"] = len(group["ids"])
+            _finish_queue_entries(group["ids"], "done", result)
+        except SheetImportError as e:
+            _finish_queue_entries(group["ids"], "failed", import_failure_outcome(e))
+        except Exception as e:
+            logger.error(f"Queued import into {sheet_key} failed: {str(e)}")
+            _finish_queue_entries(group["ids"], "failed", import_failure_outcome(SheetWriteError(str(e), plan_id)))
+        if lease is not None and lease.lost:
+            break
+        # Keep the lease for the next group
+        acquire_sheet_lock(sheet_key, owner)
+    return len(rows)
+
+
+def _has_queued_writes(sheet_key):
+    with get_db_connection() as conn:
+        row = conn.execute(
+            "SELECT 1 FROM sheet_write_queue WHERE sheet_key = ? AND status IN ('pending', 'running') LIMIT 1", (sheet_key,)
+        ).fetchone()
+    return row is not None
+
+
+def drain_sheet_write_queue(sheet_key, worksheet_name):
+    """Write a worksheet's queue if its lease is free; returns at once when another worker holds it.
+
+    The holder keeps writing until the queue is empty, and checks again
+    after releasing the lease, so an import queued while it was finishing
+    is never left behind.
+    """
+    owner = f"{os.getpid()}-{threading.get_ident()}-{uuid.uuid4().hex[:8]}"
+    while acquire_sheet_lock(sheet_key, owner):
+        try:
+            with SheetLease(sheet_key, owner) as lease:
+                while process_sheet_write_queue(sheet_key, owner, worksheet_name, lease) and not lease.lost:
+                    pass
+        finally:
+            release_sheet_lock(sheet_key, owner)
+        if lease.lost or not _has_queued_writes(sheet_key):
+            return
+
+
+def _take_queue_outcome(entry_id):
+    """The outcome of a finished queue entry (removing it), or None while it is not finished"""
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT status, result FROM sheet_write_queue WHERE id = ?", (entry_id,)).fetchone()
+        if row is None or row["status"] not in ("done", "failed"):
+            return None
+        conn.execute("DELETE FROM sheet_write_queue WHERE id = ?", (entry_id,))
+        conn.commit()
+    return row["status"], json.loads(row["result"])
+
+
+def run_sheet_import(spreadsheet, worksheet_name, field_mappings, formatted_activities, append_only=False, wait=True):
+    """Import activities into a worksheet, serialised with other imports into it.
+
+    With ``append_only`` every activity is appended as a new row, without
+    reading the worksheet beyond its header or matching existing rows.
+
+    Returns a summary dict. Raises SheetImportError for problems the user
+    can fix and SheetWriteError when writing failed (its plan can be
+    resumed through the import plan API). While another worker holds the
+    worksheet's lease, ``wait=False`` raises SheetImportQueued straight
+    away (the holder writes the queued import); otherwise the call waits
+    for the outcome, as the command line does.
+    """
+    sheet_key = _sheet_key(spreadsheet, worksheet_name)
+    payload = json.dumps({"field_mappings": field_mappings, "activities": formatted_activities, "append_only": append_only})
+    with get_db_connection() as conn:
+        # Outcomes nobody collected (e.g. the submitting worker died)
+        conn.execute("DELETE FROM sheet_write_queue WHERE status IN ('done', 'failed') AND created_at < datetime('now', '-1 day')")
+        entry_id = conn.execute(
+            "INSERT INTO sheet_write_queue (sheet_key, spreadsheet_id, worksheet_name, payload) VALUES (?, ?, ?, ?)",
+            (sheet_key, spreadsheet["id"], worksheet_name, payload)
+        ).lastrowid
+        conn.commit()
+
+    deadline = time.monotonic() + SHEET_QUEUE_TIMEOUT_SECONDS
+    while True:
+        drain_sheet_write_queue(sheet_key, worksheet_name)
+        outcome = _take_queue_outcome(entry_id)
+        if outcome:
+            status, result = outcome
+            if status == "done":
+                return result
+            raise_import_failure(result)
+        if not wait:
+            raise SheetImportQueued(entry_id)
+
+        if time.monotonic() > deadline:
+            with get_db_connection() as conn:
+                withdrawn = conn.execute(
+                    "DELETE FROM sheet_write_queue WHERE id = ? AND status = 'pending'", (entry_id,)
+                ).rowcount
+                conn.commit()
+            if withdrawn:
+                raise SheetImportError("Another import into this worksheet is still running. Please try again in a few minutes.")
+            # Already being written by the lock holder; wait for its outcome
+            deadline = time.monotonic() + SHEET_QUEUE_TIMEOUT_SECONDS
+        time.sleep(SHEET_QUEUE_POLL_SECONDS)
+
+
+# Idempotent confirms. Every preview carries a random import key, sent back
+# with its confirm. The first confirm with a key runs the import; a repeat
+# (double click, browser retry) replays the stored outcome without touching
+# the sheet again, or is told that the first run is still in progress.
+# A confirm whose worksheet is being written by another worker is 'queued'
+# under its key: the lease holder writes it, and polling the key (see
+# settle_queued_import) collects the outcome, so no request thread waits
+# for the queue.
+# A run that failed before writing anything does not burn the key, so the
+# user can fix the mapping and confirm the same preview again. A run that
+# failed part-way through its writes is 'interrupted': the key stays bound
+# to its stored plan, and the next confirm resumes that plan rather than
+# planning (and appending) the same activities a second time.
+IMPORT_REQUEST_LEASE_SECONDS = SHEET_QUEUE_TIMEOUT_SECONDS + SHEET_LOCK_LEASE_SECONDS
+
+
+def request_idempotency_key(source):
+    """The import key of a confirm, from the request body or an Idempotency-Key header"""
+    key = source.get("idempotency_key") or request.headers.get("Idempotency-Key") or ""
+    return key.strip()[:128] or None
+
+
+def claim_import_request(idempotency_key, owner):
+    """Claim a key for a new run; returns None when claimed, else the key's (status, result)"""
+    now = time.time()
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM import_requests WHERE created_at < datetime('now', '-1 day')")
+        # Failed and interrupted runs may be retried, and a run whose owner
+        # died is taken over; plan_id is kept so the retry can resume it
+        cursor = conn.execute(
+            """INSERT INTO import_requests (idempotency_key, owner, expires_at) VALUES (?, ?, ?)
+               ON CONFLICT(idempotency_key) DO UPDATE SET
+                   status = 'running', owner = excluded.owner, expires_at = excluded.expires_at, result = NULL
+               WHERE import_requests.status IN ('failed', 'interrupted')
+                   OR (import_requests.status = 'running' AND import_requests.expires_at < ?)""",
+            (idempotency_key, owner, now + IMPORT_REQUEST_LEASE_SECONDS, now)
+        )
+        conn.commit()
+        if cursor.rowcount == 1:
+            return None
+    return get_import_request(idempotency_key)
+
+
+def get_import_request(idempotency_key):
+    """(status, result) of a confirmed import key, or None if unknown or its run died"""
+    if not idempotency_key:
+        return None
+    with get_db_connection() as conn:
+        row = conn.execute(
+            "SELECT status, result, expires_at FROM import_requests WHERE idempotency_key = ?", (idempotency_key,)
+        ).fetchone()
+    if row is None or (row["status"] == "running" and row["expires_at"] < time.time()):
+        return None
+    return row["status"], json.loads(row["result"]) if row["result"] else None
+
+
+def get_import_request_plan(idempotency_key):
+    """ID of the plan an interrupted run of this key left behind, if any"""
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT plan_id FROM import_requests WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+    return row["plan_id"] if row else None
+
+
+def finish_import_request(idempotency_key, owner, status, result, plan_id=None):
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE import_requests SET status = ?, result = ?, plan_id = ? WHERE idempotency_key = ? AND owner = ?",
+            (status, json.dumps(result), plan_id, idempotency_key, owner)
+        )
+        conn.commit()
+
+
+def _failure_status(outcome, resume_plan_id=None):
+    """Status a key gets from a failed run (see import_failure_outcome), and the plan it stays on"""
+    if outcome.get("user_error"):
+        # Nothing was written: release the key for another attempt
+        return "failed", None
+    plan_id = outcome.get("plan_id") or resume_plan_id
+    if plan_id:
+        # Some batches may be in the sheet already: keep the key on this plan
+        outcome["plan_id"] = plan_id
+        return "interrupted", plan_id
+    # Failed before a plan was stored, so before any write
+    return "failed", None
+
+
+def settle_queued_import(idempotency_key, queued):
+    """Collect the outcome of a key's queued import; returns the key's (status, result).
+
+    Writes the worksheet's queue first if its lease is free, so the import
+    moves on even when the worker that held the lease has died.
+    """
+    entry_id = queued["queue_entry"]
+    with get_db_connection() as conn:
+        entry = conn.execute(
+            "SELECT sheet_key, worksheet_name FROM sheet_write_queue WHERE id = ?", (entry_id,)
+        ).fetchone()
+    if entry is not None:
+        drain_sheet_write_queue(entry["sheet_key"], entry["worksheet_name"])
+    outcome = _take_queue_outcome(entry_id)
+    if outcome is not None:
+        queue_status, result = outcome
+        status, plan_id = ("done", None) if queue_status == "done" else _failure_status(result)
+    elif entry is None:
+        # Collected by a concurrent poll, or expired from the queue
+        status, plan_id, result = "failed", None, {"error": "The queued import was lost. Please import the activities again."}
+    else:
+        return get_import_request(idempotency_key)
+    with get_db_connection() as conn:
+        # Only the first poll to see the outcome records it
+        conn.execute(
+            "UPDATE import_requests SET status = ?, result = ?, plan_id = ? WHERE idempotency_key = ? AND status = 'queued'",
+            (status, json.dumps(result), plan_id, idempotency_key)
+        )
+        conn.commit()
+    return get_import_request(idempotency_key)
+
+
+def resume_import_plan(plan_id):
+    """Finish writing a stored plan under its worksheet's write lease"""
+    record = get_import_plan(plan_id)
+    spreadsheet = get_spreadsheet(record["spreadsheet_id"]) if record else None
+    if not spreadsheet:
+        raise SheetImportError("The interrupted import can no longer be resumed. Please preview the activities again.")
+    logger.info(f"Resuming import plan {plan_id}")
+    with sheet_write_lock(spreadsheet, record["worksheet_name"]) as lease:
+        return execute_import_plan(spreadsheet, record["worksheet_name"], get_import_plan(plan_id), lease=lease)
+
+
+def run_idempotent_import(idempotency_key, run_import):
+    """Run ``run_import()`` once per import key and return its summary.
+
+    A repeat with the same key gets the stored summary of the first run
+    (marked ``replayed``), or that run's error, instead of importing again;
+    if the first run was interrupted while writing, the repeat resumes its
+    plan. Raises SheetImportQueued while the key's import is queued or
+    still being written by another request. Without a key the import
+    simply runs.
+    """
+    if not idempotency_key:
+        return run_import()
+
+    owner = f"{os.getpid()}-{threading.get_ident()}-{uuid.uuid4().hex[:8]}"
+    existing = claim_import_request(idempotency_key, owner)
+    while existing is not None:
+        status, result = existing
+        if status == "done":
+            logger.info(f"Replaying the result of import {idempotency_key}")
+            return dict(result, replayed=True)
+        if status == "failed":
+            raise_import_failure(result)
+        if status == "interrupted":
+            # Resume it here, unless another repeat got to it first
+            existing = claim_import_request(idempotency_key, owner)
+            continue
+        if status == "queued":
+            existing = settle_queued_import(idempotency_key, result)
+            if existing is None:
+                # The key expired meanwhile; start over with it
+                existing = claim_import_request(idempotency_key, owner)
+            elif existing[0] == "queued":
+                raise SheetImportQueued(result["queue_entry"])
+            continue
+        # Still being written by another request
+        raise SheetImportQueued()
+
+    resume_plan_id = get_import_request_plan(idempotency_key)
+    try:
+        result = resume_import_plan(resume_plan_id) if resume_plan_id else run_import()
+    except SheetImportQueued as e:
+        finish_import_request(idempotency_key, owner, "queued", {"queue_entry": e.entry_id})
+        raise
+    except Exception as e:
+        outcome = import_failure_outcome(e)
+        status, plan_id = _failure_status(outcome, resume_plan_id)
+        finish_import_request(idempotency_key, owner, status, outcome, plan_id)
+        raise
+    finish_import_request(idempotency_key, owner, "done", result, resume_plan_id)
+    return result
+
+
+def import_preview(idempotency_key, spreadsheet, worksheet_name, field_mappings, formatted_activities, append_only=False):
+    """Import the previewed activities, once per import key"""
+    def run_import():
+        # A repeat whose first run failed runs again, and needs the preview for that
+        if not formatted_activities:
+            raise SheetImportError("No activities to import. Please preview activities first.", endpoint="import_activities")
+        return run_sheet_import(spreadsheet, worksheet_name, field_mappings, formatted_activities, append_only, wait=False)
+
+    return run_idempotent_import(idempotency_key, run_import)
+
+
+# Weekly and monthly rollups
+#
+# Kept in SQLite per spreadsheet and updated incrementally from the activities
+# of each import, then written to a summary worksheet so the sheet itself
+# does not need SUMIFs over the whole log. The app only ever writes to a
+# summary worksheet it created itself (tracked by sheetId), never to an
+# existing tab that happens to have the same name. Set ROLLUP_WORKSHEET to
+# an empty value to keep the rollups in the database only.
+ROLLUP_WORKSHEET = os.getenv("ROLLUP_WORKSHEET", "Strava Rollups")
+ROLLUP_COLUMNS = 13
+ROLLUP_HEADERS = ["Start", "Activities", "Distance (km)", "Time", "Avg Pace", "Avg HR"]
+
+
+def _parse_duration_seconds(value):
+    """Seconds from an hh:mm:ss or mm:ss string"""
+    seconds = 0
+    for part in str(value).split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def rollup_contribution(activity):
+    """What one formatted activity adds to the rollups, or None if it cannot be counted"""
+    if not activity.get("strava_id"):
+        return None
+    try:
+        activity_date = datetime.strptime(activity["date"], "%d/%m/%Y").date()
+        distance_m = float(str(activity["distance"]).replace(",", ".")) * 1000
+        moving_time_s = _parse_duration_seconds(activity["duration"])
+    except (KeyError, ValueError):
+        logger.warning(f"Skipping activity {activity.get('strava_id')} in rollups: unparseable values")
+        return None
+    heart_rate = activity.get("heart_rate")
+    return {
+        "activity_id": str(activity["strava_id"]),
+        "activity_date": activity_date.isoformat(),
+        "distance_m": distance_m,
+        "moving_time_s": moving_time_s,
+        "heart_rate": float(heart_rate) if heart_rate not in ("", None) else None,
+    }
+
+
+def _rollup_periods(activity_date):
+    """The (period, period_start) keys an activity date falls into"""
+    day = datetime.strptime(activity_date, "%Y-%m-%d").date()
+    week_start = day - timedelta(days=day.weekday())
+    return [("week", week_start.isoformat()), ("month", day.replace(day=1).isoformat())]
+
+
+def _rollup_deltas(contribution, sign):
+    """Rows of (period, period_start, count, distance, time, hr sum, hr time) for one contribution"""
+    has_hr = contribution["heart_rate"] is not None
+    hr_time = contribution["moving_time_s"] if has_hr else 0
+    hr_sum = contribution["heart_rate"] * hr_time if has_hr else 0
+    return [
+        (period, period_start, sign, sign * contribution["distance_m"], sign * contribution["moving_time_s"],
+         sign * hr_sum, sign * hr_time)
+        for period, period_start in _rollup_periods(contribution["activity_date"])
+    ]
+
+
+def update_activity_rollups(spreadsheet_id, contributions):
+    """Apply imported activities to the rollups without rescanning the log.
+
+    Each activity's previous contribution (if it was imported before) is
+    subtracted and the new one added, so re-importing is idempotent and an
+    edited activity moves correctly between periods.
+    """
+    contributions = list({c["activity_id"]: c for c in contributions}.values())
+    if not contributions:
+        return
+    with get_db_connection() as conn:
+        previous = {}
+        ids = [c["activity_id"] for c in contributions]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for row in conn.execute(
+                f"""SELECT activity_id, activity_date, distance_m, moving_time_s, heart_rate
+                    FROM rollup_contributions WHERE spreadsheet_id = ? AND activity_id IN ({placeholders})""",
+                [spreadsheet_id] + chunk
+            ):
+                previous[row["activity_id"]] = dict(row)
+
+        # Sum all deltas per period first so each period row is written once
+        deltas = {}
+        for contribution in contributions:
+            rows = _rollup_deltas(contribution, 1)
+            if contribution["activity_id"] in previous:
+                old = previous[contribution["activity_id"]]
+                if old == contribution:
+                    continue
+                rows += _rollup_deltas(old, -1)
+            for period, period_start, *values in rows:
+                totals = deltas.setdefault((period, period_start), [0, 0.0, 0, 0.0, 0])
+                for j, value in enumerate(values):
+                    totals[j] += value
+
+        conn.executemany(
+            """INSERT INTO activity_rollups
+               (spreadsheet_id, period, period_start, activity_count, distance_m, moving_time_s, hr_weighted_sum, hr_time_s)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(spreadsheet_id, period, period_start) DO UPDATE SET
+                   activity_count = activity_rollups.activity_count + excluded.activity_count,
+                   distance_m = activity_rollups.distance_m + excluded.distance_m,
+                   moving_time_s = activity_rollups.moving_time_s + excluded.moving_time_s,
+                   hr_weighted_sum = activity_rollups.hr_weighted_sum + excluded.hr_weighted_sum,
+                   hr_time_s = activity_rollups.hr_time_s + excluded.hr_time_s""",
+            [(spreadsheet_id, period, period_start, *totals) for (period, period_start), totals in deltas.items()]
+        )
+        conn.execute("DELETE FROM activity_rollups WHERE spreadsheet_id = ? AND activity_count <= 0", (spreadsheet_id,))
+        conn.executemany(
+            """INSERT INTO rollup_contributions
+               (spreadsheet_id, activity_id, activity_date, distance_m, moving_time_s, heart_rate)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(spreadsheet_id, activity_id) DO UPDATE SET
+                   activity_date = excluded.activity_date,
+                   distance_m = excluded.distance_m,
+                   moving_time_s = excluded.moving_time_s,
+                   heart_rate = excluded.heart_rate""",
+            [
+                (spreadsheet_id, c["activity_id"], c["activity_date"], c["distance_m"], c["moving_time_s"], c["heart_rate"])
+                for c in contributions
+            ]
+        )
+        conn.commit()
+    logger.info(f"Updated {len(deltas)} rollup periods for spreadsheet {spreadsheet_id}")
+
+
+def get_activity_rollups(spreadsheet_id, period):
+    """Rollup rows for one period type, newest first, formatted like the activity values"""
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            """SELECT period_start, activity_count, distance_m, moving_time_s, hr_weighted_sum, hr_time_s
+               FROM activity_rollups WHERE spreadsheet_id = ? AND period = ? ORDER BY period_start DESC""",
+            (spreadsheet_id, period)
+        ).fetchall()
+    rollups = []
+    for row in rows:
+        distance_km = round(row["distance_m"] / 1000, 2)
+        hours, remainder = divmod(int(row["moving_time_s"]), 3600)
+        minutes, seconds = divmod(remainder, 60)
+        pace = ""
+        if distance_km > 0:
+            pace_minutes, pace_seconds = divmod(row["moving_time_s"] / distance_km, 60)
+            pace = f"{int(pace_minutes):02d}:{int(pace_seconds):02d}"
+        rollups.append({
+            "start": datetime.strptime(row["period_start"], "%Y-%m-%d").strftime("%d/%m/%Y"),
+            "count": row["activity_count"],
+            "distance": str(distance_km).replace(".", ","),
+            "duration": f"{hours:02d}:{minutes:02d}:{seconds:02d}",
+            "pace": pace,
+            "heart_rate": round(row["hr_weighted_sum"] / row["hr_time_s"]) if row["hr_time_s"] else "",
+        })
+    return rollups
+
+
+def get_rollup_sheet_id(spreadsheet_id):
+    """sheetId of the summary worksheet the app created in this spreadsheet, if any"""
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT rollup_sheet_id FROM spreadsheets WHERE id = ?", (spreadsheet_id,)).fetchone()
+    return row["rollup_sheet_id"] if row else None
+
+
+def set_rollup_sheet_id(spreadsheet_id, sheet_id):
+    with get_db_connection() as conn:
+        conn.execute("UPDATE spreadsheets SET rollup_sheet_id = ? WHERE id = ?", (sheet_id, spreadsheet_id))
+        conn.commit()
+
+
+def _summary_cell(value):
+    """CellData for one summary value; counts, distances and heart rates as numbers"""
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    try:
+        return {"userEnteredValue": {"numberValue": float(value.replace(",", "."))}}
+    except ValueError:
+        return {"userEnteredValue": {"stringValue": value}}
+
+
+def rollup_summary_requests(spreadsheet_id, sheet_id, create):
+    """batchUpdate requests that (create or resize and) clear the summary worksheet, then fill it"""
+    sections = []
+    for period, title, first_column in (("week", "Weekly", 0), ("month", "Monthly", 7)):
+        rows = [[title], ROLLUP_HEADERS]
+        rows += [
+            [r["start"], r["count"], r["distance"], r["duration"], r["pace"], r["heart_rate"]]
+            for r in get_activity_rollups(spreadsheet_id, period)
+        ]
+        sections.append((first_column, rows))
+    grid = {
+        "rowCount": max(len(rows) for _, rows in sections) + WORKSHEET_ROW_HEADROOM,
+        "columnCount": ROLLUP_COLUMNS,
+    }
+
+    if create:
+        requests_body = [{"addSheet": {"properties": {"sheetId": sheet_id, "title": ROLLUP_WORKSHEET, "gridProperties": grid}}}]
+    else:
+        # The worksheet only holds the summary, so it is resized to fit and cleared whole
+        requests_body = [
+            {"updateSheetProperties": {
+                "properties": {"sheetId": sheet_id, "gridProperties": grid},
+                "fields": "gridProperties.rowCount,gridProperties.columnCount"
+            }},
+            {"updateCells": {"range": {"sheetId": sheet_id}, "fields": "userEnteredValue"}},
+        ]
+    for first_column, rows in sections:
+        requests_body.append({"updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": 0, "columnIndex": first_column},
+            "rows": [{"values": [_summary_cell(value) for value in row]} for row in rows],
+            "fields": "userEnteredValue"
+        }})
+    return requests_body
+
+
+def write_rollup_summary(sheet_obj, spreadsheet_id):
+    """Rewrite weekly (columns A-F) and monthly (H-M) rollups with one spreadsheets.batchUpdate call.
+
+    The first call creates the summary worksheet in that same call and
+    remembers its sheetId; later calls clear and refill that worksheet. If a
+    tab with the summary's name exists that the app did not create, nothing
+    is written.
+    """
+    if not ROLLUP_WORKSHEET:
+        return
+    sheet_id = get_rollup_sheet_id(spreadsheet_id)
+    create = sheet_id is None
+    try:
+        if create:
+            if ROLLUP_WORKSHEET in fetch_worksheet_names(sheet_obj.id):
+                logger.warning(
+                    f"Not writing rollups: worksheet '{ROLLUP_WORKSHEET}' was not created by this app. "
+                    "Rename it or set ROLLUP_WORKSHEET to another name."
+                )
+                return
+            sheet_id = random.randint(1, 2**31 - 1)
+        sheet_obj.batch_update({"requests": rollup_summary_requests(spreadsheet_id, sheet_id, create)})
+    except Exception as e:
+        # The import itself succeeded; the summary is refreshed on the next one
+        logger.warning(f"Could not write rollup summary: {str(e)}")
+        if not create:
+            forget_deleted_rollup_worksheet(sheet_obj, spreadsheet_id, sheet_id)
+        invalidate_sheet_cache(sheet_obj.id)
+        return
+    if create:
+        logger.info(f"Created summary worksheet '{ROLLUP_WORKSHEET}'")
+        set_rollup_sheet_id(spreadsheet_id, sheet_id)
+        invalidate_sheet_cache(sheet_obj.id)
+
+
+def forget_deleted_rollup_worksheet(sheet_obj, spreadsheet_id, sheet_id):
+    """Drop the stored sheetId once its worksheet is gone, so the next import creates a new one"""
+    try:
+        if sheet_id not in [ws.id for ws in sheet_obj.worksheets()]:
+            set_rollup_sheet_id(spreadsheet_id, None)
+    except Exception as e:
+        logger.warning(f"Could not check for the summary worksheet: {str(e)}")
+
+
+# Training load
+#
+# Daily load is the sum of each activity's Banister TRIMP (moving minutes
+# weighted by heart-rate reserve), or minutes x TRAINING_LOAD_DEFAULT_INTENSITY
+# for activities without heart rate. Fitness (CTL) and fatigue (ATL) are
+# exponentially weighted averages of daily load over 42 and 7 days; form
+# (TSB) is yesterday's CTL - ATL. The state of every day is stored, so an
+# import only advances it from the earliest day it touches.
+CTL_DAYS = 42
+ATL_DAYS = 7
+TRAINING_LOAD_DEFAULT_INTENSITY = float(os.getenv("TRAINING_LOAD_DEFAULT_INTENSITY", "1.0"))
+
+
+def activity_training_load(moving_time_s, heart_rate):
+    """TRIMP for one activity, or duration x default intensity without heart rate"""
+    minutes = moving_time_s / 60
+    if heart_rate is None:
+        return minutes * TRAINING_LOAD_DEFAULT_INTENSITY
+    reserve = (heart_rate - RESTING_HEART_RATE) / max(MAX_HEART_RATE - RESTING_HEART_RATE, 1)
+    reserve = min(max(reserve, 0.0), 1.0)
+    return minutes * reserve * 0.64 * math.exp(1.92 * reserve)
+
+
+def _format_load(value):
+    """One decimal with a decimal comma, like the other numeric sheet values"""
+    return str(round(value, 1)).replace(".", ",")
+
+
+def compute_training_load(conn, spreadsheet_id, contributions):
+    """Advance the stored state over the days affected by ``contributions``.
+
+    ``contributions`` (see rollup_contribution) replace whatever the same
+    activities contributed before. Starts from the stored state of the day
+    before the earliest affected date and returns {day: (load, ctl, atl)}
+    for that day onwards, up to the last day with a stored state or load.
+    Returns {} when nothing changed.
+    """
+    previous = {}
+    ids = [c["activity_id"] for c in contributions]
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        for row in conn.execute(
+            f"""SELECT activity_id, activity_date, distance_m, moving_time_s, heart_rate
+                FROM rollup_contributions WHERE spreadsheet_id = ? AND activity_id IN ({placeholders})""",
+            [spreadsheet_id] + chunk
+        ):
+            previous[row["activity_id"]] = dict(row)
+
+    changed = [c for c in contributions if previous.get(c["activity_id"]) != c]
+    if not changed:
+        return {}
+    # An activity whose date changed also affects its old date
+    start = min(
+        [c["activity_date"] for c in changed]
+        + [previous[c["activity_id"]]["activity_date"] for c in changed if c["activity_id"] in previous]
+    )
+
+    # Daily loads from the start date on: stored activities not being replaced, plus the new ones
+    replaced = {c["activity_id"] for c in contributions}
+    daily_load = {}
+    for row in conn.execute(
+        "SELECT activity_id, activity_date, moving_time_s, heart_rate FROM rollup_contributions WHERE spreadsheet_id = ? AND activity_date >= ?",
+        (spreadsheet_id, start)
+    ):
+        if row["activity_id"] not in replaced:
+            daily_load[row["activity_date"]] = daily_load.get(row["activity_date"], 0.0) + activity_training_load(row["moving_time_s"], row["heart_rate"])
+    for c in contributions:
+        if c["activity_date"] >= start:
+            daily_load[c["activity_date"]] = daily_load.get(c["activity_date"], 0.0) + activity_training_load(c["moving_time_s"], c["heart_rate"])
+
+    start_day = datetime.strptime(start, "%Y-%m-%d").date()
+    seed = conn.execute(
+        "SELECT day, ctl, atl FROM training_load WHERE spreadsheet_id = ? AND day < ? ORDER BY day DESC LIMIT 1",
+        (spreadsheet_id, start)
+    ).fetchone()
+    ctl, atl = (seed["ctl"], seed["atl"]) if seed else (0.0, 0.0)
+    if seed:
+        # Decay across any rest days between the last stored state and the start date
+        gap = (start_day - datetime.strptime(seed["day"], "%Y-%m-%d").date()).days - 1
+        ctl *= (1 - 1 / CTL_DAYS) ** gap
+        atl *= (1 - 1 / ATL_DAYS) ** gap
+
+    last_stored = conn.execute(
+        "SELECT MAX(day) FROM training_load WHERE spreadsheet_id = ?", (spreadsheet_id,)
+    ).fetchone()[0]
+    end = max([d for d in (last_stored, max(daily_load, default=None)) if d] + [start])
+    end_day = datetime.strptime(end, "%Y-%m-%d").date()
+
+    states = {}
+    day = start_day
+    while day <= end_day:
+        key = day.isoformat()
+        load = daily_load.get(key, 0.0)
+        ctl += (load - ctl) / CTL_DAYS
+        atl += (load - atl) / ATL_DAYS
+        states[key] = (load, ctl, atl)
+        day += timedelta(days=1)
+    return states
+
+
+def training_load_values(conn, spreadsheet_id, states, day):
+    """CTL/ATL/TSB on a day, from freshly computed states or the stored ones"""
+    today = states.get(day)
+    yesterday_key = (datetime.strptime(day, "%Y-%m-%d").date() - timedelta(days=1)).isoformat()
+    yesterday = states.get(yesterday_key)
+    if today is None:
+        row = conn.execute(
+            "SELECT load, ctl, atl FROM training_load WHERE spreadsheet_id = ? AND day = ?", (spreadsheet_id, day)
+        ).fetchone()
+        today = tuple(row) if row else None
+    if yesterday is None:
+        row = conn.execute(
+            "SELECT load, ctl, atl FROM training_load WHERE spreadsheet_id = ? AND day = ?", (spreadsheet_id, yesterday_key)
+        ).fetchone()
+        yesterday = tuple(row) if row else (0.0, 0.0, 0.0)
+    if today is None:
+        return None
+    return {"ctl": today[1], "atl": today[2], "tsb": yesterday[1] - yesterday[2]}
+
+
+def add_training_load_fields(spreadsheet_id, formatted_activities):
+    """Fill in ctl/atl/tsb for the activities about to be imported (nothing is stored)"""
+    activity_contributions = [rollup_contribution(a) for a in formatted_activities]
+    contributions = [c for c in activity_contributions if c]
+    with get_db_connection() as conn:
+        states = compute_training_load(conn, spreadsheet_id, contributions) if contributions else {}
+        for activity, contribution in zip(formatted_activities, activity_contributions):
+            values = training_load_values(conn, spreadsheet_id, states, contribution["activity_date"]) if contribution else None
+            for field, _ in TRAINING_LOAD_FIELDS:
+                activity[field] = _format_load(values[field]) if values else ""
+    return formatted_activities
+
+
+def advance_training_load(spreadsheet_id, contributions):
+    """Persist the training-load state for the days touched by an import"""
+    if not contributions:
+        return
+    with get_db_connection() as conn:
+        states = compute_training_load(conn, spreadsheet_id, contributions)
+        conn.executemany(
+            """INSERT INTO training_load (spreadsheet_id, day, load, ctl, atl) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(spreadsheet_id, day) DO UPDATE SET
+                   load = excluded.load, ctl = excluded.ctl, atl = excluded.atl""",
+            [(spreadsheet_id, day, load, ctl, atl) for day, (load, ctl, atl) in states.items()]
+        )
+        conn.commit()
+    if states:
+        logger.info(f"Advanced training load for spreadsheet {spreadsheet_id} over {len(states)} days from {min(states)}")
+
+
+def parse_field_mappings(mapping_source):
+    """Collect the non-empty field -> header mappings from a form or JSON dict"""
+    field_mappings = {}
+    for field in IMPORT_FIELDS:
+        header = mapping_source.get(f"map_{field}") or mapping_source.get(field)
+        if header:
+            field_mappings[field] = header
+    return field_mappings
+
+
+def store_preview_session(formatted_activities, source):
+    """Keep a new preview in the session, with a fresh idempotency key for its import"""
+    session["preview_activities"] = formatted_activities
+    session["preview_source"] = source
+    session["import_key"] = uuid.uuid4().hex
+
 
-    # For POST requests, redirect to preview
-    return redirect(url_for("preview_activities"))
+def clear_preview_session(idempotency_key=None):
+    """Drop the preview state once its activities have been imported"""
+    # A replayed confirm of an older preview must not drop a newer one
+    if idempotency_key and session.get("import_key", idempotency_key) != idempotency_key:
+        return
+    session.pop("preview_activities", None)
+    session.pop("import_params", None)
+    session.pop("preview_source", None)
+    session.pop("saved_field_mappings", None)
+    session.pop("import_key", None)
 
 
 @app.route("/confirm_import", methods=["POST"])
 def confirm_import():
     token = session.get("token")
     formatted_activities = session.get("preview_activities")
+    idempotency_key = request_idempotency_key(request.form)
     
     if not token:
         flash("Please connect your Strava account first")
         return redirect(url_for("home"))
     
-    if not formatted_activities:
+    # A repeat of a confirm that already ran (or is running) is answered from
+    # its stored outcome even though the preview has been cleared since
+    if not formatted_activities and get_import_request(idempotency_key) is None:
         flash("No activities to import. Please preview activities first.")
         return redirect(url_for("import_activities"))
     
-    # Get the selected spreadsheet ID from form
+    # Get the selected spreadsheet ID and worksheet name from form
     spreadsheet_id = request.form.get("spreadsheet_id")
-    
-    # Get the selected worksheet name
     worksheet_name = request.form.get("worksheet_name", "Sheet1")
     
     # Get field mappings
-    field_mappings = {}
-    for field in ["date", "distance", "duration", "pace", "heart_rate"]:
-        header = request.form.get(f"map_{field}")
-        if header:
-            field_mappings[field] = header
-    
+    field_mappings = parse_field_mappings(request.form)
     logger.info(f"Field mappings: {field_mappings}")
-    print(f"DEBUG: Field mappings: {field_mappings}")
-    
-    # If no spreadsheet selected, use the default
-    spreadsheet = None
-    if spreadsheet_id:
-        spreadsheet = get_spreadsheet(int(spreadsheet_id))
-    
-    if not spreadsheet:
-        spreadsheet = get_default_spreadsheet()
+    append_only = request.form.get("append_only") == "on"
     
+    spreadsheet = resolve_import_spreadsheet(spreadsheet_id)
     if not spreadsheet:
         flash("No spreadsheet configured. Please add a spreadsheet first.")
         return redirect(url_for("spreadsheets"))
 
-    # Save header mappings to database for future use
+    save_import_preferences(spreadsheet, worksheet_name, field_mappings)
+
     try:
-        save_header_mappings(spreadsheet["id"], worksheet_name, field_mappings)
-        logger.info(f"Saved header mappings for spreadsheet {spreadsheet['id']}, worksheet {worksheet_name}")
+        result = import_preview(idempotency_key, spreadsheet, worksheet_name, field_mappings, formatted_activities, append_only)
+    except SheetImportQueued as e:
+        # Written by the worker holding the worksheet's lease; confirming
+        # again (same import key) shows the outcome
+        flash(str(e))
+        return redirect(url_for("home"))
+    except SheetImportError as e:
+        flash(e.message)
+        if e.endpoint != "preview_activities":
+            return redirect(url_for(e.endpoint))
+        error = e
     except Exception as e:
-        logger.error(f"Error saving header mappings: {str(e)}")
-        print(f"DEBUG: Error saving header mappings: {str(e)}")
+        logger.error(f"Error importing to spreadsheet: {str(e)}")
+        flash(f"Error importing to spreadsheet: {str(e)}")
+        error = e
+    else:
+        flash(result["message"])
+        clear_preview_session(idempotency_key)
+        return redirect(url_for("home"))
 
-    # Update column preferences based on the field mappings
-    include_date = 1 if "date" in field_mappings else 0
-    include_distance = 1 if "distance" in field_mappings else 0
-    include_time = 1 if "duration" in field_mappings else 0
-    include_pace = 1 if "pace" in field_mappings else 0
-    include_hr = 1 if "heart_rate" in field_mappings else 0
-    
-    # Save column preferences for this spreadsheet
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            """UPDATE spreadsheets SET 
-                include_date = ?, 
-                include_distance = ?, 
-                include_time = ?, 
-                include_pace = ?, 
-                include_hr = ?,
-                default_worksheet = ?
-                WHERE id = ?""",
-            (
-                include_date,
-                include_distance,
-                include_time,
-                include_pace,
-                include_hr,
-                worksheet_name,
-                spreadsheet["id"]
-            )
-        )
-        conn.commit()
-        
-    logger.info(f"Updated column preferences and default worksheet for spreadsheet {spreadsheet['id']}: date={include_date}, distance={include_distance}, time={include_time}, pace={include_pace}, hr={include_hr}, default_worksheet={worksheet_name}")
-    print(f"DEBUG: Updated column preferences and default worksheet: date={include_date}, distance={include_distance}, time={include_time}, pace={include_pace}, hr={include_hr}, default_worksheet={worksheet_name}")
+    # Store the field mappings in session to preserve them, and go back to
+    # the preview, which is re-rendered from the session without refetching
+    logger.info(f"Import failed, returning to preview: {str(error)}")
+    session["saved_field_mappings"] = field_mappings
+    return redirect(url_for("preview_activities", spreadsheet_id=spreadsheet["id"], worksheet_name=worksheet_name))
+
+
+@app.route("/api/confirm_import", methods=["POST"])
+def api_confirm_import():
+    """JSON import endpoint used by the preview page.
+
+    Takes {spreadsheet_id, worksheet_name, mappings, append_only,
+    idempotency_key} and imports the activities stored by the last preview.
+    A repeat with the same idempotency_key returns the first result instead
+    of importing again. On a fixable error (e.g. a header that does not
+    exist) the page stays as it is and only the mapping has to be sent again.
+    While the worksheet is busy the import is queued: the answer is a 202
+    with a ``status_url`` to poll.
+    """
+    if not session.get("token"):
+        return jsonify({"error": "Please connect your Strava account first"}), 401
+
+    data = request.get_json(silent=True) or {}
+    idempotency_key = request_idempotency_key(data)
+    formatted_activities = session.get("preview_activities")
+    if not formatted_activities and get_import_request(idempotency_key) is None:
+        return jsonify({"error": "No activities to import. Please preview activities first."}), 409
+
+    worksheet_name = data.get("worksheet_name") or "Sheet1"
+    field_mappings = parse_field_mappings(data.get("mappings") or {})
+    logger.info(f"Field mappings: {field_mappings}")
+
+    spreadsheet = resolve_import_spreadsheet(data.get("spreadsheet_id"))
+    if not spreadsheet:
+        return jsonify({"error": "No spreadsheet configured. Please add a spreadsheet first."}), 404
+
+    save_import_preferences(spreadsheet, worksheet_name, field_mappings)
 
     try:
-        # Auth to Google Sheets
-        creds = ServiceAccountCredentials.from_json_keyfile_name(
-            os.getenv("GOOGLE_CREDS_FILE"),
-            [
-                "https://spreadsheets.google.com/feeds",
-                "https://www.googleapis.com/auth/drive",
-            ],
+        result = import_preview(
+            idempotency_key, spreadsheet, worksheet_name, field_mappings, formatted_activities, bool(data.get("append_only"))
         )
-        client = gspread.authorize(creds)
-        
-        # Log the service account email for debugging
-        logger.info(f"Using service account: {SERVICE_ACCOUNT_EMAIL}")
-        
-        # Try to open by ID first if available, otherwise by name
-        sheet_obj = None
-        if spreadsheet.get("sheet_id"):
-            try:
-                logger.debug(f"Attempting to open spreadsheet by ID: {spreadsheet['sheet_id']}")
-                sheet_obj = client.open_by_key(spreadsheet["sheet_id"])
-                logger.info(f"Successfully opened spreadsheet by ID: {spreadsheet['sheet_id']}")
-            except gspread.exceptions.APIError as e:
-                logger.error(f"API Error when opening spreadsheet by ID: {str(e)}")
-                if "not found" in str(e).lower():
-                    flash(f"Spreadsheet with ID '{spreadsheet['sheet_id']}' was not found. Make sure the ID is correct and the spreadsheet is shared with {SERVICE_ACCOUNT_EMAIL}")
-                    return redirect(url_for("spreadsheets"))
-                try:
-                    logger.debug(f"Falling back to opening by name: {spreadsheet['name']}")
-                    sheet_obj = client.open(spreadsheet["name"])
-                    logger.info(f"Successfully opened spreadsheet by name: {spreadsheet['name']}")
-                except Exception as e2:
-                    logger.error(f"Error opening by name: {str(e2)}")
-                    flash(f"Could not open spreadsheet by ID or name. Please make sure the spreadsheet is shared with {SERVICE_ACCOUNT_EMAIL}")
-                    return redirect(url_for("spreadsheets"))
-            except Exception as e:
-                logger.error(f"Error opening by ID: {str(e)}")
-                try:
-                    logger.debug(f"Falling back to opening by name: {spreadsheet['name']}")
-                    sheet_obj = client.open(spreadsheet["name"])
-                    logger.info(f"Successfully opened spreadsheet by name: {spreadsheet['name']}")
-                except Exception as e2:
-                    logger.error(f"Error opening by name: {str(e2)}")
-                    flash(f"Could not open spreadsheet. Please make sure the spreadsheet is shared with {SERVICE_ACCOUNT_EMAIL}")
-                    return redirect(url_for("spreadsheets"))
-        else:
-            try:
-                logger.debug(f"Attempting to open spreadsheet by name: {spreadsheet['name']}")
-                sheet_obj = client.open(spreadsheet["name"])
-                logger.info(f"Successfully opened spreadsheet by name: {spreadsheet['name']}")
-            except Exception as e:
-                logger.error(f"Error opening by name: {str(e)}")
-                flash(f"Could not open spreadsheet '{spreadsheet['name']}'. Please make sure the spreadsheet is shared with {SERVICE_ACCOUNT_EMAIL}")
-                return redirect(url_for("spreadsheets"))
-        
-        # Get the specified worksheet or create it if it doesn't exist
-        try:
-            sheet = sheet_obj.worksheet(worksheet_name)
-            logger.info(f"Using worksheet: {worksheet_name}")
-        except gspread.exceptions.WorksheetNotFound:
-            try:
-                # Create a new worksheet with the specified name
-                sheet = sheet_obj.add_worksheet(title=worksheet_name, rows=100, cols=20)
-                logger.info(f"Created new worksheet: {worksheet_name}")
-                
-                # Add headers to the new worksheet if we have field mappings
-                if field_mappings:
-                    # Create a list of headers in the order they appear in field_mappings
-                    headers = list(field_mappings.values())
-                    if headers:
-                        sheet.update('A1', [headers], value_input_option='USER_ENTERED')
-                        logger.info(f"Added headers to new worksheet: {headers}")
-            except Exception as e:
-                logger.error(f"Error creating worksheet: {str(e)}")
-                flash(f"Could not create worksheet '{worksheet_name}': {str(e)}")
-                
-                # Store the field mappings in session to preserve them
-                session["saved_field_mappings"] = field_mappings
-                
-                # Redirect back to preview with the same parameters
-                import_params = session.get("import_params", {})
-                return redirect(url_for("preview_activities", **import_params))
-        
-        # Get all values to find the last row with data and verify headers
-        all_values = sheet.get_all_values()
-        
-        # Check if sheet has headers and find column indices
-        if not all_values:
-            # Add headers if sheet is empty and we have field mappings
-            print(f"DEBUG: Field mappings: {field_mappings}")
-            if field_mappings:
-                headers = list(field_mappings.values())
-                if headers:
-                    sheet.update('A1', [headers], value_input_option='USER_ENTERED')
-                    all_values = [headers]  # Update all_values to include the new headers
-            else:
-                flash("No field mappings provided and sheet is empty. Please select at least one field to import.")
-                
-                # Store the field mappings in session to preserve them
-                session["saved_field_mappings"] = field_mappings
-                
-                # Redirect back to preview with the same parameters
-                import_params = session.get("import_params", {})
-                return redirect(url_for("preview_activities", **import_params))
-        
-        headers = all_values[0]
-        
-        # Find column indices for each mapped field
-        column_indices = {}
-        for field, header in field_mappings.items():
-            try:
-                column_indices[field] = headers.index(header)
-            except ValueError:
-                flash(f"Could not find '{header}' header in the spreadsheet")
-                
-                # Store the field mappings in session to preserve them
-                session["saved_field_mappings"] = field_mappings
-                
-                # Redirect back to preview with the same parameters
-                import_params = session.get("import_params", {})
-                return redirect(url_for("preview_activities", **import_params))
-        
-        # Check if date field is mapped (needed for duplicate checking)
-        date_column_idx = column_indices.get("date")
-        
-        # Create a dictionary of existing dates and their row indices for fast lookup
-        date_rows = {}  # Store all dates with their row indices for comparison
-        if date_column_idx is not None:
-            # Skip header row (index 0)
-            for i, row in enumerate(all_values[1:], start=2):  # Start at 2 because row 1 is header
-                if len(row) > date_column_idx:
-                    date_value = row[date_column_idx]
-                    if date_value:  # Only consider non-empty date cells
-                        # Store date with its row index, normalized to handle single quotes
-                        normalized_date = normalize_sheet_value(date_value)
-                        date_rows[date_value] = i  # Keep original for lookup, but we'll compare normalized
-            
-            logger.info(f"Found {len(date_rows)} existing date entries in spreadsheet")
-            print(f"DEBUG: Found {len(date_rows)} existing date entries in spreadsheet")
-        
-        # Find the first empty row for new entries
-        first_empty_row = len(all_values) + 1
-        
-        # Track stats for reporting
-        updated_count = 0
-        added_count = 0
-        
-        # Import each activity from the previewed data
-        for activity in formatted_activities:
-            activity_date = activity["date"]
-            date_exists = False
-            row_idx = None
-            
-            # Check if this date already exists in the spreadsheet using the dates_equal function
-            if date_column_idx is not None and activity_date:
-                for existing_date, existing_row_idx in date_rows.items():
-                    if dates_equal(activity_date, existing_date):
-                        date_exists = True
-                        row_idx = existing_row_idx
-                        break
-            
-            if date_exists and row_idx:
-                # Update existing row - only update mapped fields to preserve formulas and unmapped columns
-                logger.info(f"Updating existing row {row_idx} for date {activity_date}")
-                print(f"DEBUG: Updating existing row {row_idx} for date {activity_date}")
-                
-                # Get the existing row data to check for changes
-                existing_row = None
-                if len(all_values) >= row_idx:
-                    existing_row = all_values[row_idx-1]  # row_idx is 1-based, all_values is 0-based
-                    logger.info(f"Got existing row data: {existing_row}")
-                    print(f"DEBUG: Got existing row data: {existing_row}")
-                
-                # Only update the values for mapped fields by updating individual cells
-                has_changes = False
-                updates_to_make = []  # List of (cell_range, value) tuples
-                
-                for field, col_idx in column_indices.items():
-                    # Get current column letter (A=0, B=1, etc.)
-                    col_letter = column_index_to_letter(col_idx)
-                    cell_range = f"{col_letter}{row_idx}"
-                    
-                    # Get existing value for comparison
-                    old_value = existing_row[col_idx] if (existing_row and col_idx < len(existing_row)) else ""
-                    new_value = activity[field]
-                    
-                    should_update = False
-                    
-                    if field == "date":
-                        # For dates, preserve the original format unless it's empty or we need to update it
-                        if not old_value:
-                            should_update = True
-                            logger.info(f"Will update empty date field at {cell_range}: '{old_value}' -> '{new_value}'")
-                            print(f"DEBUG: Will update empty date field at {cell_range}: '{old_value}' -> '{new_value}'")
-                        elif not dates_equal(old_value, new_value):
-                            # Only update if dates are actually different
-                            should_update = True
-                            logger.info(f"Will update date field at {cell_range}: '{old_value}' -> '{new_value}'")
-                            print(f"DEBUG: Will update date field at {cell_range}: '{old_value}' -> '{new_value}'")
-                        else:
-                            logger.info(f"Preserved existing date at {cell_range}: '{old_value}' (equivalent to '{new_value}')")
-                            print(f"DEBUG: Preserved existing date at {cell_range}: '{old_value}' (equivalent to '{new_value}')")
-                    else:
-                        # For other fields, only update if values are actually different
-                        if not values_equal(old_value, new_value):
-                            should_update = True
-                            logger.info(f"Will update {field} at {cell_range}: '{old_value}' -> '{new_value}'")
-                            print(f"DEBUG: Will update {field} at {cell_range}: '{old_value}' -> '{new_value}'")
-                        else:
-                            logger.info(f"No change needed for {field} at {cell_range}: '{old_value}' (equivalent to '{new_value}')")
-                            print(f"DEBUG: No change needed for {field} at {cell_range}: '{old_value}' (equivalent to '{new_value}')")
-                    
-                    if should_update:
-                        updates_to_make.append((cell_range, new_value))
-                        has_changes = True
-                
-                # Only update the spreadsheet if there are actual changes
-                if has_changes:
-                    logger.info(f"Making {len(updates_to_make)} cell updates: {updates_to_make}")
-                    print(f"DEBUG: Making {len(updates_to_make)} cell updates: {updates_to_make}")
-                    
-                    # Update each cell individually to preserve formulas and unmapped columns
-                    for cell_range, value in updates_to_make:
-                        try:
-                            # Update individual cell using USER_ENTERED to prevent Google Sheets from adding single quotes
-                            sheet.update(cell_range, [[value]], value_input_option='USER_ENTERED')
-                            logger.info(f"Successfully updated cell {cell_range} with value '{value}'")
-                            print(f"DEBUG: Successfully updated cell {cell_range} with value '{value}'")
-                        except Exception as e:
-                            logger.error(f"Error updating cell {cell_range}: {str(e)}")
-                            print(f"DEBUG: Error updating cell {cell_range}: {str(e)}")
-                            # Continue with other updates even if one fails
-                    
-                    updated_count += 1
-                else:
-                    logger.info(f"No changes detected for row {row_idx}, skipping update")
-                    print(f"DEBUG: No changes detected for row {row_idx}, skipping update")
-            else:
-                # Add new row
-                row_idx = first_empty_row
-                first_empty_row += 1
-                
-                # Create a row with values in the correct positions
-                row_values = [""] * len(headers)
-                
-                # Fill in the values based on field mappings
-                for field, col_idx in column_indices.items():
-                    row_values[col_idx] = activity[field]
-                
-                # Update the entire row at once (more efficient)
-                # Use USER_ENTERED to prevent Google Sheets from adding single quotes to time values
-                sheet.update(f'A{row_idx}', [row_values], value_input_option='USER_ENTERED')
-                added_count += 1
-                
-                # Add to date_rows dictionary for future lookups (both formats)
-                if date_column_idx is not None and activity_date:
-                    date_rows[activity_date] = row_idx
-        
-        # Show appropriate success message based on what happened
-        if updated_count > 0 and added_count > 0:
-            flash(f"Successfully imported {len(formatted_activities)} activities to '{spreadsheet['name']}' (worksheet: {worksheet_name}): {added_count} new, {updated_count} updated!")
-        elif updated_count > 0:
-            flash(f"Successfully updated {updated_count} existing activities in '{spreadsheet['name']}' (worksheet: {worksheet_name})!")
-        else:
-            flash(f"Successfully added {added_count} new activities to '{spreadsheet['name']}' (worksheet: {worksheet_name})!")
-        
-        # Clear the preview data from session
-        session.pop("preview_activities", None)
-        session.pop("import_params", None)
-        session.pop("saved_field_mappings", None)
-        
+    except SheetImportQueued as e:
+        return import_queued_response(idempotency_key, e)
+    except SheetImportError as e:
+        return jsonify({"error": e.message, "field": e.field}), 400
     except Exception as e:
+        # The plan keeps its progress; POST /api/import_plan/<plan_id>/execute resumes it
         logger.error(f"Error importing to spreadsheet: {str(e)}")
-        flash(f"Error importing to spreadsheet: {str(e)}")
-        
-        # Store the field mappings in session to preserve them
-        session["saved_field_mappings"] = field_mappings
-        
-        # Redirect back to preview with the same parameters
-        import_params = session.get("import_params", {})
-        return redirect(url_for("preview_activities", **import_params))
+        return jsonify({"error": f"Error importing to spreadsheet: {str(e)}", "plan_id": getattr(e, "plan_id", None)}), 502
 
-    return redirect(url_for("home"))
+    # Flash the summary so it is shown on the page the client navigates to
+    flash(result["message"])
+    clear_preview_session(idempotency_key)
+    result["redirect"] = url_for("home")
+    return jsonify(result)
+
+
+def import_queued_response(idempotency_key, queued):
+    """202 for an import that is waiting on its worksheet, with the URL the page polls"""
+    body = {"status": "queued", "message": str(queued)}
+    if idempotency_key:
+        body["status_url"] = url_for("api_import_status", idempotency_key=idempotency_key)
+    return jsonify(body), 202
+
+
+@app.route("/api/import_status/<idempotency_key>")
+def api_import_status(idempotency_key):
+    """Outcome of a confirmed import, polled by the preview page while it is queued"""
+    if not session.get("token"):
+        return jsonify({"error": "Please connect your Strava account first"}), 401
+
+    existing = get_import_request(idempotency_key)
+    if existing is not None and existing[0] == "queued":
+        existing = settle_queued_import(idempotency_key, existing[1])
+    if existing is None:
+        return jsonify({"error": "This import is no longer running. Please confirm it again."}), 404
+
+    status, result = existing
+    if status in ("queued", "running"):
+        return import_queued_response(idempotency_key, SheetImportQueued())
+    if status == "done":
+        flash(result["message"])
+        clear_preview_session(idempotency_key)
+        return jsonify(dict(result, status="done", redirect=url_for("home")))
+    if result.get("user_error"):
+        return jsonify({"status": status, "error": result["error"], "field": result.get("field")}), 400
+    return jsonify({
+        "status": status, "error": f"Error importing to spreadsheet: {result['error']}", "plan_id": result.get("plan_id")
+    }), 502
+
+
+@app.route("/api/import_plan", methods=["POST"])
+def api_import_plan():
+    """Dry run: compute the import plan for the current preview without writing.
+
+    Takes the same body as /api/confirm_import and returns the cells that
+    would change, the rows that would be appended and the unchanged rows,
+    plus a plan_id that /api/import_plan/<plan_id>/execute applies.
+    """
+    if not session.get("token"):
+        return jsonify({"error": "Please connect your Strava account first"}), 401
+
+    formatted_activities = session.get("preview_activities")
+    if not formatted_activities:
+        return jsonify({"error": "No activities to import. Please preview activities first."}), 409
+
+    data = request.get_json(silent=True) or {}
+    worksheet_name = data.get("worksheet_name") or "Sheet1"
+    field_mappings = parse_field_mappings(data.get("mappings") or {})
+
+    spreadsheet = resolve_import_spreadsheet(data.get("spreadsheet_id"))
+    if not spreadsheet:
+        return jsonify({"error": "No spreadsheet configured. Please add a spreadsheet first."}), 404
+
+    try:
+        plan, _, _ = plan_sheet_import(
+            spreadsheet, worksheet_name, field_mappings, formatted_activities, append_only=bool(data.get("append_only"))
+        )
+    except SheetImportError as e:
+        return jsonify({"error": e.message, "field": e.field}), 400
+    except Exception as e:
+        logger.error(f"Error planning import: {str(e)}")
+        return jsonify({"error": f"Error reading spreadsheet: {str(e)}"}), 502
+
+    save_import_plan(spreadsheet, worksheet_name, plan)
+    return jsonify(summarize_import_plan(plan))
+
+
+@app.route("/api/import_plan/<plan_id>/execute", methods=["POST"])
+def api_execute_import_plan(plan_id):
+    """Apply a planned import, or resume one that failed part-way"""
+    if not session.get("token"):
+        return jsonify({"error": "Please connect your Strava account first"}), 401
+
+    record = get_import_plan(plan_id)
+    if not record:
+        return jsonify({"error": "Import plan not found"}), 404
+
+    spreadsheet = get_spreadsheet(record["spreadsheet_id"])
+    if not spreadsheet:
+        return jsonify({"error": "Spreadsheet not found"}), 404
+
+    field_mappings = record["plan"].get("field_mappings")
+    if field_mappings:
+        save_import_preferences(spreadsheet, record["worksheet_name"], field_mappings)
+
+    try:
+        with sheet_write_lock(spreadsheet, record["worksheet_name"]) as lease:
+            result = execute_import_plan(spreadsheet, record["worksheet_name"], get_import_plan(plan_id), lease=lease)
+    except SheetImportError as e:
+        return jsonify({"error": e.message, "field": e.field}), 409
+    except Exception as e:
+        logger.error(f"Error executing import plan {plan_id}: {str(e)}")
+        return jsonify({"error": f"Error importing to spreadsheet: {str(e)}", "plan_id": plan_id}), 502
+
+    flash(result["message"])
+    clear_preview_session()
+    result["redirect"] = url_for("home")
+    return jsonify(result)
+
+
+@app.route("/api/import_plan/<plan_id>/revert", methods=["POST"])
+def api_revert_import_plan(plan_id):
+    """Undo an import: restore every cell it wrote from the import journal"""
+    if not session.get("token"):
+        return jsonify({"error": "Please connect your Strava account first"}), 401
+
+    record = get_import_plan(plan_id)
+    if not record:
+        return jsonify({"error": "Import plan not found"}), 404
+    if record["status"] == "reverted":
+        return jsonify({"error": "This import has already been reverted"}), 409
+
+    spreadsheet = get_spreadsheet(record["spreadsheet_id"])
+    if not spreadsheet:
+        return jsonify({"error": "Spreadsheet not found"}), 404
+
+    try:
+        # Serialised with imports into the worksheet, like any other write
+        with sheet_write_lock(spreadsheet, record["worksheet_name"]):
+            result = revert_import(spreadsheet, record["worksheet_name"], plan_id)
+    except SheetImportError as e:
+        return jsonify({"error": e.message}), 409
+    except Exception as e:
+        logger.error(f"Error reverting import plan {plan_id}: {str(e)}")
+        return jsonify({"error": f"Error reverting import: {str(e)}"}), 502
+    return jsonify(result)
+
+
+@app.route("/health")
+def health():
+    """Liveness check with the database (schema included) and the upstream circuit breakers"""
+    try:
+        ensure_db_initialized()
+        with get_db_connection() as conn:
+            conn.execute("SELECT 1").fetchone()
+        database = "ok"
+    except Exception as e:
+        database = f"error: {str(e)}"
+    upstreams = {breaker.name: breaker.snapshot() for breaker in (google_breaker, strava_breaker)}
+    if database != "ok":
+        status = "unhealthy"
+    elif any(u["state"] != "closed" for u in upstreams.values()):
+        status = "degraded"
+    else:
+        status = "ok"
+    body = {"status": status, "database": database, "upstreams": upstreams}
+    # Only a dead database makes this node unusable; upstream outages are reported, not failed
+    return jsonify(body), 200 if database == "ok" else 503
 
 
 @app.route("/logout")
@@ -1185,7 +4069,7 @@ def add_spreadsheet():
         return redirect(url_for("home"))
     
     if request.method == "GET":
-        return render_template("add_spreadsheet.html", service_account_email=SERVICE_ACCOUNT_EMAIL)
+        return render_template("add_spreadsheet.html", service_account_email=get_service_account_email())
     
     # Process form data
     name = request.form.get("name")
@@ -1206,23 +4090,18 @@ def add_spreadsheet():
     
     if not name:
         flash("Spreadsheet name is required")
-        return render_template("add_spreadsheet.html", service_account_email=SERVICE_ACCOUNT_EMAIL)
+        return render_template("add_spreadsheet.html", service_account_email=get_service_account_email())
     
     # Extract sheet ID from URL if provided
     sheet_id = extract_sheet_id_from_url(sheet_input)
     
     # Verify the spreadsheet is accessible before saving
     if sheet_id:
+        import gspread
+
         try:
             # Auth to Google Sheets
-            creds = ServiceAccountCredentials.from_json_keyfile_name(
-                os.getenv("GOOGLE_CREDS_FILE"),
-                [
-                    "https://spreadsheets.google.com/feeds",
-                    "https://www.googleapis.com/auth/drive",
-                ],
-            )
-            client = gspread.authorize(creds)
+            client = get_gspread_client()
             
             # Try to open the spreadsheet to verify access
             try:
@@ -1236,23 +4115,23 @@ def add_spreadsheet():
                         logger.info(f"Verified that worksheet '{default_worksheet}' exists")
                     except gspread.exceptions.WorksheetNotFound:
                         flash(f"Worksheet '{default_worksheet}' not found in the spreadsheet. Please make sure the worksheet name is correct.")
-                        return render_template("add_spreadsheet.html", service_account_email=SERVICE_ACCOUNT_EMAIL)
+                        return render_template("add_spreadsheet.html", service_account_email=get_service_account_email())
                         
             except gspread.exceptions.APIError as e:
                 logger.error(f"API Error when verifying spreadsheet: {str(e)}")
                 if "not found" in str(e).lower():
-                    flash(f"Spreadsheet with ID '{sheet_id}' was not found. Make sure the ID is correct and the spreadsheet is shared with {SERVICE_ACCOUNT_EMAIL}")
+                    flash(f"Spreadsheet with ID '{sheet_id}' was not found. Make sure the ID is correct and the spreadsheet is shared with {get_service_account_email()}")
                 else:
                     flash(f"Error accessing spreadsheet: {str(e)}")
-                return render_template("add_spreadsheet.html", service_account_email=SERVICE_ACCOUNT_EMAIL)
+                return render_template("add_spreadsheet.html", service_account_email=get_service_account_email())
             except Exception as e:
                 logger.error(f"Error when verifying spreadsheet: {str(e)}")
                 flash(f"Error accessing spreadsheet: {str(e)}")
-                return render_template("add_spreadsheet.html", service_account_email=SERVICE_ACCOUNT_EMAIL)
+                return render_template("add_spreadsheet.html", service_account_email=get_service_account_email())
         except Exception as e:
             logger.error(f"Error with Google credentials: {str(e)}")
             flash(f"Error with Google credentials: {str(e)}")
-            return render_template("add_spreadsheet.html", service_account_email=SERVICE_ACCOUNT_EMAIL)
+            return render_template("add_spreadsheet.html", service_account_email=get_service_account_email())
     
     # If setting as default, unset any existing default
     if is_default:
@@ -1297,7 +4176,7 @@ def edit_spreadsheet(id):
         return redirect(url_for("spreadsheets"))
     
     if request.method == "GET":
-        return render_template("edit_spreadsheet.html", spreadsheet=spreadsheet, service_account_email=SERVICE_ACCOUNT_EMAIL)
+        return render_template("edit_spreadsheet.html", spreadsheet=spreadsheet, service_account_email=get_service_account_email())
     
     # Process form data
     name = request.form.get("name")
@@ -1318,23 +4197,18 @@ def edit_spreadsheet(id):
     
     if not name:
         flash("Spreadsheet name is required")
-        return render_template("edit_spreadsheet.html", spreadsheet=spreadsheet, service_account_email=SERVICE_ACCOUNT_EMAIL)
+        return render_template("edit_spreadsheet.html", spreadsheet=spreadsheet, service_account_email=get_service_account_email())
     
     # Extract sheet ID from URL if provided
     sheet_id = extract_sheet_id_from_url(sheet_input)
     
     # Verify the spreadsheet is accessible before saving
     if sheet_id:
+        import gspread
+
         try:
             # Auth to Google Sheets
-            creds = ServiceAccountCredentials.from_json_keyfile_name(
-                os.getenv("GOOGLE_CREDS_FILE"),
-                [
-                    "https://spreadsheets.google.com/feeds",
-                    "https://www.googleapis.com/auth/drive",
-                ],
-            )
-            client = gspread.authorize(creds)
+            client = get_gspread_client()
             
             # Try to open the spreadsheet to verify access
             try:
@@ -1348,23 +4222,23 @@ def edit_spreadsheet(id):
                         logger.info(f"Verified that worksheet '{default_worksheet}' exists")
                     except gspread.exceptions.WorksheetNotFound:
                         flash(f"Worksheet '{default_worksheet}' not found in the spreadsheet. Please make sure the worksheet name is correct.")
-                        return render_template("edit_spreadsheet.html", spreadsheet=spreadsheet, service_account_email=SERVICE_ACCOUNT_EMAIL)
+                        return render_template("edit_spreadsheet.html", spreadsheet=spreadsheet, service_account_email=get_service_account_email())
                         
             except gspread.exceptions.APIError as e:
                 logger.error(f"API Error when opening spreadsheet by ID: {str(e)}")
                 if "not found" in str(e).lower():
-                    flash(f"Spreadsheet with ID '{sheet_id}' was not found. Make sure the ID is correct and the spreadsheet is shared with {SERVICE_ACCOUNT_EMAIL}")
+                    flash(f"Spreadsheet with ID '{sheet_id}' was not found. Make sure the ID is correct and the spreadsheet is shared with {get_service_account_email()}")
                 else:
                     flash(f"Error accessing spreadsheet: {str(e)}")
-                return render_template("edit_spreadsheet.html", spreadsheet=spreadsheet, service_account_email=SERVICE_ACCOUNT_EMAIL)
+                return render_template("edit_spreadsheet.html", spreadsheet=spreadsheet, service_account_email=get_service_account_email())
             except Exception as e:
                 logger.error(f"Error when verifying spreadsheet: {str(e)}")
                 flash(f"Error accessing spreadsheet: {str(e)}")
-                return render_template("edit_spreadsheet.html", spreadsheet=spreadsheet, service_account_email=SERVICE_ACCOUNT_EMAIL)
+                return render_template("edit_spreadsheet.html", spreadsheet=spreadsheet, service_account_email=get_service_account_email())
         except Exception as e:
             logger.error(f"Error with Google credentials: {str(e)}")
             flash(f"Error with Google credentials: {str(e)}")
-            return render_template("edit_spreadsheet.html", spreadsheet=spreadsheet, service_account_email=SERVICE_ACCOUNT_EMAIL)
+            return render_template("edit_spreadsheet.html", spreadsheet=spreadsheet, service_account_email=get_service_account_email())
     
     # If setting as default, unset any existing default
     if is_default:
@@ -1462,6 +4336,15 @@ def set_default_spreadsheet(id):
     return redirect(url_for("spreadsheets"))
 
 
+@coalesce_sheet_read("worksheet_names", ttl=SHEET_CACHE_TTL)
+def fetch_worksheet_names(sheet_id):
+    """Titles of all worksheets in a spreadsheet; raises on Google errors"""
+    client = get_gspread_client()
+    logger.debug(f"Attempting to open spreadsheet with ID: {sheet_id}")
+    sheet_obj = client.open_by_key(sheet_id)
+    return [ws.title for ws in sheet_obj.worksheets()]
+
+
 # Add a new function to get worksheet names from a spreadsheet
 def get_worksheet_names(spreadsheet_id):
     """Get all worksheet names from a spreadsheet"""
@@ -1471,26 +4354,10 @@ def get_worksheet_names(spreadsheet_id):
         logger.warning(f"Invalid spreadsheet ID: {spreadsheet_id}")
         return ["Sheet1"]
         
+    import gspread
+
     try:
-        # Auth to Google Sheets
-        creds = ServiceAccountCredentials.from_json_keyfile_name(
-            os.getenv("GOOGLE_CREDS_FILE"),
-            [
-                "https://spreadsheets.google.com/feeds",
-                "https://www.googleapis.com/auth/drive",
-            ],
-        )
-        client = gspread.authorize(creds)
-        
-        # Try to open the spreadsheet
-        logger.debug(f"Attempting to open spreadsheet with ID: {spreadsheet_id}")
-        sheet_obj = client.open_by_key(spreadsheet_id)
-        
-        # Get all worksheets
-        worksheets = sheet_obj.worksheets()
-        
-        # Return list of worksheet names
-        worksheet_names = [ws.title for ws in worksheets]
+        worksheet_names = fetch_worksheet_names(spreadsheet_id)
         logger.info(f"Found {len(worksheet_names)} worksheets: {worksheet_names}")
         return worksheet_names
     except gspread.exceptions.APIError as e:
@@ -1547,6 +4414,37 @@ def debug_spreadsheets():
     return jsonify({"spreadsheets": spreadsheets})
 
 
+@coalesce_sheet_read("worksheet_headers", ttl=SHEET_CACHE_TTL)
+def fetch_worksheet_headers(sheet_id, worksheet_name=None):
+    """Non-empty first-row cells of a worksheet (the first one if it does not exist); raises on Google errors"""
+    import gspread
+
+    client = get_gspread_client()
+    logger.debug(f"Attempting to open spreadsheet with ID: {sheet_id}")
+    sheet_obj = client.open_by_key(sheet_id)
+    worksheets = sheet_obj.worksheets()
+    if not worksheets:
+        logger.warning("No worksheets found in the spreadsheet")
+        return []
+        
+    # If worksheet_name is None or empty, use the first worksheet
+    if not worksheet_name or worksheet_name == "undefined" or worksheet_name == "null":
+        worksheet = worksheets[0]
+        logger.info(f"No worksheet specified, using first worksheet: {worksheet.title}")
+    else:
+        # Get the specified worksheet
+        try:
+            worksheet = sheet_obj.worksheet(worksheet_name)
+            logger.info(f"Using specified worksheet: {worksheet_name}")
+        except gspread.exceptions.WorksheetNotFound:
+            # If worksheet not found, use the first worksheet
+            worksheet = worksheets[0]
+            logger.warning(f"Worksheet '{worksheet_name}' not found, using '{worksheet.title}' instead")
+    
+    # Filter out empty headers and ensure we have values
+    return [h for h in worksheet.row_values(1) if h.strip()]
+
+
 def get_worksheet_headers(spreadsheet_id, worksheet_name=None):
     """Get headers from the first row of a worksheet"""
     logger.info(f"Fetching headers for spreadsheet ID: {spreadsheet_id}, worksheet: {worksheet_name}")
@@ -1556,48 +4454,10 @@ def get_worksheet_headers(spreadsheet_id, worksheet_name=None):
         logger.warning(f"Invalid spreadsheet ID: {spreadsheet_id}")
         return []
         
+    import gspread
+
     try:
-        # Auth to Google Sheets
-        creds = ServiceAccountCredentials.from_json_keyfile_name(
-            os.getenv("GOOGLE_CREDS_FILE"),
-            [
-                "https://spreadsheets.google.com/feeds",
-                "https://www.googleapis.com/auth/drive",
-            ],
-        )
-        client = gspread.authorize(creds)
-        
-        # Try to open the spreadsheet
-        logger.debug(f"Attempting to open spreadsheet with ID: {spreadsheet_id}")
-        sheet_obj = client.open_by_key(spreadsheet_id)
-        
-        # Get all worksheets
-        worksheets = sheet_obj.worksheets()
-        
-        if not worksheets:
-            logger.warning("No worksheets found in the spreadsheet")
-            return []
-            
-        # If worksheet_name is None or empty, use the first worksheet
-        if not worksheet_name or worksheet_name == "undefined" or worksheet_name == "null":
-            worksheet = worksheets[0]
-            logger.info(f"No worksheet specified, using first worksheet: {worksheet.title}")
-        else:
-            # Get the specified worksheet
-            try:
-                worksheet = sheet_obj.worksheet(worksheet_name)
-                logger.info(f"Using specified worksheet: {worksheet_name}")
-            except gspread.exceptions.WorksheetNotFound:
-                # If worksheet not found, use the first worksheet
-                worksheet = worksheets[0]
-                logger.warning(f"Worksheet '{worksheet_name}' not found, using '{worksheet.title}' instead")
-        
-        # Get the first row (headers)
-        headers = worksheet.row_values(1)
-        
-        # Filter out empty headers and ensure we have values
-        headers = [h for h in headers if h.strip()]
-        
+        headers = fetch_worksheet_headers(spreadsheet_id, worksheet_name)
         logger.info(f"Found {len(headers)} headers: {headers}")
         print(f"DEBUG: Found {len(headers)} headers: {headers}")
         return headers
@@ -1642,9 +4502,123 @@ def get_headers_endpoint(sheet_id, worksheet_name):
         print(f"DEBUG: Found headers: {headers}")
         return jsonify({"headers": headers})
     except Exception as e:
-        logger.error(f"Error getting worksheet headers: {str(e)}")
-        print(f"DEBUG: Error getting worksheet headers: {str(e)}")
-        return jsonify({"error": str(e), "headers": []})
+        logger.error(f"Error getting worksheet headers: {str(e)}")
+        print(f"DEBUG: Error getting worksheet headers: {str(e)}")
+        return jsonify({"error": str(e), "headers": []})
+
+
+# Worksheets whose header rows are included in one bootstrap response
+BOOTSTRAP_MAX_WORKSHEETS = 50
+
+
+@coalesce_sheet_read("bootstrap", ttl=SHEET_CACHE_TTL)
+def fetch_sheet_bootstrap(sheet_id, worksheet_name=None):
+    """Worksheet titles and header rows of a spreadsheet in two Sheets API calls.
+
+    One spreadsheets.get restricted to the sheet titles, then one
+    values.batchGet for row 1 of the requested worksheet and the first
+    BOOTSTRAP_MAX_WORKSHEETS others, so the page can switch worksheets
+    without asking again. Returns (worksheet names, {worksheet: headers}).
+    """
+    from gspread.urls import SPREADSHEET_URL, SPREADSHEET_VALUES_BATCH_URL
+
+    client = get_gspread_client()
+    metadata = client.request(
+        "get", SPREADSHEET_URL % sheet_id, params={"fields": "sheets.properties.title"}
+    ).json()
+    worksheet_names = [s["properties"]["title"] for s in metadata.get("sheets", [])]
+    if not worksheet_names:
+        return [], {}
+
+    header_sheets = worksheet_names[:BOOTSTRAP_MAX_WORKSHEETS]
+    if worksheet_name in worksheet_names and worksheet_name not in header_sheets:
+        header_sheets.append(worksheet_name)
+    quoted = ["'{}'!1:1".format(name.replace("'", "''")) for name in header_sheets]
+    values = client.request(
+        "get", SPREADSHEET_VALUES_BATCH_URL % sheet_id, params={"ranges": quoted, "majorDimension": "ROWS"}
+    ).json()
+
+    headers = {}
+    for name, value_range in zip(header_sheets, values.get("valueRanges", [])):
+        first_row = (value_range.get("values") or [[]])[0]
+        headers[name] = [h for h in first_row if str(h).strip()]
+    return worksheet_names, headers
+
+
+def get_all_header_mappings(spreadsheet_id):
+    """Saved header mappings of every worksheet of a spreadsheet, as {worksheet: {field: header}}"""
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            "SELECT worksheet_name, field_name, header_name FROM header_mappings WHERE spreadsheet_id = ?",
+            (spreadsheet_id,)
+        ).fetchall()
+    mappings = {}
+    for row in rows:
+        mappings.setdefault(row["worksheet_name"], {})[row["field_name"]] = row["header_name"]
+    return mappings
+
+
+def spreadsheet_column_preferences(spreadsheet):
+    """The per-spreadsheet include_* settings as the page expects them"""
+    return {
+        "date": spreadsheet.get("include_date", 1) == 1,
+        "distance": spreadsheet.get("include_distance", 1) == 1,
+        "time": spreadsheet.get("include_time", 1) == 1,
+        "pace": spreadsheet.get("include_pace", 1) == 1,
+        "heart_rate": spreadsheet.get("include_hr", 1) == 1
+    }
+
+
+@app.route("/api/preview_bootstrap/<int:spreadsheet_id>")
+def api_preview_bootstrap(spreadsheet_id):
+    """Everything the preview page needs for a spreadsheet, in one request.
+
+    Returns the worksheet names, the worksheet to select, header rows,
+    saved mappings per worksheet and the column preferences. Replaces the
+    /get_worksheets -> /get_worksheet_headers -> /get_header_mappings chain.
+    """
+    if not get_authenticated_token():
+        return jsonify({"error": "Not authenticated"}), 401
+
+    spreadsheet = get_spreadsheet(spreadsheet_id)
+    if not spreadsheet:
+        return jsonify({"error": "Spreadsheet not found"}), 404
+
+    requested = request.args.get("worksheet") or ""
+    default_worksheet = spreadsheet.get("default_worksheet") or "Sheet1"
+    response = {
+        "spreadsheet_id": spreadsheet_id,
+        "worksheets": [requested or default_worksheet],
+        "selected_worksheet": requested or default_worksheet,
+        "headers": {},
+        "mappings": get_all_header_mappings(spreadsheet_id),
+        "column_preferences": spreadsheet_column_preferences(spreadsheet),
+    }
+    if not spreadsheet.get("sheet_id"):
+        response["error"] = "This spreadsheet has no Google Sheet ID configured"
+        return jsonify(response)
+
+    import gspread
+
+    try:
+        worksheet_names, headers = fetch_sheet_bootstrap(spreadsheet["sheet_id"], requested or default_worksheet)
+    except gspread.exceptions.APIError as e:
+        logger.error(f"Google Sheets API error: {str(e)}")
+        response["error"] = f"Could not open the spreadsheet. Make sure it is shared with {get_service_account_email()}."
+        return jsonify(response)
+    except Exception as e:
+        logger.error(f"Error loading preview bootstrap: {str(e)}")
+        response["error"] = str(e)
+        return jsonify(response)
+
+    if worksheet_names:
+        response["worksheets"] = worksheet_names
+        for candidate in (requested, default_worksheet, worksheet_names[0]):
+            if candidate in worksheet_names:
+                response["selected_worksheet"] = candidate
+                break
+    response["headers"] = headers
+    return jsonify(response)
 
 
 # Functions to save and load header mappings
@@ -1653,6 +4627,13 @@ def save_header_mappings(spreadsheet_id, worksheet_name, mappings):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         
+        # Value formats stay valid while a field keeps its header
+        cursor.execute(
+            "SELECT field_name, header_name, value_format FROM header_mappings WHERE spreadsheet_id = ? AND worksheet_name = ?",
+            (spreadsheet_id, worksheet_name)
+        )
+        formats = {(row['field_name'], row['header_name']): row['value_format'] for row in cursor.fetchall()}
+        
         # First delete any existing mappings for this spreadsheet and worksheet
         cursor.execute(
             "DELETE FROM header_mappings WHERE spreadsheet_id = ? AND worksheet_name = ?",
@@ -1663,8 +4644,8 @@ def save_header_mappings(spreadsheet_id, worksheet_name, mappings):
         for field_name, header_name in mappings.items():
             if header_name:  # Only save non-empty mappings
                 cursor.execute(
-                    "INSERT INTO header_mappings (spreadsheet_id, worksheet_name, field_name, header_name) VALUES (?, ?, ?, ?)",
-                    (spreadsheet_id, worksheet_name, field_name, header_name)
+                    "INSERT INTO header_mappings (spreadsheet_id, worksheet_name, field_name, header_name, value_format) VALUES (?, ?, ?, ?, ?)",
+                    (spreadsheet_id, worksheet_name, field_name, header_name, formats.get((field_name, header_name)))
                 )
         
         conn.commit()
@@ -1684,6 +4665,24 @@ def get_header_mappings(spreadsheet_id, worksheet_name):
         return mappings
 
 
+def get_date_format(spreadsheet_id, worksheet_name):
+    """The cached format of a worksheet's mapped date column, or None"""
+    with get_db_connection() as conn:
+        row = conn.execute(
+            "SELECT value_format FROM header_mappings WHERE spreadsheet_id = ? AND worksheet_name = ? AND field_name = 'date'",
+            (spreadsheet_id, worksheet_name)
+        ).fetchone()
+    return row['value_format'] if row else None
+
+def save_date_format(spreadsheet_id, worksheet_name, date_format):
+    """Cache the inferred date format on the date column's mapping row"""
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE header_mappings SET value_format = ? WHERE spreadsheet_id = ? AND worksheet_name = ? AND field_name = 'date'",
+            (date_format, spreadsheet_id, worksheet_name)
+        )
+        conn.commit()
+
 @app.route("/get_header_mappings/<spreadsheet_id>/<worksheet_name>")
 def get_header_mappings_endpoint(spreadsheet_id, worksheet_name):
     """API endpoint to get saved header mappings for a spreadsheet and worksheet"""
@@ -1716,15 +4715,7 @@ def get_header_mappings_endpoint(spreadsheet_id, worksheet_name):
         
         # Get spreadsheet column preferences
         spreadsheet = get_spreadsheet(int(spreadsheet_id))
-        column_preferences = {}
-        if spreadsheet:
-            column_preferences = {
-                "date": spreadsheet.get("include_date", 1) == 1,
-                "distance": spreadsheet.get("include_distance", 1) == 1,
-                "time": spreadsheet.get("include_time", 1) == 1,
-                "pace": spreadsheet.get("include_pace", 1) == 1,
-                "heart_rate": spreadsheet.get("include_hr", 1) == 1
-            }
+        column_preferences = spreadsheet_column_preferences(spreadsheet) if spreadsheet else {}
         
         logger.info(f"Found mappings: {mappings}")
         logger.info(f"Column preferences: {column_preferences}")
@@ -1751,6 +4742,8 @@ def get_spreadsheet_data(spreadsheet_id, worksheet_name=None, row_limit=None):
         print(f"DEBUG: Invalid spreadsheet ID: {spreadsheet_id}")
         return []
         
+    import gspread
+
     try:
         # Auth to Google Sheets
         creds_file = os.getenv("GOOGLE_CREDS_FILE")
@@ -1760,14 +4753,7 @@ def get_spreadsheet_data(spreadsheet_id, worksheet_name=None, row_limit=None):
             print(f"DEBUG: {error_msg}")
             raise FileNotFoundError(error_msg)
             
-        creds = ServiceAccountCredentials.from_json_keyfile_name(
-            creds_file,
-            [
-                "https://spreadsheets.google.com/feeds",
-                "https://www.googleapis.com/auth/drive",
-            ],
-        )
-        client = gspread.authorize(creds)
+        client = get_gspread_client()
         
         # Try to open the spreadsheet
         logger.debug(f"Attempting to open spreadsheet with ID: {spreadsheet_id}")
@@ -2079,44 +5065,13 @@ def print_selected_data():
 
 @app.route("/sync")
 def sync():
-    token = session.get("token")
-    
-    # Try to get from cookie session ID if not in session
-    if not token and COOKIE_NAME in request.cookies:
-        session_id = request.cookies.get(COOKIE_NAME)
-        token = get_token_from_session_id(session_id)
-        if token:
-            session["token"] = token
-    
+    token = get_authenticated_token()
     if not token:
         flash("Please connect your Strava account first")
         return redirect(url_for("home"))
 
-    # Check if token is expired and refresh if needed
-    if is_token_expired(token):
-        new_token = refresh_token(token)
-        if not new_token:
-            flash("Your authentication has expired. Please login again.")
-            return redirect(url_for("login"))
-        token = new_token
-        session["token"] = token
-        session.permanent = True
-        
-        # Update token in database if we have a session ID
-        if COOKIE_NAME in request.cookies:
-            session_id = request.cookies.get(COOKIE_NAME)
-            store_token_with_session_id(session_id, token)
-
-    # Use the access_token from the token dictionary
-    headers = {"Authorization": f"Bearer {token['access_token']}"}
     # Get only the latest activity (per_page=1 and page=1)
-    params = {"per_page": 1, "page": 1}
-    
-    resp = requests.get(
-        "https://www.strava.com/api/v3/athlete/activities",
-        headers=headers,
-        params=params,
-    )
+    resp = fetch_strava_activities(token, {"per_page": 1, "page": 1})
 
     if resp.status_code != 200:
         flash(f"Error accessing Strava API: {resp.status_code}")
@@ -2128,108 +5083,738 @@ def sync():
         flash("No activities found")
         return redirect(url_for("home"))
     
-    # Process and format the latest activity for display
-    formatted_activities = []
-    for a in acts:
-        # Format date (dd/mm/yyyy)
-        date_obj = datetime.strptime(a["start_date"], "%Y-%m-%dT%H:%M:%SZ")
-        formatted_date = date_obj.strftime("%d/%m/%Y")
-        
-        # Format distance (xx,yy km)
-        distance_km_numeric = round(a["distance"] / 1000, 2)
-        distance_km = str(distance_km_numeric).replace('.', ',')
-        
-        # Format duration (hh:mm:ss)
-        duration_seconds = a["moving_time"]
-        hours, remainder = divmod(duration_seconds, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        duration = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-        
-        # Calculate pace (min/km)
-        if distance_km_numeric > 0:
-            pace_seconds = duration_seconds / distance_km_numeric
-            pace_minutes, pace_remainder_seconds = divmod(pace_seconds, 60)
-            pace = f"{int(pace_minutes):02d}:{int(pace_remainder_seconds):02d}"
-        else:
-            pace = "00:00"
-            
-        # Get HR (if available)
-        avg_hr_raw = a.get("average_heartrate", "")
-        avg_hr = round(float(avg_hr_raw)) if avg_hr_raw != "" else ""
-        
-        formatted_activities.append({
-            "date": formatted_date,
-            "distance": distance_km,
-            "duration": duration,
-            "pace": pace,
-            "heart_rate": avg_hr,
-            "name": a.get("name", "Activity"),
-            "type": a.get("type", "")
-        })
-
     # Store the formatted activities in the session for later use
-    session["preview_activities"] = formatted_activities
-    
-    # Get all spreadsheets for selection
-    all_spreadsheets = get_spreadsheets()
-    
-    # Get default spreadsheet
-    default_spreadsheet = None
-    for sheet in all_spreadsheets:
-        if sheet.get("is_default"):
-            default_spreadsheet = sheet
-            break
-    
-    # If no default, use the first one
-    if not default_spreadsheet and all_spreadsheets:
-        default_spreadsheet = all_spreadsheets[0]
-    
-    # Ensure sheet_id is included in the default spreadsheet
-    if default_spreadsheet and not default_spreadsheet.get("sheet_id"):
-        logger.warning(f"Default spreadsheet {default_spreadsheet.get('name')} has no sheet_id")
-        print(f"DEBUG: Default spreadsheet {default_spreadsheet.get('name')} has no sheet_id")
-    else:
-        logger.info(f"Default spreadsheet: {default_spreadsheet.get('name')}, sheet_id: {default_spreadsheet.get('sheet_id')}")
-        print(f"DEBUG: Default spreadsheet: {default_spreadsheet.get('name')}, sheet_id: {default_spreadsheet.get('sheet_id')}")
+    formatted_activities = add_stream_metrics([format_activity(a) for a in acts])
+    store_preview_session(formatted_activities, "sync")
     
-    # Get worksheet names for the selected spreadsheet
-    worksheet_names = []
-    selected_worksheet = "Sheet1"  # Default fallback
-    if default_spreadsheet and default_spreadsheet.get("sheet_id"):
+    return render_preview_page(formatted_activities, "sync")
+
+# Activity streams
+#
+# Opt-in download of the per-second streams behind each activity. Streams are
+# stored as zlib-compressed typed arrays rather than JSON lists: a float is
+# 4 bytes before compression instead of ~8 characters of text, and loading
+# is a decompress plus a zero-copy numpy.frombuffer / array.frombytes.
+STRAVA_ACTIVITY_STREAMS_URL = "https://www.strava.com/api/v3/activities/{activity_id}/streams"
+
+# Stream type -> array typecode ('i' int32 seconds, 'f' float32)
+STREAM_TYPECODES = {
+    "time": "i",
+    "distance": "f",
+    "heartrate": "f",
+    "altitude": "f",
+    "cadence": "f",
+}
+NUMPY_DTYPES = {"i": "<i4", "f": "<f4"}
+# Stored samples are 4 bytes wide whatever the platform; array's "i" is a C
+# int, so pick whichever array code has that width here
+ARRAY_TYPECODES = {"i": next(code for code in ("i", "l") if array(code).itemsize == 4), "f": "f"}
+
+STREAMS_MAX_WORKERS = 4
+# Stop fetching when fewer than this many requests remain in Strava's
+# 15-minute window, leaving headroom for interactive requests
+STRAVA_RATE_LIMIT_HEADROOM = 10
+
+
+def encode_stream(values, typecode):
+    """Pack a list of numbers into a compressed little-endian typed array.
+
+    Missing samples (None) are stored as NaN, which only float streams can
+    hold; see store_activity_streams.
+    """
+    packed = array(ARRAY_TYPECODES[typecode], (float("nan") if v is None else v for v in values))
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return zlib.compress(packed.tobytes(), 6)
+
+
+def decode_stream(blob, typecode, as_numpy=False):
+    """Unpack a stored stream into an array.array, or a numpy array view"""
+    raw = zlib.decompress(blob)
+    if as_numpy:
+        import numpy as np
+        # frombuffer reuses the decompressed buffer without copying it
+        return np.frombuffer(raw, dtype=NUMPY_DTYPES[typecode])
+    values = array(ARRAY_TYPECODES[typecode])
+    values.frombytes(raw)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def store_activity_summaries(activities):
+    """Upsert raw Strava activity summaries into the local archive"""
+    with get_db_connection() as conn:
+        conn.executemany(
+            """INSERT INTO activities (id, start_date, start_date_local, name, type, distance, moving_time, average_heartrate)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(id) DO UPDATE SET
+                   start_date = excluded.start_date,
+                   start_date_local = excluded.start_date_local,
+                   name = excluded.name,
+                   type = excluded.type,
+                   distance = excluded.distance,
+                   moving_time = excluded.moving_time,
+                   average_heartrate = excluded.average_heartrate,
+                   updated_at = CURRENT_TIMESTAMP""",
+            [
+                (
+                    a["id"], a["start_date"], a.get("start_date_local"), a.get("name"), a.get("type"),
+                    a.get("distance"), a.get("moving_time"), a.get("average_heartrate")
+                )
+                for a in activities if a.get("id") is not None
+            ]
+        )
+        conn.commit()
+
+
+def store_activity_streams(activity_id, streams):
+    """Store the streams of one activity, replacing any previous copy"""
+    rows = []
+    for stream_type, typecode in STREAM_TYPECODES.items():
+        values = streams.get(stream_type)
+        if values:
+            if typecode == "i" and any(v is None for v in values):
+                # Keep the gaps as NaN rather than zeros
+                typecode = "f"
+            rows.append((activity_id, stream_type, typecode, len(values), encode_stream(values, typecode)))
+    with get_db_connection() as conn:
+        conn.executemany(
+            """INSERT INTO activity_streams (activity_id, stream_type, typecode, length, data) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(activity_id, stream_type) DO UPDATE SET
+                   typecode = excluded.typecode, length = excluded.length, data = excluded.data,
+                   created_at = CURRENT_TIMESTAMP""",
+            rows
+        )
+        conn.commit()
+
+
+def load_activity_streams(activity_id, stream_types=None, as_numpy=False):
+    """Load the stored streams of one activity as {stream_type: array}"""
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            "SELECT stream_type, typecode, data FROM activity_streams WHERE activity_id = ?",
+            (activity_id,)
+        ).fetchall()
+    return {
+        row["stream_type"]: decode_stream(row["data"], row["typecode"], as_numpy)
+        for row in rows
+        if stream_types is None or row["stream_type"] in stream_types
+    }
+
+
+def get_activity_ids_with_streams(activity_ids):
+    """Return the subset of activity IDs whose streams are already stored"""
+    activity_ids = list(activity_ids)
+    found = set()
+    with get_db_connection() as conn:
+        # Chunked to stay under SQLite's bound-parameter limit
+        for i in range(0, len(activity_ids), 500):
+            chunk = activity_ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT DISTINCT activity_id FROM activity_streams WHERE activity_id IN ({placeholders})",
+                chunk
+            ).fetchall()
+            found.update(row["activity_id"] for row in rows)
+    return found
+
+
+def strava_requests_remaining(response):
+    """Requests left in the current 15-minute window, from Strava's rate limit headers"""
+    limit = response.headers.get("X-ReadRateLimit-Limit") or response.headers.get("X-RateLimit-Limit")
+    usage = response.headers.get("X-ReadRateLimit-Usage") or response.headers.get("X-RateLimit-Usage")
+    if not limit or not usage:
+        return None
+    try:
+        # Headers are "<15-minute>,<daily>"; the tighter of the two applies
+        limits = [int(x) for x in limit.split(",")]
+        usages = [int(x) for x in usage.split(",")]
+    except ValueError:
+        return None
+    return min(l - u for l, u in zip(limits, usages))
+
+
+def fetch_activity_streams(token, activity_id):
+    """Fetch the streams of one activity; returns (streams or None, response)"""
+    resp = strava_request(
+        requests.get,
+        STRAVA_ACTIVITY_STREAMS_URL.format(activity_id=activity_id),
+        headers={"Authorization": f"Bearer {token['access_token']}"},
+        params={"keys": ",".join(STREAM_TYPECODES), "key_by_type": "true"},
+    )
+    if resp.status_code != 200:
+        return None, resp
+    return {stream_type: stream.get("data", []) for stream_type, stream in resp.json().items()}, resp
+
+
+def ingest_activity_streams(token, activity_ids):
+    """Download and store streams for activities that do not have them yet.
+
+    Fetches run concurrently on a small thread pool. Every response's rate
+    limit headers are checked, and no new fetches start once the remaining
+    budget reaches STRAVA_RATE_LIMIT_HEADROOM or Strava answers 429; the
+    activities left over are reported as deferred and picked up next time.
+    """
+    stored = get_activity_ids_with_streams(activity_ids)
+    pending = [a for a in dict.fromkeys(activity_ids) if a not in stored]
+    stats = {"requested": len(activity_ids), "fetched": 0, "failed": 0, "deferred": 0, "rate_limited": False}
+    if not pending:
+        return stats
+
+    rate_state = {"stop": False}
+    rate_lock = threading.Lock()
+
+    def fetch(activity_id):
+        with rate_lock:
+            if rate_state["stop"]:
+                return activity_id, None, "deferred"
+        streams, resp = fetch_activity_streams(token, activity_id)
+        if getattr(resp, "unavailable", False):
+            # Strava is down: leave the rest for next time instead of failing each one
+            with rate_lock:
+                rate_state["stop"] = True
+            return activity_id, None, "deferred"
+        remaining = strava_requests_remaining(resp)
+        with rate_lock:
+            if resp.status_code == 429 or (remaining is not None and remaining <= STRAVA_RATE_LIMIT_HEADROOM):
+                rate_state["stop"] = True
+        if resp.status_code == 429:
+            return activity_id, None, "deferred"
+        return activity_id, streams, "fetched" if streams is not None else "failed"
+
+    with ThreadPoolExecutor(max_workers=STREAMS_MAX_WORKERS) as executor:
+        # Results are stored from this thread so SQLite sees a single writer
+        for activity_id, streams, outcome in executor.map(fetch, pending):
+            stats[outcome] += 1
+            if streams is not None:
+                store_activity_streams(activity_id, streams)
+            elif outcome == "failed":
+                logger.warning(f"Could not fetch streams for activity {activity_id}")
+
+    stats["rate_limited"] = rate_state["stop"]
+    logger.info(f"Stream ingestion: {stats}")
+    return stats
+
+
+def load_streams_for_activities(activity_ids, stream_types=("time", "distance", "heartrate")):
+    """Load stored streams for many activities in one query per 500 IDs.
+
+    Returns {activity_id: {stream_type: numpy array}}; activities without
+    stored streams are missing from the result.
+    """
+    activity_ids = list(dict.fromkeys(activity_ids))
+    type_placeholders = ",".join("?" * len(stream_types))
+    streams = {}
+    with get_db_connection() as conn:
+        for i in range(0, len(activity_ids), 500):
+            chunk = activity_ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"""SELECT activity_id, stream_type, typecode, data FROM activity_streams
+                    WHERE activity_id IN ({placeholders}) AND stream_type IN ({type_placeholders})""",
+                chunk + list(stream_types)
+            ).fetchall()
+            for row in rows:
+                streams.setdefault(row["activity_id"], {})[row["stream_type"]] = decode_stream(
+                    row["data"], row["typecode"], as_numpy=True
+                )
+    return streams
+
+
+def compute_activity_metrics(activity_ids):
+    """Splits, best efforts and HR zone time for activities with stored streams.
+
+    All activities are analysed in one batched pass. Returns
+    {activity_id: {field: value}}, or {} when numpy is not installed.
+    """
+    streams = load_streams_for_activities(activity_ids)
+    if not streams:
+        return {}
+    try:
+        # Imported here so numpy is only loaded when there is something to analyse
+        import analytics
+    except ImportError:
+        logger.warning("numpy is not installed; skipping stream metrics")
+        return {}
+    ids = list(streams)
+    metrics = analytics.compute_stream_metrics([streams[i] for i in ids], MAX_HEART_RATE)
+    return dict(zip(ids, metrics))
+
+
+def add_stream_metrics(formatted_activities):
+    """Fill in the stream metric fields of formatted activities, in place"""
+    activity_ids = [int(a["strava_id"]) for a in formatted_activities if a.get("strava_id")]
+    metrics = compute_activity_metrics(activity_ids) if activity_ids else {}
+    for activity in formatted_activities:
+        activity_metrics = metrics.get(int(activity["strava_id"])) if activity.get("strava_id") else None
+        for field, _ in STREAM_METRIC_FIELDS:
+            activity[field] = activity_metrics[field] if activity_metrics else ""
+    return formatted_activities
+
+
+@app.route("/api/analytics/season")
+def api_season_analytics():
+    """Stream metrics for every archived activity between two dates (YYYY-MM-DD)"""
+    token = get_authenticated_token()
+    if not token:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    after = request.args.get("after", "")
+    before = request.args.get("before", "")
+    try:
+        for value in (after, before):
+            if value:
+                datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        return jsonify({"error": "after and before must be dates in YYYY-MM-DD format"}), 400
+
+    query = "SELECT id, start_date, name, type FROM activities WHERE 1 = 1"
+    params = []
+    if after:
+        query += " AND start_date >= ?"
+        params.append(after)
+    if before:
+        query += " AND start_date < ?"
+        params.append(before)
+    with get_db_connection() as conn:
+        activities = conn.execute(query + " ORDER BY start_date", params).fetchall()
+
+    metrics = compute_activity_metrics([row["id"] for row in activities])
+    return jsonify({
+        "activities": [
+            dict(id=row["id"], start_date=row["start_date"], name=row["name"], type=row["type"], **metrics[row["id"]])
+            for row in activities if row["id"] in metrics
+        ],
+        "without_streams": sum(1 for row in activities if row["id"] not in metrics)
+    })
+
+
+@app.route("/api/streams/ingest", methods=["POST"])
+def api_ingest_streams():
+    """Download streams for the given activity IDs, or for the current preview"""
+    token = get_authenticated_token()
+    if not token:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    data = request.get_json(silent=True) or {}
+    activity_ids = data.get("activity_ids")
+    if activity_ids is None:
+        activity_ids = [a["strava_id"] for a in session.get("preview_activities") or [] if a.get("strava_id")]
+    try:
+        activity_ids = [int(a) for a in activity_ids]
+    except (TypeError, ValueError):
+        return jsonify({"error": "activity_ids must be a list of Strava activity IDs"}), 400
+
+    return jsonify(ingest_activity_streams(token, activity_ids))
+
+
+# Offline import from a Strava account export
+#
+# The archive is parsed by strava_export.py, which yields API-shaped activity
+# summaries, so they go through format_activity and the regular import plan
+# just like activities fetched from Strava. No Strava API calls are made.
+# Activities are imported in batches, each its own import plan, so a large
+# archive never becomes one huge plan and sheet write. The web upload only
+# reads activities.csv; decoding GPX/TCX/FIT files takes too long for a
+# request and is left to `flask import-export`.
+EXPORT_SUMMARY_BATCH_SIZE = 500
+EXPORT_IMPORT_BATCH_SIZE = 1000
+
+
+def import_strava_export(archive, spreadsheet, worksheet_name, field_mappings, with_streams=False,
+                         max_workers=0, batch_size=EXPORT_IMPORT_BATCH_SIZE, decode_files=True, wait=True):
+    """Import every activity of an export archive into a worksheet.
+
+    Summaries (and decoded streams, if requested) are archived locally as
+    they are parsed, and every ``batch_size`` activities are written as one
+    import. Activity files are decoded in this process unless ``max_workers``
+    asks for a process pool (command line only); with ``decode_files=False``
+    they are not read at all (see iter_export_activities). With
+    ``wait=False`` a batch whose worksheet is busy is left queued for the
+    lease holder (see run_sheet_import). Returns the summed counts with
+    ``parsed``, ``skipped``, ``queued``, ``imports``, ``message`` and
+    ``seconds``.
+    """
+    import strava_export
+
+    started = time.monotonic()
+    totals = {"parsed": 0, "added": 0, "updated": 0, "unchanged": 0, "imports": 0, "warnings": [], "skipped": 0, "queued": 0}
+    pending = []
+    summaries = []
+    streams_stored = 0
+
+    def flush():
+        if not pending:
+            return
+        if any(field in field_mappings for field, _ in STREAM_METRIC_FIELDS):
+            add_stream_metrics(pending)
         try:
-            logger.info(f"Getting worksheets for default spreadsheet: {default_spreadsheet.get('name')} (ID: {default_spreadsheet.get('sheet_id')})")
-            worksheet_names = get_worksheet_names(default_spreadsheet.get("sheet_id"))
-            
-            # Use the saved default worksheet if available
-            if default_spreadsheet.get("default_worksheet"):
-                selected_worksheet = default_spreadsheet.get("default_worksheet")
-                logger.info(f"Using saved default worksheet: {selected_worksheet}")
-            elif worksheet_names:
-                selected_worksheet = worksheet_names[0]  # Use first worksheet as fallback
-                logger.info(f"No saved default worksheet, using first available: {selected_worksheet}")
-            else:
-                selected_worksheet = "Sheet1"  # Final fallback
-                
-        except Exception as e:
-            logger.error(f"Error getting worksheet names: {str(e)}")
-            worksheet_names = ["Sheet1"]
-            if not selected_worksheet:
-                selected_worksheet = "Sheet1"
-    
-    # Get saved field mappings from session (if coming back from a failed import)
-    saved_field_mappings = session.get("saved_field_mappings")
-    
-    return render_template(
-        "preview_activities.html", 
-        activities=formatted_activities, 
-        spreadsheets=all_spreadsheets,
-        selected_spreadsheet=default_spreadsheet,
-        worksheet_names=worksheet_names,
-        selected_worksheet=selected_worksheet,
-        saved_field_mappings=saved_field_mappings,
-        source='sync'
+            result = run_sheet_import(spreadsheet, worksheet_name, field_mappings, pending, wait=wait)
+        except SheetImportQueued:
+            totals["queued"] += len(pending)
+            pending.clear()
+            return
+        totals["imports"] += 1
+        for key in ("added", "updated", "unchanged"):
+            totals[key] += result.get(key, 0)
+        totals["warnings"].extend(w for w in result.get("warnings", []) if w not in totals["warnings"])
+        logger.info(f"Export import: {totals['parsed']} activities read, batch {totals['imports']}: {result['message']}")
+        pending.clear()
+
+    activities = strava_export.iter_export_activities(
+        archive, with_streams=with_streams, max_workers=max_workers, decode_files=decode_files, stats=totals
+    )
+    for activity, streams in activities:
+        summaries.append(activity)
+        pending.append(format_activity(activity))
+        totals["parsed"] += 1
+        if streams:
+            store_activity_streams(activity["id"], streams)
+            streams_stored += 1
+        if len(summaries) >= EXPORT_SUMMARY_BATCH_SIZE:
+            store_activity_summaries(summaries)
+            summaries = []
+        if len(pending) >= batch_size:
+            # Archived before the sheet import, as on the single-batch path
+            store_activity_summaries(summaries)
+            summaries = []
+            flush()
+    if summaries:
+        store_activity_summaries(summaries)
+    logger.info(f"Parsed {totals['parsed']} activities from export ({streams_stored} with streams) in {time.monotonic() - started:.1f}s")
+
+    if not totals["parsed"]:
+        message = "The archive does not contain any importable activities."
+        if totals["skipped"] and not decode_files:
+            message += f" {totals['skipped']} need their activity files: import the archive with `flask import-export`."
+        raise SheetImportError(message, endpoint="import_activities")
+    flush()
+
+    totals["message"] = (
+        f"Imported the export into '{spreadsheet['name']}' (worksheet: {worksheet_name}): "
+        f"{totals['added']} added, {totals['updated']} updated, {totals['unchanged']} unchanged."
+    )
+    if totals["queued"]:
+        totals["message"] += f" {totals['queued']} more are queued behind another import into this worksheet and will be written shortly."
+    if totals["skipped"] and not decode_files:
+        totals["message"] += (
+            f" {totals['skipped']} activities have no distance or moving time in activities.csv; "
+            "import the full archive with `flask import-export` to read them from their files."
+        )
+    if totals["warnings"]:
+        totals["message"] += " Note: " + " ".join(totals["warnings"])
+    totals["seconds"] = round(time.monotonic() - started, 1)
+    return totals
+
+
+@app.route("/import_export", methods=["POST"])
+def import_export():
+    """Import a Strava export zip into a worksheet using its saved header mappings"""
+    if not get_authenticated_token():
+        flash("Please connect your Strava account first")
+        return redirect(url_for("home"))
+
+    archive = request.files.get("archive")
+    if not archive or not archive.filename:
+        flash("Please choose a Strava export archive (.zip)")
+        return redirect(url_for("import_activities"))
+
+    spreadsheet = resolve_import_spreadsheet(request.form.get("spreadsheet_id"))
+    if not spreadsheet:
+        flash("No spreadsheet configured. Please add a spreadsheet first.")
+        return redirect(url_for("spreadsheets"))
+
+    worksheet_name = request.form.get("worksheet_name") or spreadsheet.get("default_worksheet") or "Sheet1"
+    field_mappings = get_header_mappings(spreadsheet["id"], worksheet_name)
+    if not field_mappings:
+        flash(f"No saved column mapping for worksheet '{worksheet_name}'. Import a few activities through the preview first to set one up.")
+        return redirect(url_for("import_activities"))
+
+    try:
+        # The upload is spooled to a temporary file by Werkzeug; only
+        # activities.csv is read from it in place
+        result = import_strava_export(archive.stream, spreadsheet, worksheet_name, field_mappings, decode_files=False, wait=False)
+    except SheetImportError as e:
+        flash(e.message)
+        return redirect(url_for(e.endpoint))
+    except (ValueError, zipfile.BadZipFile) as e:
+        flash(f"Could not read the archive: {str(e)}")
+        return redirect(url_for("import_activities"))
+    except Exception as e:
+        logger.error(f"Error importing Strava export: {str(e)}")
+        flash(f"Error importing to spreadsheet: {str(e)}")
+        return redirect(url_for("import_activities"))
+
+    flash(f"{result['message']} ({result['parsed']} activities read from the archive in {result['seconds']}s)")
+    return redirect(url_for("home"))
+
+
+# Command line
+#
+# Headless versions of the import flow for cron and large backfills:
+#
+#     flask --app app backfill --after 2015-01-01 --sheet "Running Log" --worksheet 2015
+#     flask --app app sync --all-users --target 12345 "Running Log" 2025 --target 67890 "Club Log" Runs
+#     flask --app app import-export export_12345.zip --streams
+#
+# They use the Strava logins stored in the sessions table and the header
+# mappings saved by the last import through the web page.
+CLI_PAGE_SIZE = 200  # Strava's maximum per_page
+CLI_IMPORT_BATCH_SIZE = 1000  # activities per import plan (one sheet read, batched writes)
+
+
+def _parse_cli_date(value):
+    """Unix timestamp (UTC midnight) for a YYYY-MM-DD command line option"""
+    if not value:
+        return None
+    try:
+        day = datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise click.BadParameter(f"'{value}' is not a date in YYYY-MM-DD format")
+    return int((day - datetime(1970, 1, 1)).total_seconds())
+
+
+def get_stored_logins():
+    """Stored Strava logins as (session_id, token), newest first, one per athlete"""
+    with get_db_connection() as conn:
+        rows = conn.execute("SELECT session_id, token_data FROM sessions ORDER BY created_at DESC").fetchall()
+    logins = []
+    seen = set()
+    for row in rows:
+        token = json.loads(row["token_data"])
+        athlete = token.get("athlete") or {}
+        key = athlete.get("id") or token.get("refresh_token")
+        if key in seen:
+            continue
+        seen.add(key)
+        logins.append((row["session_id"], token))
+    return logins
+
+
+def get_cli_token(session_id, token):
+    """A valid token for a stored login, refreshed and saved back if expired"""
+    if not is_token_expired(token):
+        return token
+    new_token = refresh_token(token)
+    if not new_token:
+        return None
+    # Refresh responses do not include the athlete; keep it for de-duplication
+    if token.get("athlete") and not new_token.get("athlete"):
+        new_token["athlete"] = token["athlete"]
+    store_token_with_session_id(session_id, new_token)
+    return new_token
+
+
+def iter_strava_activity_pages(token, after=None, before=None, per_page=CLI_PAGE_SIZE, stats=None):
+    """Yield pages of raw activities until Strava returns an empty page"""
+    page = 1
+    while True:
+        resp = fetch_strava_activities(token, build_strava_params(before, after, str(page), str(per_page)))
+        if stats is not None:
+            stats["strava_requests"] += 1
+        if resp.status_code != 200:
+            raise click.ClickException(f"Error accessing Strava API: {resp.status_code}")
+        activities = resp.json()
+        if not activities:
+            return
+        yield activities
+        if len(activities) < per_page:
+            return
+        page += 1
+
+
+def resolve_cli_spreadsheet(sheet):
+    """Spreadsheet by local ID or name, or the default one"""
+    if not sheet:
+        spreadsheet = get_default_spreadsheet()
+    elif sheet.isdigit():
+        spreadsheet = get_spreadsheet(int(sheet))
+    else:
+        spreadsheet = next((s for s in get_spreadsheets() if s["name"] == sheet), None)
+    if not spreadsheet:
+        raise click.ClickException(f"Spreadsheet '{sheet or 'default'}' is not configured")
+    return spreadsheet
+
+
+def stream_activities_to_sheet(token, spreadsheet, worksheet_name, field_mappings, after=None, before=None,
+                               batch_size=CLI_IMPORT_BATCH_SIZE, append_only=False):
+    """Page through Strava and import every batch_size activities as one plan.
+
+    Returns throughput counters for the caller to print.
+    """
+    stats = {"strava_requests": 0, "activities": 0, "added": 0, "updated": 0, "unchanged": 0, "imports": 0, "throttled_seconds": 0.0}
+    started = time.monotonic()
+    pending = []
+
+    def flush():
+        if not pending:
+            return
+        if any(field in field_mappings for field, _ in STREAM_METRIC_FIELDS):
+            add_stream_metrics(pending)
+        result = run_sheet_import(spreadsheet, worksheet_name, field_mappings, pending, append_only)
+        stats["imports"] += 1
+        for key in ("added", "updated", "unchanged", "throttled_seconds"):
+            stats[key] += result[key]
+        elapsed = time.monotonic() - started
+        click.echo(f"  {stats['activities']} activities ({stats['activities'] / elapsed:.1f}/s): {result['message']}")
+        pending.clear()
+
+    for page in iter_strava_activity_pages(token, after, before, stats=stats):
+        store_activity_summaries(page)
+        pending.extend(format_activity(a) for a in page)
+        stats["activities"] += len(page)
+        if len(pending) >= batch_size:
+            flush()
+    flush()
+
+    stats["seconds"] = round(time.monotonic() - started, 1)
+    return stats
+
+
+def echo_import_stats(stats):
+    seconds = max(stats["seconds"], 0.001)
+    click.echo(
+        f"{stats['activities']} activities in {stats['seconds']}s ({stats['activities'] / seconds:.1f}/s): "
+        f"{stats['added']} added, {stats['updated']} updated, {stats['unchanged']} unchanged; "
+        f"{stats['strava_requests']} Strava requests, {stats['imports']} sheet imports, "
+        f"{stats['throttled_seconds']:.1f}s waiting for the Sheets quota"
     )
 
+
+def _cli_import_target(sheet, worksheet):
+    """Spreadsheet, worksheet and saved header mappings for a CLI import"""
+    ensure_db_initialized()
+    spreadsheet = resolve_cli_spreadsheet(sheet)
+    worksheet_name = worksheet or spreadsheet.get("default_worksheet") or "Sheet1"
+    field_mappings = get_header_mappings(spreadsheet["id"], worksheet_name)
+    if not field_mappings:
+        raise click.ClickException(
+            f"No saved column mapping for '{spreadsheet['name']}' / '{worksheet_name}'. Import once through the web page to set one up."
+        )
+    return spreadsheet, worksheet_name, field_mappings
+
+
+@app.cli.command("backfill")
+@click.option("--after", help="Import activities from this date (YYYY-MM-DD)")
+@click.option("--before", help="Import activities before this date (YYYY-MM-DD)")
+@click.option("--sheet", help="Spreadsheet name or ID (default: the default spreadsheet)")
+@click.option("--worksheet", help="Worksheet name (default: the spreadsheet's default worksheet)")
+@click.option("--batch-size", default=CLI_IMPORT_BATCH_SIZE, show_default=True, help="Activities per sheet import")
+@click.option("--append", "append_only", is_flag=True, help="Append every activity as a new row without matching existing rows (for empty or archive worksheets)")
+def backfill_command(after, before, sheet, worksheet, batch_size, append_only):
+    """Import a date range of activities for the most recent Strava login."""
+    after, before = _parse_cli_date(after), _parse_cli_date(before)
+    spreadsheet, worksheet_name, field_mappings = _cli_import_target(sheet, worksheet)
+    logins = get_stored_logins()
+    if not logins:
+        raise click.ClickException("No stored Strava login. Connect Strava through the web page first.")
+    token = get_cli_token(*logins[0])
+    if not token:
+        raise click.ClickException("The stored Strava login has expired. Connect Strava through the web page again.")
+
+    click.echo(f"Backfilling into '{spreadsheet['name']}' / '{worksheet_name}'")
+    try:
+        stats = stream_activities_to_sheet(token, spreadsheet, worksheet_name, field_mappings, after, before, batch_size, append_only)
+    except SheetImportError as e:
+        raise click.ClickException(e.message)
+    echo_import_stats(stats)
+
+
+@app.cli.command("import-export")
+@click.argument("archive", type=click.Path(exists=True, dir_okay=False))
+@click.option("--sheet", help="Spreadsheet name or ID (default: the default spreadsheet)")
+@click.option("--worksheet", help="Worksheet name (default: the spreadsheet's default worksheet)")
+@click.option("--streams", "with_streams", is_flag=True, help="Also decode and store every activity's streams")
+@click.option("--workers", type=int, default=None, help="Processes decoding activity files (default: one per CPU; 0 decodes in this process)")
+@click.option("--batch-size", default=EXPORT_IMPORT_BATCH_SIZE, show_default=True, help="Activities per sheet import")
+def import_export_command(archive, sheet, worksheet, with_streams, workers, batch_size):
+    """Import a Strava account export zip, decoding activity files on a process pool."""
+    spreadsheet, worksheet_name, field_mappings = _cli_import_target(sheet, worksheet)
+    click.echo(f"Importing {archive} into '{spreadsheet['name']}' / '{worksheet_name}'")
+    try:
+        result = import_strava_export(archive, spreadsheet, worksheet_name, field_mappings, with_streams, workers, batch_size)
+    except SheetImportError as e:
+        raise click.ClickException(e.message)
+    except (ValueError, zipfile.BadZipFile) as e:
+        raise click.ClickException(f"Could not read the archive: {str(e)}")
+    click.echo(f"{result['message']} ({result['parsed']} activities, {result['imports']} sheet imports, {result['seconds']}s)")
+
+
+def _login_athlete_id(token):
+    """Strava athlete ID of a stored login as a string, or None for logins saved without one"""
+    athlete_id = (token.get("athlete") or {}).get("id")
+    return str(athlete_id) if athlete_id is not None else None
+
+
+def resolve_sync_targets(logins, all_users, targets, sheet, worksheet):
+    """(session_id, token, athlete, import target) for each login to sync.
+
+    Spreadsheets are not owned by a Strava athlete, so --all-users needs an
+    explicit --target for every stored login rather than sending everyone's
+    activities into one worksheet.
+    """
+    by_athlete = {athlete_id: (target_sheet, target_worksheet) for athlete_id, target_sheet, target_worksheet in targets}
+    if not all_users:
+        logins = logins[:1]
+    elif sheet or worksheet:
+        raise click.ClickException(
+            "--sheet/--worksheet would write every athlete into the same worksheet. "
+            "Give each athlete its own --target ATHLETE_ID SHEET WORKSHEET instead."
+        )
+    else:
+        unmapped = [_login_athlete_id(token) or session_id[:8] for session_id, token in logins
+                    if _login_athlete_id(token) not in by_athlete]
+        if unmapped:
+            raise click.ClickException(
+                f"No --target for athlete(s) {', '.join(unmapped)}. "
+                "--all-users needs --target ATHLETE_ID SHEET WORKSHEET for every stored Strava login."
+            )
+
+    resolved = []
+    for session_id, token in logins:
+        athlete_id = _login_athlete_id(token)
+        target = by_athlete.get(athlete_id, (sheet, worksheet))
+        resolved.append((session_id, token, athlete_id or session_id[:8], _cli_import_target(*target)))
+    return resolved
+
+
+@app.cli.command("sync")
+@click.option("--all-users", is_flag=True, help="Sync every stored Strava login, not just the most recent one (needs a --target per athlete)")
+@click.option("--target", "targets", type=(str, str, str), multiple=True, metavar="ATHLETE_ID SHEET WORKSHEET",
+              help="Spreadsheet (name or ID) and worksheet for one athlete's activities; repeat for each athlete")
+@click.option("--days", default=7, show_default=True, help="Look back this many days")
+@click.option("--sheet", help="Spreadsheet name or ID (default: the default spreadsheet)")
+@click.option("--worksheet", help="Worksheet name (default: the spreadsheet's default worksheet)")
+def sync_command(all_users, targets, days, sheet, worksheet):
+    """Import recent activities; safe to run from cron (unchanged rows are not rewritten)."""
+    ensure_db_initialized()
+    logins = get_stored_logins()
+    if not logins:
+        raise click.ClickException("No stored Strava login. Connect Strava through the web page first.")
+    # Resolve every target before importing anything, so a typo fails the whole run
+    sync_targets = resolve_sync_targets(logins, all_users, targets, sheet, worksheet)
+
+    after = int(time.time()) - days * 86400
+    failures = 0
+    for session_id, token, athlete, (spreadsheet, worksheet_name, field_mappings) in sync_targets:
+        token = get_cli_token(session_id, token)
+        if not token:
+            click.echo(f"Athlete {athlete}: login expired, skipped", err=True)
+            failures += 1
+            continue
+        click.echo(f"Athlete {athlete}: syncing into '{spreadsheet['name']}' / '{worksheet_name}'")
+        try:
+            stats = stream_activities_to_sheet(token, spreadsheet, worksheet_name, field_mappings, after=after)
+        except (SheetImportError, click.ClickException) as e:
+            click.echo(f"Athlete {athlete}: {getattr(e, 'message', str(e))}", err=True)
+            failures += 1
+            continue
+        echo_import_stats(stats)
+    if failures:
+        raise SystemExit(1)
+
+
 if __name__ == "__main__":
     app.run(debug=True)
 
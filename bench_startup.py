@@ -0,0 +1,89 @@
+"""
+Startup-time benchmark for worker cold starts.
+
+Each run starts a fresh interpreter, imports ``app`` and serves one request to
+the home page through the Flask test client, reporting:
+
+- import time of the ``app`` module
+- latency of the first request (includes the one-time database initialisation)
+- latency of a second request (warm path, for comparison)
+- whether the heavy Google/OAuth client libraries were loaded along the way
+
+Usage:
+    python bench_startup.py [--runs 10]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs inside the child interpreter; prints a single JSON line
+CHILD_SCRIPT = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app as app_module
+t1 = time.perf_counter()
+client = app_module.app.test_client()
+client.get("/")
+t2 = time.perf_counter()
+client.get("/")
+t3 = time.perf_counter()
+heavy = ["gspread", "oauth2client", "requests_oauthlib"]
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "first_request_ms": (t2 - t1) * 1000,
+    "second_request_ms": (t3 - t2) * 1000,
+    "heavy_modules_loaded": [m for m in heavy if m in sys.modules],
+}))
+"""
+
+
+def run_once(db_path):
+    env = dict(os.environ)
+    env["DB_PATH"] = db_path
+    env.setdefault("SECRET_KEY", "bench")
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT],
+        cwd=PROJECT_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # Logging goes to stderr; the measurement is the last stdout line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="number of cold starts to measure")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench.db")
+        # The first run creates the schema; later runs measure restarts
+        # against an existing database, which is the common worker recycle case.
+        first = run_once(db_path)
+        runs = [run_once(db_path) for _ in range(args.runs)]
+
+    def summary(key):
+        values = [r[key] for r in runs]
+        return f"median {statistics.median(values):7.1f} ms   min {min(values):7.1f} ms   max {max(values):7.1f} ms"
+
+    print(f"Cold starts measured: {len(runs)} (plus 1 schema-creating run: "
+          f"import {first['import_ms']:.1f} ms, first request {first['first_request_ms']:.1f} ms)")
+    print(f"import app        {summary('import_ms')}")
+    print(f"first request     {summary('first_request_ms')}")
+    print(f"second request    {summary('second_request_ms')}")
+    loaded = sorted({m for r in runs for m in r["heavy_modules_loaded"]})
+    print(f"heavy client libraries loaded: {', '.join(loaded) if loaded else 'none'}")
+
+
+if __name__ == "__main__":
+    main()
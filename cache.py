@@ -0,0 +1,158 @@
+"""
+Interchangeable key-value caches shared by the app's workers.
+
+Three backends with the same small interface (``get``, ``set``, ``delete``):
+
+- ``MemoryCache``: an LRU dict in this process; the default, and enough
+  for a single worker.
+- ``SQLiteCache``: a table in a SQLite file, shared by every worker on the
+  host (the app points it at its own database).
+- ``RedisCache``: any Redis-protocol server, shared across hosts. Needs the
+  optional ``redis`` package, or an already-built client (tests pass a
+  ``fakeredis`` one).
+
+Values are serialised to JSON by every backend, so callers always get a
+fresh copy with the same types back (tuples come back as lists) whichever
+backend is configured, and an expired entry is a miss everywhere.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _loads(payload):
+    if isinstance(payload, bytes):
+        payload = payload.decode("utf-8")
+    return json.loads(payload)
+
+
+class MemoryCache:
+    """LRU cache in this process"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (expires_at, payload)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            payload = entry[1]
+        return _loads(payload)
+
+    def set(self, key, value, ttl):
+        payload = _dumps(value)
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteCache:
+    """Cache table in a SQLite file shared by all workers on the host"""
+
+    # Expired rows are purged on every this many writes
+    PURGE_EVERY = 200
+
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self._writes = 0
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        if not self._ready:
+            with self._lock:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache_entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                conn.commit()
+                self._ready = True
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        finally:
+            conn.close()
+        return _loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, _dumps(value), now + ttl)
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def delete(self, key):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class RedisCache:
+    """Cache on a Redis-protocol server; expiry is left to the server"""
+
+    def __init__(self, url=None, prefix="activity-tracker:", timeout=2, client=None):
+        self.prefix = prefix
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self._client = client
+
+    def get(self, key):
+        payload = self._client.get(self.prefix + key)
+        return _loads(payload) if payload is not None else None
+
+    def set(self, key, value, ttl):
+        # Millisecond expiry so that sub-second TTLs behave as in the other backends
+        self._client.set(self.prefix + key, _dumps(value), px=max(1, int(ttl * 1000)))
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+
+def make_cache(backend, sqlite_path=None, redis_url=None, maxsize=1024):
+    """Build the configured backend: "memory", "sqlite" or "redis" """
+    if backend == "sqlite":
+        return SQLiteCache(sqlite_path)
+    if backend == "redis":
+        return RedisCache(redis_url or "redis://localhost:6379/0")
+    if backend == "memory":
+        return MemoryCache(maxsize)
+    raise ValueError(f"Unknown cache backend: {backend}")
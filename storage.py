@@ -0,0 +1,238 @@
+"""
+Relational storage backends behind ``get_db_connection()``.
+
+The persistence functions in the app write plain SQL in the SQLite dialect
+with ``?`` placeholders and use the sqlite3 connection API (``execute``,
+``executemany``, ``cursor()``, ``lastrowid``, ``rowcount``, rows readable by
+column name and by position). Each backend hands out connections that
+behave that way, so those functions stay backend-agnostic:
+
+- ``SQLiteStorage``: a fresh sqlite3 connection per use on one local file;
+  the default.
+- ``PostgresStorage``: connections borrowed from a thread-safe pool, so
+  several web nodes can share one database. Statements are translated on
+  the way through (placeholders, column types in DDL and the few SQLite-only
+  expressions the app uses). Needs the optional ``psycopg2`` package.
+
+Schema versioning is backend-specific as well: SQLite keeps the version in
+``PRAGMA user_version``, PostgreSQL in a one-row ``schema_version`` table,
+and each backend has its own lock that serialises concurrent migrations.
+"""
+
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SQLiteStorage:
+    """One SQLite database file; a new connection for every use"""
+
+    def __init__(self, path):
+        self.path = path
+
+    @contextmanager
+    def connection(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get_schema_version(self, conn):
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def set_schema_version(self, conn, version):
+        conn.execute(f"PRAGMA user_version = {int(version)}")
+
+    def begin_migration(self, conn):
+        # Takes the database write lock until commit or rollback
+        conn.execute("BEGIN IMMEDIATE")
+
+
+# SQLite-only expressions used by the app, and their PostgreSQL equivalents
+_DATETIME_OFFSET_RE = re.compile(r"datetime\('now',\s*'([+-])(\d+) (\w+)'\)", re.IGNORECASE)
+_TABLE_INFO_RE = re.compile(r"^\s*PRAGMA\s+table_info\((\w+)\)\s*$", re.IGNORECASE)
+# Column types in CREATE/ALTER TABLE. Every integer column becomes BIGINT:
+# Strava activity IDs no longer fit in 32 bits.
+_DDL_TYPES = [
+    (re.compile(r"\bINTEGER PRIMARY KEY AUTOINCREMENT\b", re.IGNORECASE), "BIGSERIAL PRIMARY KEY"),
+    (re.compile(r"\bINTEGER\b", re.IGNORECASE), "BIGINT"),
+    (re.compile(r"\bREAL\b", re.IGNORECASE), "DOUBLE PRECISION"),
+    (re.compile(r"\bBLOB\b", re.IGNORECASE), "BYTEA"),
+]
+
+
+def _convert_placeholders(sql, escape_percent):
+    """``?`` to ``%s`` outside string literals; ``%`` doubled when psycopg2 will format"""
+    out = []
+    in_string = False
+    for char in sql:
+        if char == "'":
+            in_string = not in_string
+        if char == "?" and not in_string:
+            out.append("%s")
+        elif char == "%" and escape_percent:
+            out.append("%%")
+        else:
+            out.append(char)
+    return "".join(out)
+
+
+def translate_sql(sql, has_params=True):
+    """Rewrite a statement written for SQLite so that PostgreSQL runs it"""
+    table_info = _TABLE_INFO_RE.match(sql)
+    if table_info:
+        # Same (position, name) leading columns as the PRAGMA
+        return (
+            "SELECT ordinal_position - 1 AS cid, column_name AS name FROM information_schema.columns "
+            f"WHERE table_schema = current_schema() AND table_name = '{table_info.group(1)}' "
+            "ORDER BY ordinal_position"
+        )
+
+    if re.match(r"\s*(CREATE|ALTER)\s+TABLE\b", sql, re.IGNORECASE):
+        for pattern, replacement in _DDL_TYPES:
+            sql = pattern.sub(replacement, sql)
+
+    sql = _DATETIME_OFFSET_RE.sub(
+        lambda m: f"(CURRENT_TIMESTAMP {m.group(1)} INTERVAL '{m.group(2)} {m.group(3)}')", sql
+    )
+    # psycopg2 only interprets % when it has parameters to substitute
+    return _convert_placeholders(sql, escape_percent=has_params)
+
+
+class PostgresCursor:
+    """sqlite3-style cursor over a psycopg2 cursor"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._lastrowid = None
+        self._inserted = False
+
+    def execute(self, sql, params=()):
+        params = tuple(params)
+        self._cursor.execute(translate_sql(sql, bool(params)), params or None)
+        self._lastrowid = None
+        self._inserted = sql.lstrip()[:6].upper() == "INSERT"
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(translate_sql(sql), [tuple(params) for params in seq_of_params])
+        self._lastrowid = None
+        self._inserted = False
+        return self
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        """ID generated by the last INSERT, read back on first use"""
+        if self._lastrowid is None and self._inserted:
+            # lastval() fails in a session that has not used a sequence yet;
+            # the savepoint keeps that from aborting the caller's transaction
+            self._cursor.execute("SAVEPOINT lastrowid")
+            try:
+                self._cursor.execute("SELECT lastval()")
+                self._lastrowid = self._cursor.fetchone()[0]
+                self._cursor.execute("RELEASE SAVEPOINT lastrowid")
+            except Exception:
+                self._cursor.execute("ROLLBACK TO SAVEPOINT lastrowid")
+            self._inserted = False
+        return self._lastrowid
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class PostgresConnection:
+    """sqlite3-style connection over a pooled psycopg2 connection"""
+
+    def __init__(self, raw, cursor_factory):
+        self._raw = raw
+        self._cursor_factory = cursor_factory
+
+    def cursor(self):
+        return PostgresCursor(self._raw.cursor(cursor_factory=self._cursor_factory))
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+
+class PostgresStorage:
+    """PostgreSQL database behind a pool of connections shared by this process's threads"""
+
+    # Key of the advisory lock that serialises migrations across nodes
+    MIGRATION_LOCK_ID = 7140047
+
+    def __init__(self, dsn, minconn=1, maxconn=10, acquire_timeout=30):
+        import psycopg2.extras
+        import psycopg2.pool
+
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, dsn)
+        self._cursor_factory = psycopg2.extras.DictCursor
+        # The pool raises as soon as it is exhausted; wait for a free slot instead
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self.acquire_timeout = acquire_timeout
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise RuntimeError(f"No database connection free after {self.acquire_timeout}s")
+        try:
+            raw = self._pool.getconn()
+            broken = False
+            try:
+                yield PostgresConnection(raw, self._cursor_factory)
+            finally:
+                # Like closing a sqlite3 connection: uncommitted work is
+                # dropped, and the next borrower starts outside a transaction
+                try:
+                    raw.rollback()
+                except Exception:
+                    broken = True
+                self._pool.putconn(raw, close=broken or bool(raw.closed))
+        finally:
+            self._slots.release()
+
+    def get_schema_version(self, conn):
+        if conn.execute("SELECT to_regclass('schema_version')").fetchone()[0] is None:
+            return 0
+        row = conn.execute("SELECT version FROM schema_version").fetchone()
+        return row[0] if row else 0
+
+    def set_schema_version(self, conn, version):
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        conn.execute("DELETE FROM schema_version")
+        conn.execute("INSERT INTO schema_version (version) VALUES (?)", (int(version),))
+
+    def begin_migration(self, conn):
+        # Held until the transaction commits or rolls back
+        conn.execute("SELECT pg_advisory_xact_lock(?)", (self.MIGRATION_LOCK_ID,))
+
+
+def make_storage(database_url, sqlite_path, minconn=1, maxconn=10):
+    """PostgreSQL for a postgres:// or postgresql:// URL, otherwise SQLite at ``sqlite_path``"""
+    if database_url and database_url.startswith(("postgres://", "postgresql://")):
+        return PostgresStorage(database_url, minconn=minconn, maxconn=maxconn)
+    return SQLiteStorage(sqlite_path)
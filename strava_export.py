@@ -0,0 +1,350 @@
+"""
+Streaming reader for Strava account export archives.
+
+A Strava bulk export is a zip with ``activities.csv`` and one GPX, TCX or FIT
+file (often gzipped) per activity under ``activities/``. The archive is read
+in place: the CSV is decoded row by row straight out of the zip, and activity
+files are read one chunk at a time and decoded on a process pool (or in the
+calling process). Nothing is extracted to disk.
+
+Activities are yielded as dicts shaped like Strava API activity summaries
+(``id``, ``start_date``, ``distance``, ``moving_time``, ...), so they go
+through the same formatting and import path as activities fetched from the
+API. This module has no Flask dependency so that pool workers stay light.
+"""
+
+import csv
+import gzip
+import io
+import math
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+
+EXPORT_CSV = "activities.csv"
+
+# Activity files read and decoded per round trip to the process pool; bounds
+# how many raw files are held in memory at once
+DECODE_CHUNK_SIZE = 32
+
+# Sample gaps longer than this (auto-pause) do not count as moving time
+MAX_MOVING_GAP_S = 30
+# Slower than this (m/s) counts as standing still
+MIN_MOVING_SPEED = 0.5
+
+EXPORT_DATE_FORMATS = ("%b %d, %Y, %I:%M:%S %p", "%d %b %Y, %H:%M:%S", "%Y-%m-%d %H:%M:%S")
+
+
+def _parse_number(value):
+    """Parse a CSV number written with either decimal separator; None if empty"""
+    value = (value or "").strip()
+    if not value:
+        return None
+    if "," in value and "." in value:
+        value = value.replace(",", "")
+    else:
+        value = value.replace(",", ".")
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _parse_export_date(value):
+    """Convert an export date (UTC) to the API's ISO format"""
+    value = (value or "").strip()
+    for fmt in EXPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%dT%H:%M:%SZ")
+        except ValueError:
+            continue
+    return None
+
+
+def _column_indexes(header):
+    """First and last position of every column name (the export repeats some names)"""
+    first, last = {}, {}
+    for i, name in enumerate(header):
+        first.setdefault(name, i)
+        last[name] = i
+    return first, last
+
+
+def iter_csv_activities(zf):
+    """Yield one API-shaped activity per row of activities.csv"""
+    with zf.open(EXPORT_CSV) as raw:
+        reader = csv.reader(io.TextIOWrapper(raw, encoding="utf-8-sig", newline=""))
+        header = next(reader, None)
+        if not header:
+            return
+        first, last = _column_indexes(header)
+
+        def cell(row, name, positions=first):
+            i = positions.get(name)
+            return row[i] if i is not None and i < len(row) else ""
+
+        # "Distance" appears twice in current exports: kilometres in the
+        # summary block, then metres. Older exports only have kilometres.
+        distance_in_metres = first.get("Distance") != last.get("Distance")
+
+        for row in reader:
+            activity_id = cell(row, "Activity ID").strip()
+            start_date = _parse_export_date(cell(row, "Activity Date"))
+            if not activity_id or not start_date:
+                continue
+
+            distance = _parse_number(cell(row, "Distance", last)) if distance_in_metres else None
+            if distance is None:
+                # Older exports, and rows whose metres column is empty: kilometres
+                distance_km = _parse_number(cell(row, "Distance"))
+                distance = distance_km * 1000 if distance_km is not None else None
+            moving_time = _parse_number(cell(row, "Moving Time", last)) or _parse_number(cell(row, "Elapsed Time"))
+            heart_rate = _parse_number(cell(row, "Average Heart Rate", last))
+
+            activity = {
+                "id": int(activity_id),
+                "start_date": start_date,
+                "name": cell(row, "Activity Name") or "Activity",
+                "type": cell(row, "Activity Type"),
+                "distance": distance,
+                "moving_time": int(moving_time) if moving_time is not None else None,
+                "filename": cell(row, "Filename").strip(),
+            }
+            if heart_rate is not None:
+                activity["average_heartrate"] = heart_rate
+            yield activity
+
+
+def _haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in metres"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371000 * 2 * math.asin(math.sqrt(a))
+
+
+def _local_name(tag):
+    """Tag name without its XML namespace"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _parse_xml_time(value):
+    """Timestamp of an ISO 8601 time from a GPX/TCX file"""
+    return datetime.fromisoformat(value.strip().replace("Z", "+00:00")).timestamp()
+
+
+def _points_to_streams(points):
+    """Streams (time from start, cumulative distance, ...) from decoded track points.
+
+    Each point is a dict with ``time`` and any of ``lat``/``lon``,
+    ``distance``, ``heartrate`` and ``altitude``.
+    """
+    points = [p for p in points if p.get("time") is not None]
+    if not points:
+        return None
+    start = points[0]["time"]
+    streams = {"time": [], "distance": [], "heartrate": [], "altitude": []}
+    total = 0.0
+    previous = None
+    for point in points:
+        if point.get("distance") is not None:
+            total = point["distance"]
+        elif previous is not None and point.get("lat") is not None and previous.get("lat") is not None:
+            total += _haversine_m(previous["lat"], previous["lon"], point["lat"], point["lon"])
+        if point.get("lat") is not None:
+            previous = point
+        streams["time"].append(int(round(point["time"] - start)))
+        streams["distance"].append(total)
+        streams["heartrate"].append(point.get("heartrate"))
+        streams["altitude"].append(point.get("altitude"))
+    # Drop streams the file did not record at all
+    return {name: values for name, values in streams.items() if any(v is not None for v in values)}
+
+
+def _decode_gpx(data):
+    """Track points of a GPX file"""
+    points = []
+    for _, element in ET.iterparse(io.BytesIO(data)):
+        if _local_name(element.tag) != "trkpt":
+            continue
+        point = {"lat": float(element.get("lat")), "lon": float(element.get("lon")), "time": None}
+        for child in element.iter():
+            name = _local_name(child.tag)
+            if name == "time" and child.text:
+                point["time"] = _parse_xml_time(child.text)
+            elif name == "ele" and child.text:
+                point["altitude"] = float(child.text)
+            elif name == "hr" and child.text:
+                point["heartrate"] = float(child.text)
+        points.append(point)
+        element.clear()
+    return points
+
+
+def _decode_tcx(data):
+    """Track points of a TCX file"""
+    points = []
+    for _, element in ET.iterparse(io.BytesIO(data)):
+        if _local_name(element.tag) != "Trackpoint":
+            continue
+        point = {"time": None}
+        for child in element.iter():
+            name = _local_name(child.tag)
+            if not child.text or not child.text.strip():
+                continue
+            if name == "Time":
+                point["time"] = _parse_xml_time(child.text)
+            elif name == "DistanceMeters":
+                point["distance"] = float(child.text)
+            elif name == "AltitudeMeters":
+                point["altitude"] = float(child.text)
+            elif name == "LatitudeDegrees":
+                point["lat"] = float(child.text)
+            elif name == "LongitudeDegrees":
+                point["lon"] = float(child.text)
+            elif name == "Value":
+                # The only <Value> in a trackpoint is inside <HeartRateBpm>
+                point["heartrate"] = float(child.text)
+        points.append(point)
+        element.clear()
+    return points
+
+
+def _decode_fit(data):
+    """Record messages of a FIT file; needs the optional fitdecode package"""
+    try:
+        import fitdecode
+    except ImportError:
+        return None
+    points = []
+    with fitdecode.FitReader(io.BytesIO(data)) as fit:
+        for frame in fit:
+            if not isinstance(frame, fitdecode.FitDataMessage) or frame.name != "record":
+                continue
+            timestamp = frame.get_value("timestamp", fallback=None)
+            if timestamp is None:
+                continue
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            altitude = frame.get_value("enhanced_altitude", fallback=None)
+            if altitude is None:
+                altitude = frame.get_value("altitude", fallback=None)
+            points.append({
+                "time": timestamp.timestamp(),
+                "distance": frame.get_value("distance", fallback=None),
+                "heartrate": frame.get_value("heart_rate", fallback=None),
+                "altitude": altitude,
+            })
+    return points
+
+
+def decode_activity_file(filename, data):
+    """Decode one GPX/TCX/FIT file (optionally gzipped) into streams, or None.
+
+    Runs in a pool worker, so it takes and returns plain picklable values.
+    """
+    name = filename.lower()
+    if name.endswith(".gz"):
+        data = gzip.decompress(data)
+        name = name[:-3]
+    try:
+        if name.endswith(".gpx"):
+            points = _decode_gpx(data)
+        elif name.endswith(".tcx"):
+            # Garmin TCX files sometimes start with whitespace before the XML declaration
+            points = _decode_tcx(data.lstrip())
+        elif name.endswith(".fit"):
+            points = _decode_fit(data)
+        else:
+            return None
+    except (ET.ParseError, ValueError, EOFError, OSError):
+        return None
+    return _points_to_streams(points) if points else None
+
+
+def _decode_task(task):
+    filename, data = task
+    return decode_activity_file(filename, data)
+
+
+def summarize_streams(streams):
+    """Distance, moving time and average HR from decoded streams"""
+    time = streams.get("time") or []
+    distance = streams.get("distance") or [0.0] * len(time)
+    heartrate = streams.get("heartrate") or [None] * len(time)
+    moving_time = 0
+    hr_sum = hr_time = 0.0
+    for i in range(1, len(time)):
+        dt = time[i] - time[i - 1]
+        if dt <= 0 or dt > MAX_MOVING_GAP_S or (distance[i] - distance[i - 1]) / dt < MIN_MOVING_SPEED:
+            continue
+        moving_time += dt
+        if heartrate[i] is not None:
+            hr_sum += heartrate[i] * dt
+            hr_time += dt
+    summary = {"distance": distance[-1] if distance else None, "moving_time": moving_time}
+    if hr_time:
+        summary["average_heartrate"] = hr_sum / hr_time
+    return summary
+
+
+def _needs_file(activity, with_streams):
+    """Whether the activity file has to be decoded for this activity"""
+    if not activity["filename"]:
+        return False
+    return with_streams or activity["distance"] is None or activity["moving_time"] is None
+
+
+def iter_export_activities(fileobj, with_streams=False, max_workers=None, decode_files=True, stats=None):
+    """Yield (activity, streams or None) for every activity in an export archive.
+
+    ``fileobj`` is a path or a seekable binary file. Activity files are only
+    decoded when ``with_streams`` is set or the CSV row lacks distance or
+    moving time; they are read from the zip a chunk at a time and decoded
+    on a process pool, while the CSV keeps streaming in this process. With
+    ``max_workers=0`` they are decoded in this process instead. With
+    ``decode_files=False`` only activities.csv is read, and rows that would
+    need their file are skipped and counted in ``stats["skipped"]``.
+    """
+    with zipfile.ZipFile(fileobj) as zf:
+        names = set(zf.namelist())
+        if EXPORT_CSV not in names:
+            raise ValueError(f"{EXPORT_CSV} not found in the archive; is this a Strava account export?")
+
+        rows = iter_csv_activities(zf)
+        executor = None
+        try:
+            while True:
+                chunk = list(islice(rows, DECODE_CHUNK_SIZE))
+                if not chunk:
+                    break
+                to_decode = [a for a in chunk if decode_files and _needs_file(a, with_streams) and a["filename"] in names]
+                decoded = {}
+                if to_decode:
+                    tasks = [(a["filename"], zf.read(a["filename"])) for a in to_decode]
+                    if max_workers == 0:
+                        results = map(_decode_task, tasks)
+                    else:
+                        if executor is None:
+                            executor = ProcessPoolExecutor(max_workers=max_workers)
+                        results = executor.map(_decode_task, tasks)
+                    decoded = dict(zip((a["id"] for a in to_decode), results))
+
+                for activity in chunk:
+                    streams = decoded.get(activity["id"])
+                    if streams:
+                        summary = summarize_streams(streams)
+                        for key, value in summary.items():
+                            if activity.get(key) is None and value is not None:
+                                activity[key] = value
+                    if activity["distance"] is None or activity["moving_time"] is None:
+                        # Nothing to import without both (e.g. a FIT file and no fitdecode)
+                        if stats is not None:
+                            stats["skipped"] = stats.get("skipped", 0) + 1
+                        continue
+                    activity.pop("filename")
+                    yield activity, streams if with_streams else None
+        finally:
+            if executor is not None:
+                executor.shutdown()
@@ -0,0 +1,36 @@
+import os
+import sys
+import tempfile
+import uuid
+
+# Tests import the app modules from the project root, against a scratch database
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(), "activity_tracker_test.db"))
+
+# TEST_DATABASE_URL=postgresql://... runs the whole suite against PostgreSQL,
+# in a schema created for this run and dropped at the end
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+TEST_SCHEMA = f"test_{uuid.uuid4().hex[:12]}"
+
+if TEST_DATABASE_URL:
+    separator = "&" if "?" in TEST_DATABASE_URL else "?"
+    os.environ["DATABASE_URL"] = f"{TEST_DATABASE_URL}{separator}options=-csearch_path%3D{TEST_SCHEMA}"
+
+
+def _run_in_admin_schema(sql):
+    from storage import PostgresStorage
+
+    admin = PostgresStorage(TEST_DATABASE_URL, maxconn=1)
+    with admin.connection() as conn:
+        conn.execute(sql)
+        conn.commit()
+
+
+def pytest_sessionstart(session):
+    if TEST_DATABASE_URL:
+        _run_in_admin_schema(f"CREATE SCHEMA {TEST_SCHEMA}")
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if TEST_DATABASE_URL:
+        _run_in_admin_schema(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE")
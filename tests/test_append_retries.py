@@ -0,0 +1,138 @@
+import re
+import uuid
+
+import pytest
+
+import app
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = FakeResponse(status_code)
+
+
+class FakeSheet:
+    def __init__(self, values):
+        self.values = values
+
+    def col_values(self, col):
+        return [row[col - 1] if col <= len(row) else "" for row in self.values]
+
+    def get_all_values(self, **kwargs):
+        return self.values
+
+    def row_values(self, row):
+        return self.values[row - 1]
+
+
+def _failing_call(status_code):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise FakeAPIError(status_code)
+    return fn, calls
+
+
+def test_append_is_not_retried_after_a_server_error(monkeypatch):
+    monkeypatch.setattr(app.time, "sleep", lambda seconds: None)
+    scheduler = app.SheetsScheduler(app.SHEETS_BUDGETS)
+    append_url = "https://sheets.googleapis.com/v4/spreadsheets/abc/values/Log!A1:append"
+    fn, calls = _failing_call(503)
+    with pytest.raises(FakeAPIError):
+        scheduler.call("svc", "write", fn, app.sheets_retry_statuses("post", append_url))
+    assert len(calls) == 1
+
+    fn, calls = _failing_call(503)
+    values_url = "https://sheets.googleapis.com/v4/spreadsheets/abc/values:batchUpdate"
+    with pytest.raises(FakeAPIError):
+        scheduler.call("svc", "write", fn, app.sheets_retry_statuses("post", values_url))
+    assert len(calls) == app.SHEETS_MAX_RETRIES + 1
+
+
+def test_rows_already_appended_are_found_by_id():
+    plan = {"column_indices": {"distance": 0, "strava_id": 1}, "append_after_row": 1}
+    sheet = FakeSheet([["Distance", "ID"], ["5,2", "111"], ["10", "222"]])
+    rows = [["10", "'222"], ["7,5", "'333"]]
+    assert app.find_appended_rows(sheet, plan, rows) == [(0, 3, ["10", "'222"])]
+
+
+def test_rows_already_appended_are_found_at_the_end_without_ids():
+    plan = {"column_indices": {"distance": 0, "heart_rate": 1}, "append_after_row": 2}
+    rows = [["5,2", 150], ["7,5", 142]]
+    appended = FakeSheet([["Distance", "HR"], [3.1, 130], [5.2, 150], [7.5, 142]])
+    assert app.find_appended_rows(appended, plan, rows) == [(0, 3, rows[0]), (1, 4, rows[1])]
+    not_appended = FakeSheet([["Distance", "HR"], [3.1, 130], [5.2, 150]])
+    assert app.find_appended_rows(not_appended, plan, rows) == []
+
+
+class InterruptedAppendSheet(FakeSheet):
+    """Fails the first append, after applying it or not; later appends succeed"""
+
+    id = 0
+    row_count = 1000
+    col_count = 26
+
+    def __init__(self, values, first_applied):
+        super().__init__(values)
+        self.first_applied = first_applied
+        self.appends = 0
+        self.restored = []
+
+    def append_rows(self, rows, **kwargs):
+        self.appends += 1
+        first_row = len(self.values) + 1
+        if self.appends > 1 or self.first_applied:
+            self.values.extend([str(value).lstrip("'") for value in row] for row in rows)
+        if self.appends == 1:
+            raise RuntimeError("The read operation timed out")
+        return {"updates": {"updatedRange": f"'Log'!A{first_row}:B{len(self.values)}"}}
+
+    def values_batch_get(self, ranges, params=None):
+        value_ranges = []
+        for cell_range in ranges:
+            first, last = map(int, re.findall(r"[A-Z]+(\d+)", cell_range))
+            value_ranges.append({"values": self.values[first - 1:last]})
+        return {"valueRanges": value_ranges}
+
+    def values_batch_update(self, body):
+        self.restored += [section["range"] for section in body["data"]]
+
+
+@pytest.mark.parametrize("first_applied", [True, False])
+def test_revert_after_resumed_append_keeps_the_existing_duplicate(monkeypatch, first_applied):
+    app.ensure_db_initialized()
+    with app.get_db_connection() as conn:
+        spreadsheet_id = conn.execute(
+            "INSERT INTO spreadsheets (name, sheet_id, is_default) VALUES (?, ?, 0)", ("Log", uuid.uuid4().hex)
+        ).lastrowid
+        conn.commit()
+    spreadsheet = app.get_spreadsheet(spreadsheet_id)
+    for name in ("advance_training_load", "update_activity_rollups", "write_rollup_summary"):
+        monkeypatch.setattr(app, name, lambda *args: None)
+
+    # Activity 222 is in the sheet already; append-only imports it again
+    sheet = InterruptedAppendSheet([["Date", "ID"], ["01/10/2026", "111"], ["02/10/2026", "222"]], first_applied)
+    activities = [{"date": "02/10/2026", "strava_id": "222"}, {"date": "03/10/2026", "strava_id": "333"}]
+    plan = app.build_import_plan(sheet.values[:1], {"date": "Date", "strava_id": "ID"}, activities, sheet=sheet, append_only=True)
+    plan_id = app.save_import_plan(spreadsheet, "Log", plan)
+    with pytest.raises(RuntimeError):
+        app.execute_import_plan(spreadsheet, "Log", app.get_import_plan(plan_id), sheet, sheet)
+
+    # Rows the failed attempt placed are found below the old table end; the
+    # user's own row 3 never counts as one of them
+    app.execute_import_plan(spreadsheet, "Log", app.get_import_plan(plan_id), sheet, sheet)
+    assert sheet.appends == (1 if first_applied else 2)
+    assert [row[1] for row in sheet.values[3:]] == ["222", "333"]
+
+    monkeypatch.setattr(app, "get_gspread_client", lambda: None)
+    monkeypatch.setattr(app, "open_spreadsheet", lambda client, spreadsheet: sheet)
+    app.revert_import(spreadsheet, "Log", plan_id)
+    assert sheet.restored == ["'Log'!A4:B5"]
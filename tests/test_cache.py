@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+from cache import MemoryCache, RedisCache, SQLiteCache
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return MemoryCache()
+    if request.param == "sqlite":
+        return SQLiteCache(str(tmp_path / "cache.db"))
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisCache(client=fakeredis.FakeRedis())
+
+
+def test_get_set_delete(cache):
+    assert cache.get("missing") is None
+    cache.set("key", {"a": 1}, ttl=60)
+    assert cache.get("key") == {"a": 1}
+    cache.set("key", {"a": 2}, ttl=60)
+    assert cache.get("key") == {"a": 2}
+    cache.delete("key")
+    assert cache.get("key") is None
+
+
+def test_entries_expire(cache):
+    cache.set("short", "value", ttl=0.05)
+    cache.set("long", "value", ttl=60)
+    time.sleep(0.1)
+    assert cache.get("short") is None
+    assert cache.get("long") == "value"
+
+
+def test_values_come_back_as_fresh_json_copies(cache):
+    value = {"rows": [["Дата", 5.2, None, True]], "pair": (1, 2)}
+    cache.set("key", value, ttl=60)
+    first = cache.get("key")
+    assert first == {"rows": [["Дата", 5.2, None, True]], "pair": [1, 2]}
+    first["rows"].append("changed")
+    assert cache.get("key")["rows"] == [["Дата", 5.2, None, True]]
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(maxsize=2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    cache.get("a")
+    cache.set("c", 3, ttl=60)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
@@ -0,0 +1,38 @@
+from datetime import date
+
+import pytest
+
+import app
+
+
+def test_distance_compares_at_two_decimals_even_when_written_shorter():
+    # format_activity writes 12.30 km as "12,3"
+    assert app.cells_equal("distance", 12.3, "12,3")
+    assert app.cells_equal("distance", 12.30, "12,3")
+    assert not app.cells_equal("distance", 12.34, "12,3")
+    assert not app.cells_equal("distance", 12.31, "12,3")
+
+
+def test_heart_rate_compares_to_the_beat():
+    assert app.cells_equal("heart_rate", 150, "150")
+    assert app.cells_equal("heart_rate", 150.4, 150)
+    assert not app.cells_equal("heart_rate", 151, 150)
+
+
+def test_formatted_distance_matches_its_own_sheet_value():
+    activity = app.format_activity({
+        "id": 1, "start_date": "2025-06-01T07:00:00Z", "distance": 12300, "moving_time": 3600,
+    })
+    assert activity["distance"] == "12,3"
+    assert app.cells_equal("distance", 12.3, activity["distance"])
+    assert not app.cells_equal("distance", 12.34, activity["distance"])
+
+
+def test_dates_without_a_column_format_parse_once_per_value(monkeypatch):
+    monkeypatch.setattr(app, "_parse_date", lambda value: pytest.fail("guessed through exceptions"))
+    app._guess_date_key.cache_clear()
+    column = ["01/06/2025", "2025-06-02", "01/06/2025", "not a date"] * 50
+    keys = [app.sheet_date_key(value) for value in column]
+    assert keys[:4] == [date(2025, 6, 1), date(2025, 6, 2), date(2025, 6, 1), "not a date"]
+    assert app._guess_date_key.cache_info().misses == 3
+    assert app.cells_equal("date", "2025-06-02", "02/06/2025")
@@ -0,0 +1,56 @@
+import app
+
+
+def _plan(rows):
+    return {
+        "column_indices": {"date": 0, "distance": 1},
+        "header_row": None,
+        "header_updates": [],
+        "cell_updates": [],
+        "appends": [{"row": row, "values": ["01/06/2025", "5,0"]} for row in rows],
+    }
+
+
+def test_contiguous_appended_rows_are_one_entry():
+    entries = app.plan_journal_entries(_plan([5, 6, 7, 10]))
+    assert [entry["range"] for entry in entries] == ["A5:B7", "A10:B10"]
+    assert entries[0]["old"] == [["", ""]] * 3
+    assert entries[0]["fields"] == ["date", "distance"]
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self.reads = []
+        self.writes = []
+
+    def values_batch_get(self, ranges, params=None):
+        self.reads.append(len(ranges))
+        return {"valueRanges": [{"values": [["01/06/2025", "5,0"]]} for _ in ranges]}
+
+    def values_batch_update(self, body):
+        self.writes.append(body)
+
+
+def test_revert_reads_in_bounded_batches(monkeypatch):
+    app.ensure_db_initialized()
+    # Every other row, so no two entries merge
+    plan = _plan(range(2, 2 + 2 * 250, 2))
+    # PostgreSQL enforces the plan's foreign key, so the spreadsheet has to exist
+    with app.get_db_connection() as conn:
+        spreadsheet_id = conn.execute(
+            "INSERT INTO spreadsheets (name, sheet_id, is_default) VALUES (?, ?, 0)", ("S", "abc")
+        ).lastrowid
+        conn.commit()
+    spreadsheet = app.get_spreadsheet(spreadsheet_id)
+    plan_id = app.save_import_plan(spreadsheet, "Log", dict(plan, append_only=False, structure=[], total=0,
+                                                              updated_rows=[], unchanged_rows=[], create_worksheet=False))
+    app.journal_import_plan(plan_id, plan)
+
+    fake = FakeSpreadsheet()
+    monkeypatch.setattr(app, "get_gspread_client", lambda: None)
+    monkeypatch.setattr(app, "open_spreadsheet", lambda client, spreadsheet: fake)
+    result = app.revert_import(spreadsheet, "Log", plan_id)
+
+    assert fake.reads == [100, 100, 50]
+    assert len(fake.writes) == 1
+    assert result["reverted"] == 250
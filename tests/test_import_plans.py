@@ -0,0 +1,56 @@
+import uuid
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def spreadsheet():
+    app.ensure_db_initialized()
+    with app.get_db_connection() as conn:
+        spreadsheet_id = conn.execute(
+            "INSERT INTO spreadsheets (name, sheet_id, is_default) VALUES (?, ?, 0)", ("Log", uuid.uuid4().hex)
+        ).lastrowid
+        conn.commit()
+    return app.get_spreadsheet(spreadsheet_id)
+
+
+def test_plan_always_carries_its_structure():
+    plan = app.build_import_plan([], {"date": "Date"}, [{"date": "01/10/2026"}], worksheet_name="Log")
+    assert plan["create_worksheet"]
+    assert [list(request)[0] for request in plan["structure"]] == ["addSheet", "updateCells"]
+
+
+def test_plan_without_structure_is_rejected(spreadsheet):
+    plan = app.build_import_plan([], {"date": "Date"}, [{"date": "01/10/2026"}], worksheet_name="Log")
+    del plan["structure"]
+    plan_id = app.save_import_plan(spreadsheet, "Log", plan)
+    with pytest.raises(app.SheetImportError, match="preview the activities again"):
+        app.execute_import_plan(spreadsheet, "Log", app.get_import_plan(plan_id), sheet_obj=object())
+
+
+class FakeSpreadsheet:
+    client = None
+
+    def __init__(self):
+        self.batch_updates = []
+
+    def batch_update(self, body):
+        self.batch_updates.append(body["requests"])
+        return {"replies": [{"addSheet": {"properties": body["requests"][0]["addSheet"]["properties"]}}]}
+
+    def add_worksheet(self, **kwargs):
+        pytest.fail("worksheets are created by the structure batchUpdate")
+
+
+def test_new_worksheet_is_prepared_in_one_call(spreadsheet, monkeypatch):
+    monkeypatch.setattr(app, "invalidate_sheet_cache", lambda sheet_id: None)
+    plan = app.build_import_plan([], {"date": "Date", "strava_id": "ID"}, [], worksheet_name="Log")
+    plan_id = app.save_import_plan(spreadsheet, "Log", plan)
+    sheet_obj = FakeSpreadsheet()
+    app.execute_import_plan(spreadsheet, "Log", app.get_import_plan(plan_id), sheet_obj=sheet_obj)
+
+    [requests_body] = sheet_obj.batch_updates
+    assert [list(request)[0] for request in requests_body] == ["addSheet", "updateCells", "updateDimensionProperties"]
+    assert app.get_import_plan(plan_id)["status"] == "completed"
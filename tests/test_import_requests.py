@@ -0,0 +1,102 @@
+import uuid
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def key():
+    app.ensure_db_initialized()
+    return uuid.uuid4().hex
+
+
+@pytest.fixture
+def spreadsheet():
+    app.ensure_db_initialized()
+    with app.get_db_connection() as conn:
+        spreadsheet_id = conn.execute(
+            "INSERT INTO spreadsheets (name, sheet_id, is_default) VALUES (?, ?, 0)", ("Log", uuid.uuid4().hex)
+        ).lastrowid
+        conn.commit()
+    return app.get_spreadsheet(spreadsheet_id)
+
+
+def saved_plan(spreadsheet):
+    plan = app.build_import_plan([["Date"]], {"date": "Date"}, [{"date": "2026-10-01"}], append_only=True)
+    return app.save_import_plan(spreadsheet, "Sheet1", plan)
+
+
+def test_failure_before_writing_releases_the_key(key):
+    def invalid_mapping():
+        raise app.SheetImportError("Map at least one field")
+
+    with pytest.raises(app.SheetImportError):
+        app.run_idempotent_import(key, invalid_mapping)
+    assert app.run_idempotent_import(key, lambda: {"message": "ok"}) == {"message": "ok"}
+
+
+def test_failure_while_writing_resumes_the_plan(key, spreadsheet, monkeypatch):
+    plan_id = saved_plan(spreadsheet)
+    calls = []
+
+    def interrupted():
+        calls.append("import")
+        raise app.SheetWriteError("503 from Sheets", plan_id)
+
+    def resume(resumed_plan_id):
+        calls.append(("resume", resumed_plan_id))
+        return {"message": "resumed"}
+
+    monkeypatch.setattr(app, "resume_import_plan", resume)
+    with pytest.raises(app.SheetWriteError):
+        app.run_idempotent_import(key, interrupted)
+    assert app.get_import_request(key)[0] == "interrupted"
+
+    # The repeat must not plan and append the activities again
+    assert app.run_idempotent_import(key, interrupted) == {"message": "resumed"}
+    assert calls == ["import", ("resume", plan_id)]
+    assert app.run_idempotent_import(key, interrupted) == {"message": "resumed", "replayed": True}
+
+
+def test_resume_executes_the_stored_plan(key, spreadsheet, monkeypatch):
+    executed = []
+
+    def interrupted_after_planning():
+        plan_id = saved_plan(spreadsheet)
+        raise app.SheetWriteError("503 from Sheets", plan_id)
+
+    def execute(spreadsheet, worksheet_name, record, sheet_obj=None, sheet=None, lease=None):
+        executed.append(record["id"])
+        return {"message": "resumed", "plan_id": record["id"]}
+
+    with pytest.raises(app.SheetWriteError) as interrupted:
+        app.run_idempotent_import(key, interrupted_after_planning)
+    plan_id = interrupted.value.plan_id
+    assert app.get_import_request_plan(key) == plan_id
+
+    monkeypatch.setattr(app, "execute_import_plan", execute)
+    result = app.run_idempotent_import(key, interrupted_after_planning)
+    # Only the plan stored by the first run is written; no second plan is made
+    assert executed == [plan_id]
+    assert result["plan_id"] == plan_id
+    with app.get_db_connection() as conn:
+        plans = conn.execute("SELECT COUNT(*) FROM import_plans WHERE spreadsheet_id = ?", (spreadsheet["id"],)).fetchone()[0]
+    assert plans == 1
+
+
+def test_failed_resume_keeps_the_key_on_the_plan(key, spreadsheet, monkeypatch):
+    plan_id = saved_plan(spreadsheet)
+
+    def interrupted():
+        raise app.SheetWriteError("timeout", plan_id)
+
+    def resume(resumed_plan_id):
+        raise RuntimeError("still down")
+
+    monkeypatch.setattr(app, "resume_import_plan", resume)
+    with pytest.raises(app.SheetWriteError):
+        app.run_idempotent_import(key, interrupted)
+    with pytest.raises(RuntimeError):
+        app.run_idempotent_import(key, lambda: {"message": "planned again"})
+    assert app.get_import_request_plan(key) == plan_id
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+import app
+from storage import SQLiteStorage
+
+
+def test_failed_migration_surfaces_and_is_retried(monkeypatch, tmp_path):
+    monkeypatch.setitem(app._storage_by_pid, os.getpid(), SQLiteStorage(str(tmp_path / "migrate.db")))
+    monkeypatch.setattr(app, "_db_initialized", False)
+
+    def broken(cursor):
+        raise RuntimeError("disk full")
+
+    migrations = list(app.MIGRATIONS)
+    monkeypatch.setattr(app, "MIGRATIONS", migrations[:-1] + [broken])
+    with pytest.raises(RuntimeError):
+        app.ensure_db_initialized()
+    assert not app._db_initialized
+    with app.get_db_connection() as conn:
+        assert app.get_schema_version(conn) == len(migrations) - 1
+
+    monkeypatch.setattr(app, "MIGRATIONS", migrations)
+    app.ensure_db_initialized()
+    assert app._db_initialized
+    with app.get_db_connection() as conn:
+        assert app.get_schema_version(conn) == app.SCHEMA_VERSION
+
+
+def test_health_reports_a_failed_migration(monkeypatch, tmp_path):
+    monkeypatch.setitem(app._storage_by_pid, os.getpid(), SQLiteStorage(str(tmp_path / "health.db")))
+    monkeypatch.setattr(app, "_db_initialized", False)
+
+    def broken(cursor):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(app, "MIGRATIONS", list(app.MIGRATIONS)[:-1] + [broken])
+    response = app.app.test_client().get("/health")
+    assert response.status_code == 503
+    body = response.get_json()
+    assert body["status"] == "unhealthy"
+    assert "disk full" in body["database"]
+    assert set(body["upstreams"]) == {app.google_breaker.name, app.strava_breaker.name}
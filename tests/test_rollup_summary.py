@@ -0,0 +1,92 @@
+import uuid
+
+import pytest
+
+import app
+
+
+class FakeWorksheet:
+    def __init__(self, sheet_id):
+        self.id = sheet_id
+
+
+class FakeSpreadsheet:
+    id = "sheet-key"
+
+    def __init__(self, sheet_ids=()):
+        self.requests = []
+        self.sheet_ids = list(sheet_ids)
+        self.error = None
+
+    def batch_update(self, body):
+        if self.error:
+            raise self.error
+        self.requests.append(body["requests"])
+
+    def worksheets(self):
+        return [FakeWorksheet(sheet_id) for sheet_id in self.sheet_ids]
+
+
+@pytest.fixture
+def spreadsheet_id(monkeypatch):
+    app.ensure_db_initialized()
+    with app.get_db_connection() as conn:
+        spreadsheet_id = conn.execute(
+            "INSERT INTO spreadsheets (name, sheet_id, is_default) VALUES (?, ?, 0)", ("Log", uuid.uuid4().hex)
+        ).lastrowid
+        conn.commit()
+    monkeypatch.setattr(app, "get_activity_rollups", lambda spreadsheet_id, period: [{
+        "start": "28/09/2026", "count": 2, "distance": "12,5", "duration": "01:05:00", "pace": "05:12", "heart_rate": 148,
+    }])
+    monkeypatch.setattr(app, "invalidate_sheet_cache", lambda sheet_id: None)
+    return spreadsheet_id
+
+
+def test_summary_is_created_and_filled_in_one_call(spreadsheet_id, monkeypatch):
+    monkeypatch.setattr(app, "fetch_worksheet_names", lambda sheet_id: ["Log"])
+    sheet_obj = FakeSpreadsheet()
+    app.write_rollup_summary(sheet_obj, spreadsheet_id)
+
+    [requests_body] = sheet_obj.requests
+    assert list(requests_body[0]) == ["addSheet"]
+    assert requests_body[0]["addSheet"]["properties"]["title"] == app.ROLLUP_WORKSHEET
+    sheet_id = requests_body[0]["addSheet"]["properties"]["sheetId"]
+    assert app.get_rollup_sheet_id(spreadsheet_id) == sheet_id
+
+    weekly = requests_body[1]["updateCells"]
+    assert weekly["start"] == {"sheetId": sheet_id, "rowIndex": 0, "columnIndex": 0}
+    assert weekly["rows"][2]["values"][:3] == [
+        {"userEnteredValue": {"stringValue": "28/09/2026"}},
+        {"userEnteredValue": {"numberValue": 2}},
+        {"userEnteredValue": {"numberValue": 12.5}},
+    ]
+    assert requests_body[2]["updateCells"]["start"]["columnIndex"] == 7
+
+
+def test_own_summary_is_cleared_and_refilled_in_one_call(spreadsheet_id, monkeypatch):
+    app.set_rollup_sheet_id(spreadsheet_id, 1234)
+    monkeypatch.setattr(app, "fetch_worksheet_names", lambda sheet_id: pytest.fail("no worksheet list needed"))
+    sheet_obj = FakeSpreadsheet()
+    app.write_rollup_summary(sheet_obj, spreadsheet_id)
+
+    [requests_body] = sheet_obj.requests
+    assert [list(request)[0] for request in requests_body] == [
+        "updateSheetProperties", "updateCells", "updateCells", "updateCells",
+    ]
+    assert requests_body[1]["updateCells"] == {"range": {"sheetId": 1234}, "fields": "userEnteredValue"}
+
+
+def test_tab_with_the_same_name_is_left_alone(spreadsheet_id, monkeypatch):
+    monkeypatch.setattr(app, "fetch_worksheet_names", lambda sheet_id: ["Log", app.ROLLUP_WORKSHEET])
+    sheet_obj = FakeSpreadsheet()
+    app.write_rollup_summary(sheet_obj, spreadsheet_id)
+    assert sheet_obj.requests == []
+    assert app.get_rollup_sheet_id(spreadsheet_id) is None
+
+
+def test_deleted_summary_is_forgotten(spreadsheet_id):
+    app.set_rollup_sheet_id(spreadsheet_id, 1234)
+    sheet_obj = FakeSpreadsheet(sheet_ids=[0])
+    sheet_obj.error = RuntimeError("No grid with id: 1234")
+    app.write_rollup_summary(sheet_obj, spreadsheet_id)
+    assert app.get_rollup_sheet_id(spreadsheet_id) is None
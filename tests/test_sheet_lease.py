@@ -0,0 +1,101 @@
+import json
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+
+def _queue_running(sheet_key, owner, heartbeat_at):
+    with app.get_db_connection() as conn:
+        conn.execute(
+            """INSERT INTO sheet_write_queue (sheet_key, spreadsheet_id, worksheet_name, payload, status, owner, heartbeat_at)
+               VALUES (?, 1, 'Log', ?, 'running', ?, ?)""",
+            (sheet_key, json.dumps({"field_mappings": {}, "activities": []}), owner, heartbeat_at)
+        )
+        conn.commit()
+
+
+def _statuses(sheet_key):
+    with app.get_db_connection() as conn:
+        rows = conn.execute(
+            "SELECT owner, status FROM sheet_write_queue WHERE sheet_key = ? ORDER BY id", (sheet_key,)
+        ).fetchall()
+    return [(row["owner"], row["status"]) for row in rows]
+
+
+def test_live_holder_entries_are_not_reclaimed():
+    app.ensure_db_initialized()
+    _queue_running("live-key", "other", time.time())
+    app.process_sheet_write_queue("live-key", "me", "Log")
+    assert _statuses("live-key") == [("other", "running")]
+
+
+def test_entries_of_a_silent_holder_are_reclaimed():
+    app.ensure_db_initialized()
+    _queue_running("stale-key", "other", time.time() - app.SHEET_LOCK_LEASE_SECONDS - 1)
+    app.process_sheet_write_queue("stale-key", "me", "Log")
+    # Spreadsheet 1 does not exist, so the reclaimed entry fails under the new owner
+    assert _statuses("stale-key") == [("me", "failed")]
+
+
+def test_lease_taken_over_is_reported_lost():
+    app.ensure_db_initialized()
+    assert app.acquire_sheet_lock("lease-key", "first")
+    with app.get_db_connection() as conn:
+        conn.execute("UPDATE sheet_write_locks SET expires_at = 0 WHERE sheet_key = 'lease-key'")
+        conn.commit()
+    assert app.acquire_sheet_lock("lease-key", "second")
+    lease = app.SheetLease("lease-key", "first")
+    lease.beat()
+    assert lease.lost
+
+
+def _spreadsheet():
+    with app.get_db_connection() as conn:
+        spreadsheet_id = conn.execute(
+            "INSERT INTO spreadsheets (name, sheet_id, is_default) VALUES (?, ?, 0)", ("Log", uuid.uuid4().hex)
+        ).lastrowid
+        conn.commit()
+    return app.get_spreadsheet(spreadsheet_id)
+
+
+def test_busy_worksheet_queues_without_waiting(monkeypatch):
+    app.ensure_db_initialized()
+    spreadsheet = _spreadsheet()
+    written = []
+
+    def plan_sheet_import(spreadsheet, worksheet_name, field_mappings, activities, append_only=False):
+        sheet = SimpleNamespace(id=0, row_count=100, col_count=1)
+        return app.build_import_plan([["Date"]], field_mappings, activities, sheet=sheet, append_only=True), None, sheet
+
+    def execute_import_plan(spreadsheet, worksheet_name, record, sheet_obj=None, sheet=None, lease=None):
+        written.append(len(record["plan"]["appends"]))
+        return {"message": "imported", "plan_id": record["id"]}
+
+    monkeypatch.setattr(app, "plan_sheet_import", plan_sheet_import)
+    monkeypatch.setattr(app, "execute_import_plan", execute_import_plan)
+    monkeypatch.setattr(app.time, "sleep", lambda seconds: pytest.fail("request thread waited for the queue"))
+    sheet_key = app._sheet_key(spreadsheet, "Log")
+    key = uuid.uuid4().hex
+
+    def confirm():
+        return app.import_preview(key, spreadsheet, "Log", {"date": "Date"}, [{"date": "01/10/2026"}])
+
+    # Another worker is writing the worksheet
+    assert app.acquire_sheet_lock(sheet_key, "other")
+    with pytest.raises(app.SheetImportQueued):
+        confirm()
+    assert app.get_import_request(key)[0] == "queued"
+    with pytest.raises(app.SheetImportQueued):
+        confirm()
+    assert written == []
+
+    # Once the lease is free, the next poll writes the queue and collects the outcome
+    app.release_sheet_lock(sheet_key, "other")
+    status, result = app.settle_queued_import(key, app.get_import_request(key)[1])
+    assert (status, result["message"]) == ("done", "imported")
+    assert written == [1]
+    assert confirm() == dict(result, replayed=True)
@@ -0,0 +1,45 @@
+import json
+
+import app
+
+
+def test_manifest_icons_point_at_fingerprinted_files():
+    manifest = app.build_asset_manifest(app.app.static_folder, app.app.static_url_path)
+    web_manifest = json.loads(manifest["by_source"]["manifest.json"]["encodings"]["identity"])
+    icon = manifest["by_source"]["android-icon-36x36.png"]
+    assert web_manifest["icons"][0]["src"] == "/static/" + icon["hashed"]
+
+    browserconfig = manifest["by_source"]["browserconfig.xml"]["encodings"]["identity"].decode()
+    assert "/static/" + manifest["by_source"]["ms-icon-70x70.png"]["hashed"] in browserconfig
+
+
+def test_fingerprinted_manifest_is_served():
+    manifest = app.get_asset_manifest()
+    hashed = manifest["by_source"]["manifest.json"]["hashed"]
+    response = app.app.test_client().get(f"/static/{hashed}")
+    assert response.status_code == 200
+    assert manifest["by_source"]["android-icon-192x192.png"]["hashed"] in response.get_data(as_text=True)
+
+
+def test_debug_rebuilds_only_when_files_change(monkeypatch, tmp_path):
+    (tmp_path / "style.css").write_text("body {}")
+    builds = []
+    real_build = app.build_asset_manifest
+
+    def build(static_folder, static_url_path="/static"):
+        builds.append(static_folder)
+        return real_build(static_folder, static_url_path)
+
+    monkeypatch.setattr(app, "build_asset_manifest", build)
+    monkeypatch.setattr(app.app, "static_folder", str(tmp_path))
+    monkeypatch.setattr(app.app, "debug", True)
+    monkeypatch.setattr(app, "_asset_manifest", None)
+    monkeypatch.setattr(app, "_asset_manifest_signature", None)
+
+    first = app.get_asset_manifest()
+    assert app.get_asset_manifest() is first
+    assert len(builds) == 1
+
+    (tmp_path / "style.css").write_text("body { color: red }")
+    assert app.get_asset_manifest()["by_source"]["style.css"]["hashed"] != first["by_source"]["style.css"]["hashed"]
+    assert len(builds) == 2
@@ -0,0 +1,136 @@
+import os
+import uuid
+
+import pytest
+
+import app
+from storage import PostgresStorage, SQLiteStorage, translate_sql
+
+
+def test_placeholders_outside_string_literals():
+    assert translate_sql("SELECT * FROM t WHERE a = ? AND b = '?'") == "SELECT * FROM t WHERE a = %s AND b = '?'"
+
+
+def test_percent_escaped_only_with_parameters():
+    assert translate_sql("SELECT * FROM t WHERE a LIKE 'x%' AND b = ?") == "SELECT * FROM t WHERE a LIKE 'x%%' AND b = %s"
+    assert translate_sql("SELECT * FROM t WHERE a LIKE 'x%'", has_params=False) == "SELECT * FROM t WHERE a LIKE 'x%'"
+
+
+def test_ddl_column_types():
+    sql = translate_sql(
+        "CREATE TABLE IF NOT EXISTS t (id INTEGER PRIMARY KEY AUTOINCREMENT, n INTEGER, x REAL, data BLOB)",
+        has_params=False
+    )
+    assert sql == "CREATE TABLE IF NOT EXISTS t (id BIGSERIAL PRIMARY KEY, n BIGINT, x DOUBLE PRECISION, data BYTEA)"
+    assert translate_sql("ALTER TABLE t ADD COLUMN heartbeat_at REAL", has_params=False) == (
+        "ALTER TABLE t ADD COLUMN heartbeat_at DOUBLE PRECISION"
+    )
+
+
+def test_ddl_types_untouched_outside_ddl():
+    assert translate_sql("SELECT 'INTEGER' AS kind FROM t WHERE id = ?") == "SELECT 'INTEGER' AS kind FROM t WHERE id = %s"
+
+
+def test_datetime_offsets():
+    assert translate_sql("DELETE FROM t WHERE created_at < datetime('now', '-1 day')", has_params=False) == (
+        "DELETE FROM t WHERE created_at < (CURRENT_TIMESTAMP - INTERVAL '1 day')"
+    )
+    assert translate_sql("SELECT datetime('now', '+30 minutes')", has_params=False) == (
+        "SELECT (CURRENT_TIMESTAMP + INTERVAL '30 minutes')"
+    )
+
+
+def test_pragma_table_info():
+    sql = translate_sql("PRAGMA table_info(spreadsheets)", has_params=False)
+    assert "information_schema.columns" in sql
+    assert "table_name = 'spreadsheets'" in sql
+    assert sql.startswith("SELECT ordinal_position - 1 AS cid, column_name AS name")
+
+
+# The persistence functions run against each backend. PostgreSQL needs a
+# server: set TEST_DATABASE_URL to a database the tests may create schemas in
+@pytest.fixture
+def postgres(monkeypatch):
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    pytest.importorskip("psycopg2")
+
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin = PostgresStorage(url, maxconn=1)
+    with admin.connection() as conn:
+        conn.execute(f"CREATE SCHEMA {schema}")
+        conn.commit()
+    separator = "&" if "?" in url else "?"
+    storage = PostgresStorage(f"{url}{separator}options=-csearch_path%3D{schema}", maxconn=4)
+    monkeypatch.setitem(app._storage_by_pid, os.getpid(), storage)
+    monkeypatch.setattr(app, "_db_initialized", False)
+    try:
+        yield storage
+    finally:
+        with admin.connection() as conn:
+            conn.execute(f"DROP SCHEMA {schema} CASCADE")
+            conn.commit()
+
+
+@pytest.fixture
+def sqlite(monkeypatch, tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "storage.db"))
+    monkeypatch.setitem(app._storage_by_pid, os.getpid(), storage)
+    monkeypatch.setattr(app, "_db_initialized", False)
+    return storage
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def storage(request):
+    return request.getfixturevalue(request.param)
+
+
+def test_migrations(storage):
+    app.ensure_db_initialized()
+    with app.get_db_connection() as conn:
+        assert app.get_schema_version(conn) == app.SCHEMA_VERSION
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(spreadsheets)").fetchall()]
+    assert "default_worksheet" in columns
+    # A second run finds the schema current and changes nothing
+    app.migrate_db()
+
+
+def test_persistence(storage):
+    app.ensure_db_initialized()
+
+    app.store_token_with_session_id("s1", {"access_token": "a"})
+    app.store_token_with_session_id("s1", {"access_token": "b"})
+    assert app.get_token_from_session_id("s1") == {"access_token": "b"}
+
+    with app.get_db_connection() as conn:
+        cursor = conn.execute("INSERT INTO spreadsheets (name, sheet_id, is_default) VALUES (?, ?, 1)", ("Log", "abc"))
+        spreadsheet_id = cursor.lastrowid
+        conn.commit()
+    spreadsheet = app.get_spreadsheet(spreadsheet_id)
+    assert spreadsheet["name"] == "Log"
+
+    # Strava IDs no longer fit in 32 bits
+    big_id = 2 ** 33 + 7
+    app.store_activity_summaries([{"id": big_id, "start_date": "2026-10-01T07:00:00Z", "distance": 5000.0}])
+    app.store_activity_streams(big_id, {"heartrate": [120, 130, 140]})
+    assert app.get_activity_ids_with_streams([big_id, 1]) == {big_id}
+    assert list(app.load_activity_streams(big_id)["heartrate"]) == [120, 130, 140]
+
+    contribution = {
+        "activity_id": str(big_id), "activity_date": "2026-10-01",
+        "distance_m": 5000.0, "moving_time_s": 1500, "heart_rate": 150.0,
+    }
+    app.update_activity_rollups(spreadsheet_id, [contribution])
+    app.update_activity_rollups(spreadsheet_id, [contribution])
+    assert app.get_activity_rollups(spreadsheet_id, "week")[0]["count"] == 1
+
+    plan = app.build_import_plan([["Date"]], {"date": "Date"}, [], append_only=True)
+    plan_id = app.save_import_plan(spreadsheet, "Log", plan)
+    app.update_import_plan_progress(plan_id, "running", 1)
+    assert app.get_import_plan(plan_id)["completed_batches"] == 1
+
+    assert app.acquire_sheet_lock("key", "first")
+    assert not app.acquire_sheet_lock("key", "second")
+    assert app.claim_import_request("import-key", "first") is None
+    assert app.claim_import_request("import-key", "second") == ("running", None)
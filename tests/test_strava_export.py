@@ -0,0 +1,77 @@
+import io
+import zipfile
+
+import pytest
+
+from strava_export import iter_csv_activities, iter_export_activities
+
+CURRENT_HEADER = "Activity ID,Activity Date,Activity Name,Activity Type,Elapsed Time,Distance,Filename,Moving Time,Distance,Average Heart Rate"
+OLD_HEADER = "Activity ID,Activity Date,Activity Name,Activity Type,Elapsed Time,Distance,Filename"
+
+
+def _export(csv_text):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr("activities.csv", csv_text)
+    buffer.seek(0)
+    return buffer
+
+
+def _distances(csv_text):
+    with zipfile.ZipFile(_export(csv_text)) as zf:
+        return [activity["distance"] for activity in iter_csv_activities(zf)]
+
+
+def test_distance_from_the_metres_column():
+    csv_text = CURRENT_HEADER + '\n1,"Jun 1, 2025, 7:00:00 AM",Run,Run,1600,"5.02",,1500,5021.4,150\n'
+    assert _distances(csv_text) == [5021.4]
+
+
+def test_empty_metres_column_falls_back_to_kilometres():
+    csv_text = CURRENT_HEADER + '\n1,"Jun 1, 2025, 7:00:00 AM",Run,Run,1600,"5.0",activities/1.gpx,1500,,150\n'
+    assert _distances(csv_text) == [5000.0]
+
+
+def test_older_exports_in_kilometres():
+    csv_text = OLD_HEADER + '\n1,"Jun 1, 2025, 7:00:00 AM",Run,Run,1600,"5,0",\n'
+    assert _distances(csv_text) == [5000.0]
+
+
+def test_rows_are_imported_without_decoding_files():
+    csv_text = CURRENT_HEADER + '\n1,"Jun 1, 2025, 7:00:00 AM",Run,Run,1600,"5.0",activities/1.gpx,1500,,150\n'
+    activities = list(iter_export_activities(_export(csv_text)))
+    assert [(a["id"], a["distance"], a["moving_time"], s) for a, s in activities] == [(1, 5000.0, 1500, None)]
+
+
+def test_csv_only_reading_skips_rows_that_need_their_file(monkeypatch):
+    import strava_export
+
+    monkeypatch.setattr(strava_export, "_decode_task", lambda task: pytest.fail("decoded an activity file"))
+    csv_text = CURRENT_HEADER + (
+        '\n1,"Jun 1, 2025, 7:00:00 AM",Run,Run,1600,"5.0",activities/1.gpx,1500,5000,150'
+        '\n2,"Jun 2, 2025, 7:00:00 AM",Run,Run,1600,,activities/2.gpx,1500,,\n'
+    )
+    stats = {}
+    activities = list(iter_export_activities(_export(csv_text), max_workers=0, decode_files=False, stats=stats))
+    assert [a["id"] for a, _ in activities] == [1]
+    assert stats == {"skipped": 1}
+
+
+def test_export_is_imported_in_bounded_batches(monkeypatch):
+    import app
+
+    app.ensure_db_initialized()
+    batches = []
+
+    def run_sheet_import(spreadsheet, worksheet_name, field_mappings, formatted_activities, append_only=False, wait=True):
+        batches.append(len(formatted_activities))
+        return {"added": len(formatted_activities), "updated": 0, "unchanged": 0, "warnings": [], "message": "ok"}
+
+    monkeypatch.setattr(app, "run_sheet_import", run_sheet_import)
+    rows = "".join(
+        f'{i},"Jun {i}, 2025, 7:00:00 AM",Run,Run,1600,"5.0",,1500,5000,150\n' for i in range(1, 6)
+    )
+    spreadsheet = {"id": 1, "name": "Log"}
+    result = app.import_strava_export(_export(CURRENT_HEADER + "\n" + rows), spreadsheet, "Runs", {"date": "Date"}, batch_size=2)
+    assert batches == [2, 2, 1]
+    assert (result["parsed"], result["added"], result["imports"]) == (5, 5, 3)
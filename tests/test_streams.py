@@ -0,0 +1,36 @@
+import math
+import zlib
+
+import numpy as np
+
+import analytics
+import app
+
+
+def test_samples_are_four_bytes_wide():
+    blob = app.encode_stream([1, 2, 3], "i")
+    assert len(zlib.decompress(blob)) == 12
+    assert list(app.decode_stream(blob, "i")) == [1, 2, 3]
+    assert app.decode_stream(blob, "i", as_numpy=True).tolist() == [1, 2, 3]
+
+
+def test_missing_samples_stay_distinguishable_from_zero():
+    decoded = app.decode_stream(app.encode_stream([120, None, 0], "f"), "f")
+    assert decoded[0] == 120 and math.isnan(decoded[1]) and decoded[2] == 0
+
+
+def test_integer_stream_with_gaps_is_stored_as_float():
+    app.ensure_db_initialized()
+    app.store_activity_streams(987654321, {"time": [0, None, 2], "heartrate": [150, None, 152]})
+    streams = app.load_activity_streams(987654321, as_numpy=True)
+    assert np.isnan(streams["time"][1]) and np.isnan(streams["heartrate"][1])
+
+
+def test_hr_zone_time_skips_missing_samples():
+    max_hr = 200
+    streams = {
+        "time": np.array([0, 1, 2, 3], dtype="<i4"),
+        # A gap would otherwise land in the top zone
+        "heartrate": np.array([100, np.nan, np.nan, 100], dtype="<f4"),
+    }
+    assert analytics.batch_hr_zone_time([streams], max_hr) == [[1.0, 0.0, 0.0, 0.0, 0.0]]
@@ -0,0 +1,62 @@
+import uuid
+
+import pytest
+
+import app
+
+
+def _spreadsheet(name, worksheet):
+    with app.get_db_connection() as conn:
+        spreadsheet_id = conn.execute(
+            "INSERT INTO spreadsheets (name, sheet_id, is_default) VALUES (?, ?, 0)", (name, uuid.uuid4().hex)
+        ).lastrowid
+        conn.commit()
+    app.save_header_mappings(spreadsheet_id, worksheet, {"date": "Date"})
+    return spreadsheet_id
+
+
+@pytest.fixture
+def synced(monkeypatch):
+    app.ensure_db_initialized()
+    logins = [
+        ("session-a", {"athlete": {"id": 111}, "expires_at": 4102444800}),
+        ("session-b", {"athlete": {"id": 222}, "expires_at": 4102444800}),
+    ]
+    monkeypatch.setattr(app, "get_stored_logins", lambda: logins)
+    written = []
+
+    def stream_activities_to_sheet(token, spreadsheet, worksheet_name, field_mappings, after=None):
+        written.append((token["athlete"]["id"], spreadsheet["id"], worksheet_name))
+        return {"activities": 0, "seconds": 0, "added": 0, "updated": 0, "unchanged": 0,
+                "strava_requests": 1, "imports": 0, "throttled_seconds": 0.0}
+
+    monkeypatch.setattr(app, "stream_activities_to_sheet", stream_activities_to_sheet)
+    return written
+
+
+def _sync(*args):
+    return app.app.test_cli_runner().invoke(args=["sync", *args])
+
+
+def test_all_users_write_into_their_own_worksheets(synced):
+    first = _spreadsheet(f"A {uuid.uuid4().hex}", "Runs")
+    second = _spreadsheet(f"B {uuid.uuid4().hex}", "Rides")
+    result = _sync("--all-users", "--target", "111", str(first), "Runs", "--target", "222", str(second), "Rides")
+    assert result.exit_code == 0, result.output
+    assert synced == [(111, first, "Runs"), (222, second, "Rides")]
+
+
+def test_all_users_without_a_target_for_everyone_is_refused(synced):
+    first = _spreadsheet(f"A {uuid.uuid4().hex}", "Runs")
+    result = _sync("--all-users", "--target", "111", str(first), "Runs")
+    assert result.exit_code != 0
+    assert "No --target for athlete(s) 222" in result.output
+    assert synced == []
+
+
+def test_all_users_into_one_sheet_is_refused(synced):
+    first = _spreadsheet(f"A {uuid.uuid4().hex}", "Runs")
+    result = _sync("--all-users", "--sheet", str(first), "--worksheet", "Runs")
+    assert result.exit_code != 0
+    assert "same worksheet" in result.output
+    assert synced == []
@@ -18,13 +18,9 @@ if project_home not in sys.path:
 # Set environment variables (you can also use a .env file)
 os.environ['FLASK_ENV'] = 'production'
 
-# Import your Flask application
+# Import your Flask application. The database is initialised (and any pending
+# migrations applied) once per worker, on the first request it serves.
 from app import app as application
 
-# Initialize the database on startup
-from app import init_db, migrate_db
-init_db()
-migrate_db()
-
 if __name__ == "__main__":
     application.run() 
\ No newline at end of file